@@ -0,0 +1 @@
+# Benchmarks of the synthesiser, run them with "python -m benchmarks" from the top of the repo
@@ -0,0 +1,55 @@
+# Benchmark of the overhead of the audio objects on every utterance: making an Audio object,
+# and synthesising a short utterance with Synth.get_output_audio_of_diphone_seq.
+# Run it against two checkouts to compare them (the voice and the diphones are the same for both):
+#
+#   python benchmarks/bench_audio_overhead.py --diphones ./diphones
+#   python benchmarks/bench_audio_overhead.py --diphones ./diphones --repo ../old_checkout
+import argparse
+import os
+import sys
+from time import perf_counter
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# the seconds per call of func, over repeat calls
+def time_per_call(func, repeat):
+    start_time = perf_counter()
+    for _ in range(repeat):
+        func()
+    return (perf_counter() - start_time) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the per-utterance overhead of the audio objects.')
+    parser.add_argument('--repo', default=REPO_DIR, help="The checkout to benchmark")
+    parser.add_argument('--diphones', default=os.path.join(REPO_DIR, 'diphones'),
+                        help="Folder containing diphone wavs")
+    parser.add_argument('--repeat', type=int, default=2000, help="How many times every call is timed")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.abspath(args.repo))
+    start_time = perf_counter()
+    import synth
+    import_time = perf_counter() - start_time
+    import simpleaudio
+
+    synth_args = argparse.Namespace(diphones=args.diphones, crossfade=False, reverse=None, word_cache=None)
+    diphone_synth = synth.Synth(synth_args)
+    # a short utterance made of the first diphones of the voice
+    names = sorted(name for name in os.listdir(args.diphones) if name.endswith('.wav'))
+    diphone_seq = [name[:-4] for name in names[:12]]
+
+    results = {
+        'import synth (ms)': import_time * 1e3,
+        'pyaudio imported by synth': 'pyaudio' in sys.modules,
+        'Audio() (us)': time_per_call(simpleaudio.Audio, args.repeat) * 1e6,
+        'utterance (us)': time_per_call(lambda: diphone_synth.get_output_audio_of_diphone_seq(diphone_seq),
+                                        args.repeat) * 1e6,
+    }
+    for name, value in results.items():
+        print('{:<28} {}'.format(name, '{:.1f}'.format(value) if isinstance(value, float) else value))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# Benchmark of the warm daemon ("main.py --serve") against a new process for every phrase:
+# the time to the first audio and to all of it for a short prompt, both from a running client (in process)
+# and from a new client.py process, as a shell script would call it.
+#
+#   python benchmarks/bench_daemon.py --diphones ./diphones --repeat 50
+import argparse
+import io
+import os
+import subprocess
+import sys
+import tempfile
+from time import perf_counter, sleep
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROMPT = 'Please hold, your call is important to us.'
+
+
+# the median and the 95th percentile of the times, in ms
+def describe(times):
+    return '{:8.1f} {:8.1f}'.format(np.percentile(times, 50) * 1e3, np.percentile(times, 95) * 1e3)
+
+
+# the seconds a new process of the command takes
+def time_process(command, repeat):
+    times = []
+    for _ in range(repeat):
+        start_time = perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(perf_counter() - start_time)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the warm daemon against a new process per phrase.')
+    parser.add_argument('--diphones', default=os.path.join(REPO_DIR, 'diphones'),
+                        help="Folder containing diphone wavs, or a packed voice file")
+    parser.add_argument('--repeat', type=int, default=20, help="How many times every way is timed")
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_DIR)
+    from client import synthesise_remote
+
+    main_py = os.path.join(REPO_DIR, 'main.py')
+    client_py = os.path.join(REPO_DIR, 'client.py')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        socket_path = os.path.join(tmp_dir, 'synth.sock')
+        wav_path = os.path.join(tmp_dir, 'prompt.wav')
+        cold = time_process([sys.executable, main_py, '--diphones', args.diphones, '-o', wav_path, PROMPT],
+                            max(1, args.repeat // 4))
+
+        start_time = perf_counter()
+        daemon = subprocess.Popen([sys.executable, main_py, '--diphones', args.diphones, '--serve', socket_path],
+                                  stdout=subprocess.DEVNULL)
+        try:
+            while not os.path.exists(socket_path):
+                if daemon.poll() is not None:
+                    raise RuntimeError('the daemon failed to start')
+                sleep(0.01)
+            ready_time = perf_counter() - start_time
+            first_audio, total = [], []
+            for _ in range(args.repeat):
+                header = synthesise_remote({'phrase': PROMPT}, io.BytesIO(), socket_path)
+                first_audio.append(header['first_audio_time'])
+                total.append(header['total_time'])
+            warm_process = time_process([sys.executable, client_py, '--socket', socket_path, '-o', wav_path,
+                                         PROMPT], args.repeat)
+        finally:
+            daemon.terminate()
+            daemon.wait()
+
+    print('daemon ready after {:.0f} ms'.format(ready_time * 1e3))
+    print('{:<40} {:>8} {:>8}'.format('ms', 'p50', 'p95'))
+    print('{:<40} {}'.format('new main.py process', describe(cold)))
+    print('{:<40} {}'.format('daemon, first audio (in process)', describe(first_audio)))
+    print('{:<40} {}'.format('daemon, all audio (in process)', describe(total)))
+    print('{:<40} {}'.format('daemon, new client.py process', describe(warm_process)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# Benchmark of the output encodings: how fast a minute of synthesised speech is encoded and written
+# as 16 bit PCM, mu-law and A-law wav, and how big it is per minute at the usual output rates.
+# The speech is synthesised once with the voice (a synthetic voice if not given) and resampled to every rate.
+#
+#   python benchmarks/bench_encoding.py --diphones ./diphones --rates 48000 16000 8000
+import argparse
+import io
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SENTENCE = 'A rose by any other name would smell as sweet, said the cat that sat on the mat.'
+CHUNK = 2048  # the samples written at once, as main.py streams them
+
+
+# about seconds of speech at the rate of the voice, the sentence synthesised over and over
+def synthesise_speech(diphones, seconds):
+    from synth import Synth, Utterance
+
+    diphone_synth = Synth(argparse.Namespace(diphones=diphones, crossfade=True, reverse=None, word_cache=None))
+    utt = Utterance(SENTENCE, lexicon=diphone_synth.lexicon)
+    audio = diphone_synth.get_output_audio_of_diphone_seq(utt.get_diphone_ids(utt.get_phone_ids()))
+    repeat = int(np.ceil(seconds * audio.rate / len(audio.data)))
+    return np.tile(audio.data, repeat)[:int(seconds * audio.rate)], audio.rate
+
+
+# write the samples chunk by chunk into memory, and return the seconds it took and the bytes written
+def encode(samples, rate, encoding):
+    from simpleaudio import WavWriter
+
+    output = io.BytesIO()
+    start_time = perf_counter()
+    with WavWriter(output, rate, encoding=encoding) as writer:
+        for start in range(0, len(samples), CHUNK):
+            writer.write(samples[start:start + CHUNK])
+    return perf_counter() - start_time, output.getvalue()
+
+
+# the signal to noise ratio of the decoded samples, in dB
+def get_snr(samples, decoded):
+    noise = np.sum((samples.astype(np.float64) - decoded) ** 2)
+    return 10 * np.log10(np.sum(samples.astype(np.float64) ** 2) / noise) if noise else float('inf')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the output encodings.')
+    parser.add_argument('--diphones', default=None,
+                        help="Folder containing diphone wavs, or a packed voice file (a synthetic voice if not given)")
+    parser.add_argument('--rates', nargs='+', type=int, default=[48000, 16000, 8000],
+                        help="The output rates to encode at")
+    parser.add_argument('--seconds', type=float, default=60.0, help="The length of the speech encoded")
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_DIR)
+    from benchmarks.synthetic_voice import make_synthetic_voice
+    from resample import resample
+    from simpleaudio import ENCODINGS, decode_alaw, decode_ulaw, quantise
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        diphones = args.diphones
+        if diphones is None:
+            diphones = os.path.join(tmp_dir, 'diphones')
+            make_synthetic_voice(diphones)
+        speech, voice_rate = synthesise_speech(diphones, args.seconds)
+
+    decoders = {'ulaw': decode_ulaw, 'alaw': decode_alaw}
+    print('{:>7} {:>6} {:>12} {:>14} {:>10} {:>8}'.format(
+        'rate', 'enc', 'MB / minute', 'Msamples / s', 'x realtime', 'SNR dB'))
+    for rate in args.rates:
+        samples = speech if rate == voice_rate else quantise(resample(speech, voice_rate, rate))
+        minutes = len(samples) / rate / 60
+        for encoding in ENCODINGS:
+            encode(samples[:CHUNK * 4], rate, encoding)  # warm up, e.g. the tables of G.711
+            seconds, data = encode(samples, rate, encoding)
+            if encoding in decoders:
+                snr = '{:8.1f}'.format(get_snr(samples, decoders[encoding](np.frombuffer(data[58:], np.uint8))))
+            else:
+                snr = '{:>8}'.format('exact')
+            print('{:>7} {:>6} {:>12.3f} {:>14.1f} {:>10.0f} {}'.format(
+                rate, encoding, len(data) / 2**20 / minutes, len(samples) / seconds / 1e6,
+                len(samples) / rate / seconds, snr))
+
+
+if __name__ == '__main__':
+    main()
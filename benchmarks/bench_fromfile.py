@@ -0,0 +1,81 @@
+# Benchmark of "main.py --fromfile": the throughput and the peak memory of synthesising
+# generated text documents of growing size, saved to a wav file.
+# With the streaming pipeline the peak memory should stay flat while the documents grow.
+# With --jobs, every size is run with each number of worker processes to show how it scales.
+#
+#   python benchmarks/bench_fromfile.py --diphones ./diphones --sizes 0.25 1 4
+#   python benchmarks/bench_fromfile.py --diphones ./diphones --sizes 1 --jobs 1 2 4 8
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORDS = ('the cat sat on a mat and it was very happy with the rose by any other name that would '
+         'smell as sweet when the sun came up over the hill we saw some birds fly to their home').split()
+
+
+# write a text document of about size_mb megabytes, made of sentences of common words
+def write_document(path, size_mb, seed=0):
+    rng = random.Random(seed)
+    target = int(size_mb * 2**20)
+    written = 0
+    with open(path, 'w') as file_to_write:
+        while written < target:
+            sentence = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 14)))
+            line = '{}{}\n'.format(sentence.capitalize(), rng.choice('.,.?!'))
+            file_to_write.write(line)
+            written += len(line)
+
+
+# run main.py on the document, and return the seconds it took and its peak resident memory in MB
+# (the peak of the main process, each worker process of --jobs has its own)
+def run_fromfile(diphones, text_path, wav_path, extra_args):
+    command = [sys.executable, os.path.join(REPO_DIR, 'main.py'), '--diphones', diphones,
+               '--fromfile', text_path, '-o', wav_path] + extra_args
+    start_time = perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = perf_counter() - start_time
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError('main.py failed with exit code {}'.format(process.returncode))
+    # ru_maxrss is in kilobytes on Linux
+    return elapsed, usage.ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the streaming --fromfile pipeline.')
+    parser.add_argument('--diphones', default=os.path.join(REPO_DIR, 'diphones'),
+                        help="Folder containing diphone wavs, or a packed voice file")
+    parser.add_argument('--sizes', nargs='+', type=float, default=[0.25, 1.0, 4.0],
+                        help="The sizes of the generated documents, in MB")
+    parser.add_argument('--jobs', nargs='+', type=int, default=[1],
+                        help="The numbers of worker processes to run main.py with")
+    args, extra_args = parser.parse_known_args()
+
+    print('CPUs: {}'.format(os.cpu_count()))
+    # the workers only run at once with a CPU each, otherwise the runs show what they cost, not how they scale
+    if max(args.jobs) > (os.cpu_count() or 1):
+        print('more jobs than CPUs: those runs show what the workers cost, not the speed-up of --jobs')
+    print('{:>8} {:>5} {:>10} {:>10} {:>12} {:>12}'.format(
+        'text MB', 'jobs', 'seconds', 'KB/s', 'audio MB', 'peak RSS MB'))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size_mb in args.sizes:
+            text_path = os.path.join(tmp_dir, 'document.txt')
+            wav_path = os.path.join(tmp_dir, 'document.wav')
+            write_document(text_path, size_mb)
+            text_kb = os.path.getsize(text_path) / 1024
+            for jobs in args.jobs:
+                elapsed, peak_mb = run_fromfile(args.diphones, text_path, wav_path,
+                                                ['--jobs', str(jobs)] + extra_args)
+                print('{:>8.2f} {:>5} {:>10.2f} {:>10.1f} {:>12.1f} {:>12.1f}'.format(
+                    size_mb, jobs, elapsed, text_kb / elapsed, os.path.getsize(wav_path) / 2**20, peak_mb))
+                os.remove(wav_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+# Load generator of the HTTP service (http_server.py): clients on keep-alive connections send short prompts
+# as fast as they are answered, for a while at every concurrency, and the throughput, the latency percentiles,
+# the requests turned away with 503 and the batches the service made are printed.
+# A service is started for every batch window given (0 only batches the requests waiting already), unless --url
+# points at one that is running.
+#
+#   python benchmarks/bench_http.py --diphones ./diphones --concurrency 1 4 16 64 --batch-windows 0 1
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+from time import perf_counter, sleep
+from urllib.parse import urlsplit
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROMPTS = ['Please hold, your call is important to us.', 'Hello world.', 'Your order has been shipped.',
+           'Press one for sales, or two for support.', 'Thank you, goodbye.', 'The cat sat on the mat.']
+
+
+# send a request on the connection, and return the status, the bytes of the body and when its first bytes came
+async def request(reader, writer, method, path, body=b''):
+    writer.write('{} {} HTTP/1.1\r\nHost: bench\r\nContent-Length: {}\r\n\r\n'.format(method, path, len(body))
+                 .encode('latin-1') + body)
+    await writer.drain()
+    head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+    status = int(head[0].split()[1])
+    headers = dict((name.lower(), value.strip()) for name, _, value in
+                   (line.partition(':') for line in head[1:] if line))
+    first_time = None
+    if headers.get('transfer-encoding') == 'chunked':
+        size = 0
+        while True:
+            length = int((await reader.readline()).strip(), 16)
+            if first_time is None:
+                first_time = perf_counter()
+            size += len(await reader.readexactly(length + 2)) - 2
+            if not length:
+                break
+    else:
+        size = len(await reader.readexactly(int(headers.get('content-length', 0))))
+        first_time = perf_counter()
+    return status, size, first_time
+
+
+# one client: send requests one after another until the end time, and record their latencies
+async def client(host, port, end_time, number, results):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        count = number
+        while perf_counter() < end_time:
+            body = json.dumps({'phrase': PROMPTS[count % len(PROMPTS)]}).encode('utf-8')
+            count += 1
+            start_time = perf_counter()
+            status, size, first_time = await request(reader, writer, 'POST', '/synthesise', body)
+            if status == 503:
+                results['rejected'] += 1
+                await asyncio.sleep(0.001)
+                continue
+            results['first'].append(first_time - start_time)
+            results['total'].append(perf_counter() - start_time)
+            results['bytes'] += size
+    finally:
+        writer.close()
+
+
+async def get_metrics(host, port):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(b'GET /metrics HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n')
+        await writer.drain()
+        data = await reader.read()
+    finally:
+        writer.close()
+    return json.loads(data.split(b'\r\n\r\n', 1)[1])
+
+
+# run the clients for the seconds, and return the results and the metrics of the service before and after
+async def run_load(host, port, concurrency, seconds):
+    before = await get_metrics(host, port)
+    results = {'first': [], 'total': [], 'rejected': 0, 'bytes': 0}
+    start_time = perf_counter()
+    await asyncio.gather(*[client(host, port, start_time + seconds, number, results)
+                           for number in range(concurrency)])
+    results['seconds'] = perf_counter() - start_time
+    return results, before, await get_metrics(host, port)
+
+
+def describe(label, window, concurrency, results, before, after):
+    served = len(results['total'])
+    batches = after['batches'] - before['batches']
+    batched = after['batched_requests'] - before['batched_requests']
+    audio = after['audio_seconds'] - before['audio_seconds']
+    total_ms = np.percentile(results['total'], [50, 95, 99]) * 1e3 if served else [0, 0, 0]
+    first_ms = np.percentile(results['first'], 50) * 1e3 if served else 0
+    return '{:>7} {:>6} {:>5} {:>9.1f} {:>9.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>7} {:>6.2f}'.format(
+        label, window, concurrency, served / results['seconds'], audio / results['seconds'], first_ms, *total_ms,
+        results['rejected'], batched / batches if batches else 0.0)
+
+
+# start a service, and return it once it answers
+def start_server(diphones, port, window, queue_size):
+    server = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, 'http_server.py'), '--diphones', diphones,
+                               '--port', str(port), '--batch-window', str(window), '--queue-size', str(queue_size)],
+                              stdout=subprocess.DEVNULL)
+    while True:
+        if server.poll() is not None:
+            raise RuntimeError('the service failed to start')
+        try:
+            asyncio.run(get_metrics('127.0.0.1', port))
+            return server
+        except OSError:
+            sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the throughput of the HTTP service under load.')
+    parser.add_argument('--diphones', default=os.path.join(REPO_DIR, 'diphones'),
+                        help="Folder containing diphone wavs, or a packed voice file")
+    parser.add_argument('--url', default=None, help="A running service to load (e.g. http://127.0.0.1:8000)")
+    parser.add_argument('--port', type=int, default=8765, help="The port of the services started")
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 4, 16, 64],
+                        help="The numbers of clients sending requests at once")
+    parser.add_argument('--batch-windows', nargs='+', type=float, default=[0.0, 1.0],
+                        help="The batch windows (ms) of the services started")
+    parser.add_argument('--queue-size', type=int, default=32, help="The queue size of the services started")
+    parser.add_argument('--seconds', type=float, default=5.0, help="How long every concurrency is run")
+    args = parser.parse_args()
+
+    print('{:>7} {:>6} {:>5} {:>9} {:>9} {:>8} {:>8} {:>8} {:>8} {:>7} {:>6}'.format(
+        '', 'window', 'conc', 'req / s', 'audio s/s', 'first', 'p50 ms', 'p95 ms', 'p99 ms', '503s', 'batch'))
+    if args.url is not None:
+        url = urlsplit(args.url)
+        for concurrency in args.concurrency:
+            results = asyncio.run(run_load(url.hostname, url.port or 80, concurrency, args.seconds))
+            print(describe('running', '-', concurrency, *results))
+        return
+    for window in args.batch_windows:
+        server = start_server(args.diphones, args.port, window, args.queue_size)
+        try:
+            for concurrency in args.concurrency:
+                results = asyncio.run(run_load('127.0.0.1', args.port, concurrency, args.seconds))
+                print(describe('started', window, concurrency, *results))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
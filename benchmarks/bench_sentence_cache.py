@@ -0,0 +1,70 @@
+# Benchmark of the sentence cache of "main.py --fromfile": a generated document is synthesised without the cache,
+# then with an empty cache, again with the cache filled, and after a share of its lines has been edited, and the
+# seconds, the hit rate and whether the audio is the same as without the cache are printed for every run.
+#
+#   python benchmarks/bench_sentence_cache.py --diphones ./diphones --size 0.25 --edits 0.05
+import argparse
+import filecmp
+import os
+import random
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# change a share of the lines of the document, each to a new sentence of the words
+def edit_document(path, share, words, seed=1):
+    rng = random.Random(seed)
+    with open(path) as file_to_read:
+        lines = file_to_read.readlines()
+    for num in rng.sample(range(len(lines)), max(1, int(len(lines) * share))):
+        lines[num] = '{}.\n'.format(' '.join(rng.choice(words) for _ in range(rng.randint(4, 14))).capitalize())
+    with open(path, 'w') as file_to_write:
+        file_to_write.writelines(lines)
+
+
+# run main.py on the document, and return the seconds it took and the summary of the sentence cache it printed
+def run_fromfile(diphones, text_path, wav_path, extra_args):
+    command = [sys.executable, os.path.join(REPO_DIR, 'main.py'), '--diphones', diphones,
+               '--fromfile', text_path, '-o', wav_path] + extra_args
+    start_time = perf_counter()
+    output = subprocess.run(command, stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+    elapsed = perf_counter() - start_time
+    summary = [line for line in output.splitlines() if line.startswith('Sentence cache:')]
+    return elapsed, summary[-1] if summary else ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the sentence cache of --fromfile.')
+    parser.add_argument('--diphones', default=os.path.join(REPO_DIR, 'diphones'),
+                        help="Folder containing diphone wavs, or a packed voice file")
+    parser.add_argument('--size', type=float, default=0.25, help="The size of the generated document, in MB")
+    parser.add_argument('--edits', type=float, default=0.05, help="The share of the lines edited")
+    parser.add_argument('--cache-size', type=float, default=4096, help="The budget of the cache, in MB")
+    args, extra_args = parser.parse_known_args()
+
+    sys.path.insert(0, REPO_DIR)
+    from benchmarks.bench_fromfile import WORDS, write_document
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        text_path = os.path.join(tmp_dir, 'document.txt')
+        cache_args = ['--sentence-cache', str(args.cache_size), '--sentence-cache-dir', os.path.join(tmp_dir, 'cache')]
+        write_document(text_path, args.size)
+        runs = [('no cache', None, []), ('empty cache', None, cache_args), ('filled cache', None, cache_args),
+                ('no cache', args.edits, []), ('after edits', None, cache_args)]
+        print('{:>14} {:>10}  {}'.format('', 'seconds', 'same audio / sentence cache'))
+        for label, edits, run_args in runs:
+            if edits is not None:
+                edit_document(text_path, edits, WORDS)
+                print('edited {:.0%} of the lines'.format(edits))
+            wav_path = os.path.join(tmp_dir, 'cached.wav' if run_args else 'plain.wav')
+            elapsed, summary = run_fromfile(args.diphones, text_path, wav_path, run_args + extra_args)
+            same = filecmp.cmp(wav_path, os.path.join(tmp_dir, 'plain.wav'), shallow=False) if run_args else '-'
+            print('{:>14} {:>10.2f}  {} {}'.format(label, elapsed, same, summary))
+
+
+if __name__ == '__main__':
+    main()
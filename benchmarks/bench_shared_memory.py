@@ -0,0 +1,93 @@
+# Benchmark of the memory of the --jobs worker processes: pools of 1, 2, 4... workers are set up the way
+# "main.py --fromfile --jobs N" sets them up, with every worker loading its own voice and lexicon or using the ones
+# the main process shares in shared memory, and every worker synthesises a few phrases. Their RSS (all the pages
+# they map), PSS (the pages they map, the shared ones divided between the processes sharing them) and USS
+# (the pages only they map) are then read from /proc (Linux only).
+# The PSS summed over the workers is what the pool really costs: sharing should keep it close to one voice.
+#
+#   python benchmarks/bench_shared_memory.py --diphones ./diphones --workers 1 2 4 8 16
+import argparse
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, wait
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PHRASES = ['Hello world! A rose by any other name would smell as sweet.',
+           'The cat sat on the mat, and it was good.',
+           'One, two, three: forty {cat} sat on the mat.']
+
+
+# the RSS, PSS and USS of a process in MB
+def get_memory(pid):
+    fields = {}
+    with open('/proc/{}/smaps_rollup'.format(pid)) as file_to_read:
+        for line in file_to_read:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return fields['Rss'], fields['Pss'], fields['Private_Clean'] + fields['Private_Dirty']
+
+
+# synthesise the phrase in a worker (set up by main.init_worker), and return the pid of the worker
+def synthesise(phrase, options):
+    import main
+
+    diphone_seq, word_spans = main.process_phrase(main.worker_synth, phrase, options)
+    main.synthesise_in_worker(diphone_seq, word_spans, options)
+    return os.getpid()
+
+
+# set up a pool of workers, sharing the voice or not, and return the memory of each of them
+def measure_pool(diphone_synth, synth_args, workers, share):
+    from shared_voice import SharedVoice
+    import main
+
+    shared_voice = SharedVoice.publish(diphone_synth.all_diphones, diphone_synth.lexicon) if share else None
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=main.init_worker,
+                                 initargs=(synth_args, shared_voice and shared_voice.names)) as pool:
+            futures = [pool.submit(synthesise, PHRASES[num % len(PHRASES)], diphone_synth.options)
+                       for num in range(3 * workers)]
+            wait(futures)
+            # read every worker while the pool is still up (the pids of the pool are not all in the results,
+            # as a worker can take several phrases)
+            return [get_memory(pid) for pid in pool._processes]
+    finally:
+        if shared_voice is not None:
+            shared_voice.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the memory of the --jobs workers, with and without '
+                                                 'sharing the voice.')
+    parser.add_argument('--diphones', default=None,
+                        help="Folder containing diphone wavs, or a packed voice file (a synthetic voice if not given)")
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 2, 4, 8, 16], help="The sizes of the pools")
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_DIR)
+    from benchmarks.synthetic_voice import make_synthetic_voice
+    from synth import Synth
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        diphones = args.diphones
+        if diphones is None:
+            diphones = os.path.join(tmp_dir, 'diphones')
+            make_synthetic_voice(diphones)
+        synth_args = argparse.Namespace(diphones=diphones, crossfade=False, reverse=None, word_cache=None,
+                                        outfile=None)
+        diphone_synth = Synth(synth_args)
+        print('{} CPUs, {} words in the lexicon'.format(os.cpu_count(), len(diphone_synth.lexicon)))
+        print('{:>8} {:>7} {:>12} {:>12} {:>12} {:>14}'.format(
+            'workers', 'shared', 'RSS MB each', 'PSS MB each', 'USS MB each', 'PSS MB total'))
+        for workers in args.workers:
+            for share in (False, True):
+                memory = measure_pool(diphone_synth, synth_args, workers, share)
+                rss, pss, uss = (sum(column) / len(memory) for column in zip(*memory))
+                print('{:>8} {:>7} {:>12.1f} {:>12.1f} {:>12.1f} {:>14.1f}'.format(
+                    workers, 'yes' if share else 'no', rss, pss, uss, pss * len(memory)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# Stress test and benchmark of one Synth shared by a pool of threads.
+# The stress test synthesises phrases with different options (emphasis left on or off, cross-fading, the reverse
+# ways, spelling, the volume and the speaking rate) from many threads at once, streamed and whole, and checks that
+# every one gives the same audio as it does on its own (the same way: a time stretched phrase can differ by a
+# rounding when streamed, as it is stretched in smaller blocks). The benchmark then times the same work with pools of
+# 1, 2, 4... threads, which only scales as far as NumPy releases the GIL (and as there are cores).
+#
+#   python benchmarks/bench_threads.py --diphones ./diphones --threads 1 2 4 8 --word-cache 16
+import argparse
+import hashlib
+import os
+import random
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PHRASES = ['Hello, {world}! A rose by any other name would smell as sweet.',
+           '{The cat sat on the mat, and the emphasis is left on',
+           'so this phrase starts emphasised} but ends plainly.',
+           'Please hold: your call is important to us.',
+           'A rose by any other name would smell as sweet, said the cat that sat on the mat. ' * 4]
+OPTIONS = [{}, {'crossfade': True}, {'reverse': 'words'}, {'reverse': 'phones', 'crossfade': True},
+           {'reverse': 'signal'}, {'spell': True}, {'volume': 40}, {'crossfade': True, 'volume': 70},
+           {'emphasis': True}, {'speaking_rate': 1.5}, {'crossfade': True, 'speaking_rate': 0.75}]
+
+
+# synthesise a phrase with the options, streamed or whole, and return the hash of its samples and their seconds
+def synthesise(diphone_synth, phrase, options, stream):
+    from synth import Utterance
+
+    utt = Utterance(phrase, spell=options.spell, reverse=options.reverse, lexicon=diphone_synth.lexicon)
+    diphone_seq = utt.get_diphone_ids(utt.get_phone_ids())
+    word_spans = utt.get_word_spans()
+    digest = hashlib.sha1()
+    samples = 0
+    if stream:
+        for chunk in diphone_synth.iter_audio(diphone_seq, word_spans=word_spans, gain=options.get_gain(),
+                                              options=options):
+            digest.update(chunk.tobytes())
+            samples += len(chunk)
+    else:
+        audio = diphone_synth.get_output_audio_of_diphone_seq(diphone_seq, word_spans, gain=options.get_gain(),
+                                                              options=options)
+        digest.update(audio.data.tobytes())
+        samples = len(audio.data)
+    return digest.hexdigest(), samples / diphone_synth.rate
+
+
+# run the tasks (phrase, options, stream) with a pool of threads, and return the results and the seconds it took
+def run_pool(diphone_synth, tasks, threads):
+    start_time = perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(lambda task: synthesise(diphone_synth, *task), tasks))
+    return results, perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stress test and benchmark a Synth shared by a pool of threads.')
+    parser.add_argument('--diphones', default=None,
+                        help="Folder containing diphone wavs, or a packed voice file (a synthetic voice if not given)")
+    parser.add_argument('--threads', nargs='+', type=int, default=[1, 2, 4, 8], help="The sizes of the pools")
+    parser.add_argument('--tasks', type=int, default=400, help="The phrases synthesised by every pool")
+    parser.add_argument('--word-cache', type=float, default=16.0, metavar='MB',
+                        help="The budget of the word cache shared by the threads, 0 for none")
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_DIR)
+    from benchmarks.synthetic_voice import make_synthetic_voice
+    from synth import Synth, SynthOptions
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        diphones = args.diphones
+        if diphones is None:
+            diphones = os.path.join(tmp_dir, 'diphones')
+            make_synthetic_voice(diphones)
+        diphone_synth = Synth(argparse.Namespace(diphones=diphones, crossfade=False, reverse=None,
+                                                 word_cache=args.word_cache or None))
+
+    # what every phrase and options give on their own, streamed and whole, one after another
+    cases = [(phrase, SynthOptions(**options), stream) for phrase in PHRASES for options in OPTIONS
+             for stream in (False, True)]
+    expected = {case: synthesise(diphone_synth, *case) for case in cases}
+
+    randomiser = random.Random(0)
+    tasks = [randomiser.choice(cases) for _ in range(args.tasks)]
+    print('{} CPUs, {} tasks per pool'.format(os.cpu_count(), len(tasks)))
+    print('{:>8} {:>10} {:>12} {:>11} {:>9} {:>10}'.format(
+        'threads', 'seconds', 'phrases / s', 'x realtime', 'speedup', 'mismatches'))
+    failed = 0
+    base_time = None
+    for threads in args.threads:
+        results, seconds = run_pool(diphone_synth, tasks, threads)
+        mismatches = sum(result != expected[task] for task, result in zip(tasks, results))
+        failed += mismatches
+        base_time = base_time or seconds
+        audio_seconds = sum(result[1] for result in results)
+        print('{:>8} {:>10.3f} {:>12.1f} {:>11.0f} {:>8.2f}x {:>10}'.format(
+            threads, seconds, len(tasks) / seconds, audio_seconds / seconds, base_time / seconds, mismatches))
+    if diphone_synth.word_cache is not None:
+        print(diphone_synth.word_cache.describe())
+    if failed:
+        sys.exit('FAILED: {} phrases did not give the audio they give on their own'.format(failed))
+    print('OK: every phrase gave the same audio from every thread')
+
+
+if __name__ == '__main__':
+    main()
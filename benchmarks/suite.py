@@ -0,0 +1,214 @@
+# The benchmark suite: times every stage a real run goes through, and the signals made by simpleaudio,
+# on a synthetic voice unless another one is given, and reports the results as JSON so that they can be compared
+# across commits.
+#
+#   python -m benchmarks --output before.json
+#   (change something)
+#   python -m benchmarks --output after.json --compare before.json
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from benchmarks.bench_fromfile import REPO_DIR, write_document
+from benchmarks.synthetic_voice import make_synthetic_voice
+
+SENTENCE = 'A rose by any other name would smell as sweet, said the cat that sat on the mat.'
+MIN_TIME = 0.2  # unit: second, the least time every stage is repeated for
+
+
+# time func, repeating it for at least MIN_TIME, then run it once more under tracemalloc
+# return the seconds per call, the peak bytes allocated by a call, and the net blocks it left allocated
+# (the blocks allocated and not freed by the call, less the ones it freed that were allocated before it:
+# tracemalloc only sees what is allocated at a time, not how many allocations a call makes)
+def measure(func: Callable[[], object], min_time: float=MIN_TIME) -> Dict[str, float]:
+    func()  # warm up
+    calls = 0
+    start_time = perf_counter()
+    while True:
+        func()
+        calls += 1
+        elapsed = perf_counter() - start_time
+        if elapsed >= min_time:
+            break
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    net_blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename'))
+    return {'seconds': elapsed / calls, 'calls': calls, 'peak_bytes': peak, 'net_blocks': net_blocks}
+
+
+# run main.py on the document as bench_fromfile.run_fromfile does, but from a small launcher process
+# return the seconds it took and its peak resident memory in MB
+# the peak memory of a child process counts the memory of the process it was forked from, so main.py is not started
+# from the suite itself, which has grown with the stages before (the voice, resampling and tracemalloc snapshots)
+def run_fromfile_clean(diphones: str, text_path: str, wav_path: str) -> Tuple[float, float]:
+    launcher = ('import json, sys; sys.path.insert(0, sys.argv[1]); '
+                'from benchmarks.bench_fromfile import run_fromfile; '
+                'print(json.dumps(run_fromfile(sys.argv[2], sys.argv[3], sys.argv[4], [])))')
+    output = subprocess.run([sys.executable, '-c', launcher, REPO_DIR, diphones, text_path, wav_path],
+                            stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+    seconds, peak_mb = json.loads(output.splitlines()[-1])
+    return seconds, peak_mb
+
+
+# add the throughput of a stage that handled chars characters and made audio_seconds of audio in a call
+# the real-time factor is the time it took over the length of the audio (below 1 is faster than real time)
+def add_throughput(result: Dict[str, float], chars: int=0, audio_seconds: float=0.0) -> Dict[str, float]:
+    if chars:
+        result['chars_per_second'] = chars / result['seconds']
+    if audio_seconds:
+        result['real_time_factor'] = result['seconds'] / audio_seconds
+    return result
+
+
+# run every stage and return the results
+def run_suite(diphones: str, fromfile_mb: float) -> Dict[str, object]:
+    from lexicon import Lexicon, get_default_cache_file, get_default_lexicon
+    from simpleaudio import RATE, Audio, sum_audio
+    from synth import Synth, Utterance
+    from timescale import time_stretch
+
+    stages = {}
+    # the messages printed by the synthesiser would get mixed into the JSON
+    with contextlib.redirect_stdout(io.StringIO()):
+        lexicon = get_default_lexicon()
+        stages['lexicon_load'] = measure(lambda: Lexicon.load(get_default_cache_file()))
+        words = Utterance(SENTENCE, lexicon=lexicon).seq_words
+        # a new lexicon for every call, so that the memo of the words looked up is empty
+        stages['lexicon_lookup'] = add_throughput(
+            measure(lambda: [Lexicon.from_cache(get_default_cache_file()).get_ids(word) for word in words]),
+            chars=len(SENTENCE))
+
+        synth_args = argparse.Namespace(diphones=diphones, crossfade=False, reverse=None, word_cache=None)
+        stages['synth_startup'] = measure(lambda: Synth(synth_args))
+        diphone_synth = Synth(synth_args)
+        # a folder of wavs is packed into a voice file as well, to time the start up with the packed voice
+        if os.path.isdir(diphones):
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                packed_args = argparse.Namespace(**vars(synth_args))
+                packed_args.diphones = os.path.join(tmp_dir, 'voice.dvx')
+                diphone_synth.all_diphones.save_voice_file(packed_args.diphones)
+                stages['synth_startup_packed'] = measure(lambda: Synth(packed_args))
+
+        # resampling the whole voice to 16 kHz once, as --output-rate 16000 does at start up
+        stages['voice_resampling'] = measure(lambda: diphone_synth.all_diphones.resample(16000))
+
+        stages['utterance_normalisation'] = add_throughput(
+            measure(lambda: Utterance(SENTENCE, lexicon=lexicon)), chars=len(SENTENCE))
+        utt = Utterance(SENTENCE, lexicon=lexicon)
+        stages['diphone_sequence'] = add_throughput(
+            measure(lambda: utt.get_diphone_ids(utt.get_phone_ids())), chars=len(SENTENCE))
+
+        diphone_seq = utt.get_diphone_ids(utt.get_phone_ids())
+        for crossfade in (False, True):
+            options = diphone_synth.options._replace(crossfade=crossfade)
+            audio = diphone_synth.get_output_audio_of_diphone_seq(diphone_seq, options=options)
+            result = measure(lambda: diphone_synth.get_output_audio_of_diphone_seq(diphone_seq, options=options))
+            stages['concatenation_crossfade' if crossfade else 'concatenation'] = add_throughput(
+                result, chars=len(SENTENCE), audio_seconds=len(audio.data) / audio.rate)
+
+        # the audio of the sentence (cross-faded, at the speaking rate of the voice) time stretched to half and
+        # twice its length
+        stretch_options = diphone_synth.options._replace(crossfade=True, speaking_rate=1.0)
+        audio = diphone_synth.get_output_audio_of_diphone_seq(diphone_seq, options=stretch_options)
+        for speaking_rate in (0.5, 2.0):
+            stages['time_stretch_{}'.format(speaking_rate)] = add_throughput(
+                measure(lambda: time_stretch(audio.data, speaking_rate)),
+                audio_seconds=len(audio.data) / audio.rate / speaking_rate)
+
+    # the prompts, beeps and comfort noise made by simpleaudio: a second of each, mixed with an echo
+    def make_signals() -> None:
+        tone, noise = Audio(), Audio()
+        tone.create_tone(440, RATE, 0.5)
+        noise.create_noise(RATE, 0.05, rng=0)
+        tone.add_echo(3, RATE // 10)
+        sum_audio((tone, noise))
+    stages['signal_generation'] = add_throughput(measure(make_signals), audio_seconds=1.0)
+
+    if fromfile_mb:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            text_path = os.path.join(tmp_dir, 'document.txt')
+            wav_path = os.path.join(tmp_dir, 'document.wav')
+            write_document(text_path, fromfile_mb)
+            seconds, peak_mb = run_fromfile_clean(diphones, text_path, wav_path)
+            audio_seconds = (os.path.getsize(wav_path) - 44) / 2 / diphone_synth.rate
+            stages['fromfile'] = add_throughput({'seconds': seconds, 'calls': 1, 'peak_rss_mb': peak_mb},
+                                                chars=os.path.getsize(text_path), audio_seconds=audio_seconds)
+
+    return {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'cpus': os.cpu_count(),
+        'voice': {'path': diphones, 'diphones': len(diphone_synth.all_diphones),
+                  'mb': diphone_synth.all_diphones.nbytes / 2**20, 'rate': diphone_synth.rate},
+        'stages': stages,
+    }
+
+
+# the commit of the repo being benchmarked, None if it is not a git checkout
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# print how long every stage takes compared with the results of another run
+def print_comparison(results: Dict[str, object], baseline: Dict[str, object]) -> None:
+    print('{:<26} {:>12} {:>12} {:>8}'.format('stage', 'before ms', 'after ms', 'speedup'), file=sys.stderr)
+    for name, result in results['stages'].items():
+        before = baseline['stages'].get(name)
+        if before is None:
+            continue
+        print('{:<26} {:>12.3f} {:>12.3f} {:>7.2f}x'.format(
+            name, before['seconds'] * 1e3, result['seconds'] * 1e3, before['seconds'] / result['seconds']),
+            file=sys.stderr)
+
+
+def main(argv: Optional[list]=None) -> None:
+    parser = argparse.ArgumentParser(description='Benchmark every stage of the synthesiser.')
+    parser.add_argument('--diphones', default=None,
+                        help="Folder containing diphone wavs, or a packed voice file (a synthetic voice if not given)")
+    parser.add_argument('--fromfile-mb', type=float, default=0.5,
+                        help="The size of the text given to --fromfile in MB (0 to skip it)")
+    parser.add_argument('--output', '-o', default=None, help="Save the JSON results to a file as well")
+    parser.add_argument('--compare', default=None, help="The JSON results of another run to compare with")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        diphones = args.diphones
+        if diphones is None:
+            diphones = os.path.join(tmp_dir, 'diphones')
+            make_synthetic_voice(diphones)
+        results = run_suite(diphones, args.fromfile_mb)
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output is not None:
+        with open(args.output, 'w') as file_to_write:
+            file_to_write.write(text + '\n')
+    if args.compare is not None:
+        with open(args.compare) as file_to_read:
+            print_comparison(results, json.load(file_to_read))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# Generate a synthetic diphone voice: a wav file for every pair of phones (and "pau"),
+# with about the number of diphones, lengths and rate of a real voice, so that the benchmarks
+# can be run anywhere without shipping a recorded voice.
+#
+#   python -m benchmarks.synthetic_voice ./synthetic_diphones --pack ./synthetic.dvx
+import argparse
+import os
+import wave
+from typing import Optional
+
+import numpy as np
+
+from phones import CMU_PHONES
+
+RATE = 48000
+MIN_TIME = 0.06  # unit: second, the shortest diphone
+MAX_TIME = 0.22  # unit: second, the longest diphone
+VOICED = {'AA', 'AE', 'AH', 'AO', 'AW', 'AY', 'EH', 'ER', 'EY', 'IH', 'IY', 'OW', 'OY', 'UH', 'UW',
+          'L', 'M', 'N', 'NG', 'R', 'W', 'Y'}
+
+
+# the samples of half a diphone: a harmonic tone for the voiced phones, noise for the others, nothing for "pau"
+def make_phone(phone: str, length: int, rate: int, rng: np.random.Generator) -> np.ndarray:
+    if phone == 'PAU':
+        return np.zeros(length)
+    if phone in VOICED:
+        pitch = rng.uniform(90, 220)
+        formant = rng.uniform(300, 2500)
+        time = np.arange(length) / rate
+        return (0.5 * np.sin(2 * np.pi * pitch * time) + 0.3 * np.sin(2 * np.pi * formant * time)) * 12000
+    return rng.normal(0, 4000, length)
+
+
+# write the voice to the folder, and return how many diphones it has
+def make_synthetic_voice(folder: str, rate: int=RATE, seed: int=0) -> int:
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    phones = ('PAU',) + CMU_PHONES
+    for first in phones:
+        for second in phones:
+            length = int(rng.uniform(MIN_TIME, MAX_TIME) * rate)
+            half = length // 2
+            samples = np.concatenate((make_phone(first, half, rate, rng),
+                                      make_phone(second, length - half, rate, rng)))
+            samples = np.clip(samples, -32768, 32767).astype('<i2')
+            with wave.open(os.path.join(folder, '{}-{}.wav'.format(first.lower(), second.lower())), 'wb') as wf:
+                wf.setnchannels(1)
+                wf.setsampwidth(2)
+                wf.setframerate(rate)
+                wf.writeframes(samples.tobytes())
+    return len(phones) ** 2
+
+
+# write the voice to the folder, and pack it into a voice file as well if voice_file is given
+def main(argv: Optional[list]=None) -> None:
+    parser = argparse.ArgumentParser(description='Generate a synthetic diphone voice for the benchmarks.')
+    parser.add_argument('folder', help="The folder to write the diphone wavs to")
+    parser.add_argument('--pack', default=None, metavar='VOICE_FILE',
+                        help="Pack the voice into a voice file as well")
+    parser.add_argument('--rate', type=int, default=RATE)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    count = make_synthetic_voice(args.folder, args.rate, args.seed)
+    print('Wrote {} diphones to {}'.format(count, args.folder))
+    if args.pack is not None:
+        from diphone_bank import DiphoneBank
+        DiphoneBank.from_folder(args.folder).save_voice_file(args.pack)
+        print('Packed them into {}'.format(args.pack))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+import argparse
+
+from diphone_bank import DiphoneBank
+
+
+# process the commandline and return args
+def process_commandline():
+    parser = argparse.ArgumentParser(
+        description='Pack a folder of diphone wavs into a single voice file that the synthesiser can memory-map.')
+    parser.add_argument('diphones', help="Folder containing diphone wavs")
+    parser.add_argument('voice', help="The packed voice file to write")
+    parser.add_argument('--rate', action="store", default=None, type=int, metavar='HZ',
+                        help="Resample the diphones to this rate before packing them")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = process_commandline()
+
+    print(f'Will load wavs from: {args.diphones}')
+    bank = DiphoneBank.from_folder(args.diphones)
+    if args.rate and args.rate != bank.rate:
+        print("Resampling the diphones from {} Hz to {} Hz".format(bank.rate, args.rate))
+        bank = bank.resample(args.rate)
+    print(bank.describe())
+    bank.save_voice_file(args.voice)
+    print("Packed voice saved as {}".format(args.voice))
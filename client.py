@@ -0,0 +1,107 @@
+# The thin client of the synthesis daemon ("main.py --serve"): it sends a phrase and its options over the UNIX
+# socket of the daemon and writes the audio it gets back to a file or the standard output.
+# It only uses the standard library, so it starts in milliseconds; the daemon keeps the voice and the lexicon warm.
+#
+#   python main.py --serve &
+#   python client.py -o hello.wav "Hello world."
+#   python client.py --pcm -o - "Hello world." | aplay -t raw -f S16_LE -r 48000
+#
+# The protocol: the client sends one line of JSON with the request, the daemon answers with one line of JSON
+# (the status, and the rate and channels of the audio), followed by the audio until it closes the connection.
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+from time import perf_counter
+from typing import BinaryIO, Dict, Optional
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), 'speech_synthesiser-{}.sock'.format(os.getuid()))
+OUTPUT_FORMATS = ('wav', 'pcm')  # a wav file (streamed, so without sizes in its header), or just the samples
+MAX_MESSAGE = 2**20  # the longest line of JSON read from the other side
+READ_SIZE = 65536
+
+
+# read a line of JSON from a socket file
+def read_message(file_to_read: BinaryIO) -> Dict[str, object]:
+    line = file_to_read.readline(MAX_MESSAGE)
+    if not line.endswith(b'\n'):
+        raise ValueError('the message was cut short or is too long')
+    message = json.loads(line)
+    if not isinstance(message, dict):
+        raise ValueError('the message should be a JSON object')
+    return message
+
+
+# write a line of JSON to a socket file
+def write_message(file_to_write: BinaryIO, message: Dict[str, object]) -> None:
+    file_to_write.write(json.dumps(message).encode('utf-8') + b'\n')
+    file_to_write.flush()
+
+
+# send a request to the daemon and write the audio it sends back to output
+# return the header of the answer, with how long the first audio and all of it took to arrive
+def synthesise_remote(request: Dict[str, object], output: BinaryIO,
+                      socket_path: str=DEFAULT_SOCKET) -> Dict[str, object]:
+    start_time = perf_counter()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        with connection.makefile('rwb') as stream:
+            write_message(stream, request)
+            header = read_message(stream)
+            if header.get('status') != 'ok':
+                raise RuntimeError('the daemon could not synthesise the phrase: {}'.format(header.get('message')))
+            first_audio_time = None
+            while True:
+                data = stream.read1(READ_SIZE)
+                if not data:
+                    break
+                if first_audio_time is None:
+                    first_audio_time = perf_counter() - start_time
+                output.write(data)
+    output.flush()
+    header['first_audio_time'] = first_audio_time
+    header['total_time'] = perf_counter() - start_time
+    return header
+
+
+# process the commandline and return args
+def process_commandline(argv: Optional[list]=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Synthesise a phrase with a running "main.py --serve" daemon.')
+    parser.add_argument('phrase', help="The phrase to be synthesised")
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help="The UNIX socket the daemon listens on")
+    parser.add_argument('--outfile', '-o', default='-',
+                        help="Save the output audio to a file, or write it to the standard output with '-'")
+    parser.add_argument('--pcm', action="store_true", default=False,
+                        help="Get just the samples, without a wav header")
+    parser.add_argument('--encoding', default='pcm', choices=['pcm', 'ulaw', 'alaw'],
+                        help="How the samples are encoded: 16 bit PCM, or 8 bit G.711 mu-law or A-law")
+    parser.add_argument('--volume', '-v', default=None, type=int,
+                        help="An int between 0 and 100 representing the desired volume")
+    parser.add_argument('--spell', '-s', action="store_true", default=False,
+                        help="Spell the phrase instead of pronouncing it")
+    parser.add_argument('--reverse', '-r', default=None, choices=['words', 'phones', 'signal'],
+                        help="Speak backwards in a mode specified by string argument")
+    parser.add_argument('--crossfade', '-c', action="store_true", default=False,
+                        help="Enable slightly smoother concatenation by cross-fading between diphone units")
+    parser.add_argument('--timing', action="store_true", default=False,
+                        help="Print how long the first audio and all of it took to arrive, to the standard error")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = process_commandline()
+    request = {'phrase': args.phrase, 'volume': args.volume, 'spell': args.spell, 'reverse': args.reverse,
+               'crossfade': args.crossfade, 'format': 'pcm' if args.pcm else 'wav', 'encoding': args.encoding}
+    try:
+        if args.outfile == '-':
+            header = synthesise_remote(request, sys.stdout.buffer, args.socket)
+        else:
+            with open(args.outfile, 'wb') as file_to_write:
+                header = synthesise_remote(request, file_to_write, args.socket)
+    except (OSError, RuntimeError, ValueError) as error:
+        sys.exit('client.py: {}'.format(error))
+    if args.timing:
+        print('First audio after {:.1f} ms, all of it ({} Hz) after {:.1f} ms'.format(
+            (header['first_audio_time'] or 0.0) * 1e3, header['rate'], header['total_time'] * 1e3), file=sys.stderr)
@@ -0,0 +1,234 @@
+from concurrent.futures import ThreadPoolExecutor
+from math import gcd
+from pathlib import Path
+from time import perf_counter
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+import hashlib
+import mmap
+import os
+import struct
+import wave
+
+import numpy as np
+
+from resample import get_resampling_gap, resample_poly
+from simpleaudio import quantise
+
+DEFAULT_RATE = 48000  # the rate reported by an empty bank, same as simpleaudio.RATE
+
+# the packed voice file layout:
+#   header     - magic, version, sample width, rate, number of diphones, and where each section starts
+#   name index - uint32 offsets into a utf-8 blob of the diphone names, sorted by name
+#   unit index - int64 sample offsets and int64 sample lengths of every diphone, in the same order
+#   samples    - the raw little endian 16 bit PCM of all the diphones, back to back
+VOICE_MAGIC = b'DIPHVOX1'
+VOICE_VERSION = 1
+VOICE_HEADER = struct.Struct('<8sHHIIQQQQ')
+VOICE_ALIGN = 64  # the sections are aligned so that numpy views of them are aligned too
+
+
+# read all the samples of a single diphone wav file in one call
+# return the samples together with the rate of the file
+def read_diphone_wav(wav_file: str) -> Tuple[np.ndarray, int]:
+    with wave.open(wav_file, 'rb') as wf:
+        # the diphone voices are mono 16 bit recordings, anything else cannot be concatenated
+        if wf.getsampwidth() != 2 or wf.getnchannels() != 1:
+            raise ValueError('"{}" is not a mono 16 bit wav file.'.format(wav_file))
+        rate = wf.getframerate()
+        raw = wf.readframes(wf.getnframes())
+    return np.frombuffer(raw, dtype=np.int16), rate
+
+
+# all the diphones of a voice held in memory
+# the samples of every diphone are stored back to back in one contiguous array,
+# and each diphone is found through its offset and length in that array
+class DiphoneBank:
+    def __init__(self, names: List[str], data: np.ndarray, offsets: np.ndarray, lengths: np.ndarray,
+                 rate: int=DEFAULT_RATE) -> None:
+        self.names = names  # the diphone names (e.g. "aa-b"), in the order of the index
+        self.index = {name: num for num, name in enumerate(names)}  # diphone name -> position in the index
+        self.data = data  # the samples of all the diphones
+        self.offsets = offsets  # where the samples of each diphone start in data
+        self.lengths = lengths  # how many samples each diphone has
+        self.rate = rate
+        self.nptype = data.dtype.type
+        self.load_time = 0.0  # unit: second
+
+    # load every .wav file in the wav_folder once, reading the files with a thread pool
+    @classmethod
+    def from_folder(cls, wav_folder: str, max_workers: Optional[int]=None) -> 'DiphoneBank':
+        start_time = perf_counter()
+        # the file name without the ".wav" suffix is the name of the diphone
+        wav_files = {item.stem: str(item) for item in Path(wav_folder).glob('*.wav') if item.is_file()}
+        names = sorted(wav_files)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            loaded = list(pool.map(read_diphone_wav, (wav_files[name] for name in names)))
+
+        rate = loaded[0][1] if loaded else DEFAULT_RATE
+        for name, (_, file_rate) in zip(names, loaded):
+            if file_rate != rate:
+                raise ValueError('"{}" has a rate of {} but the other diphones have {}.'
+                                 .format(wav_files[name], file_rate, rate))
+
+        # put the samples of all the diphones into one array
+        lengths = np.array([len(samples) for samples, _ in loaded], dtype=np.int64)
+        offsets = np.zeros(len(names), dtype=np.int64)
+        np.cumsum(lengths[:-1], out=offsets[1:])
+        if loaded:
+            data = np.concatenate([samples for samples, _ in loaded])
+        else:
+            data = np.array([], dtype=np.int16)
+
+        bank = cls(names, data, offsets, lengths, rate)
+        bank.load_time = perf_counter() - start_time
+        return bank
+
+    # map a packed voice file (made by build_voice.py) into memory
+    # the diphones are zero-copy views of the mapped file, so processes opening the same voice
+    # share its pages in the page cache instead of each holding their own copy
+    @classmethod
+    def from_voice_file(cls, voice_file: str) -> 'DiphoneBank':
+        start_time = perf_counter()
+        with open(voice_file, 'rb') as file_to_read:
+            voice = mmap.mmap(file_to_read.fileno(), 0, access=mmap.ACCESS_READ)
+        bank = cls.from_buffer(voice, voice_file)
+        bank.load_time = perf_counter() - start_time
+        return bank
+
+    # read a packed voice from a buffer (e.g. a mapped file or shared memory), described by source in the errors
+    # the diphones are zero-copy views of the buffer
+    @classmethod
+    def from_buffer(cls, voice, source: str) -> 'DiphoneBank':
+        if len(voice) < VOICE_HEADER.size:
+            raise ValueError('"{}" is not a packed voice file.'.format(source))
+        (magic, version, sampwidth, rate, count,
+         names_start, units_start, data_start, data_len) = VOICE_HEADER.unpack_from(voice)
+        if magic != VOICE_MAGIC or version != VOICE_VERSION or sampwidth != 2:
+            raise ValueError('"{}" is not a packed voice file of version {}.'.format(source, VOICE_VERSION))
+
+        name_offsets = np.frombuffer(voice, dtype='<u4', count=count + 1, offset=names_start)
+        blob_start = names_start + name_offsets.nbytes
+        names = [bytes(voice[blob_start + start:blob_start + end]).decode('utf-8')
+                 for start, end in zip(name_offsets[:-1].tolist(), name_offsets[1:].tolist())]
+        offsets = np.frombuffer(voice, dtype='<i8', count=count, offset=units_start)
+        lengths = np.frombuffer(voice, dtype='<i8', count=count, offset=units_start + 8 * count)
+        data = np.frombuffer(voice, dtype='<i2', count=data_len, offset=data_start)
+        return cls(names, data, offsets, lengths, rate)
+
+    # load a voice from either a folder of diphone wav files or a packed voice file
+    @classmethod
+    def load(cls, path: str) -> 'DiphoneBank':
+        if os.path.isdir(path):
+            return cls.from_folder(path)
+        return cls.from_voice_file(path)
+
+    # resample all the diphones to another rate, and return them as a new bank
+    # they are resampled together in one pass: every diphone is put in a padded copy of data, far enough from
+    # the one before for the filter not to mix them, and at a position that falls on a sample of the output,
+    # and the new bank is a view of the resampled padded copy
+    def resample(self, rate: int) -> 'DiphoneBank':
+        start_time = perf_counter()
+        divisor = gcd(rate, self.rate)
+        up, down = rate // divisor, self.rate // divisor
+        gap, alignment = get_resampling_gap(up, down)
+        # where every diphone goes in the padded copy
+        padded_lengths = -(-(self.lengths + gap) // alignment) * alignment
+        padded_offsets = np.zeros(len(self), dtype=np.int64)
+        np.cumsum(padded_lengths[:-1], out=padded_offsets[1:])
+        padded_offsets += -(-gap // alignment) * alignment
+        padded = np.zeros(int(padded_offsets[-1] + padded_lengths[-1]) if len(self) else 0)
+        for offset, padded_offset, length in zip(self.offsets.tolist(), padded_offsets.tolist(),
+                                                 self.lengths.tolist()):
+            padded[padded_offset:padded_offset + length] = self.data[offset:offset + length]
+
+        data = quantise(resample_poly(padded, up, down), self.nptype)
+        offsets = padded_offsets // down * up
+        lengths = -(-self.lengths * up // down)
+        bank = DiphoneBank(self.names, data, offsets, lengths, rate)
+        bank.load_time = self.load_time + perf_counter() - start_time
+        return bank
+
+    # write the bank as a packed voice file
+    def save_voice_file(self, voice_file: str) -> None:
+        # write to a temporary file first, so a voice that is being used is never seen half written
+        tmp_file = '{}.tmp{}'.format(voice_file, os.getpid())
+        with open(tmp_file, 'wb') as file_to_write:
+            self.write_voice(file_to_write)
+        os.replace(tmp_file, voice_file)
+
+    # write the bank in the packed voice layout to a binary file, with the names sorted so the index can be searched
+    def write_voice(self, file_to_write: BinaryIO) -> None:
+        order = sorted(range(len(self.names)), key=self.names.__getitem__)
+        encoded_names = [self.names[num].encode('utf-8') for num in order]
+        name_offsets = np.zeros(len(order) + 1, dtype='<u4')
+        name_offsets[1:] = np.cumsum([len(name) for name in encoded_names])
+        lengths = self.lengths[order].astype('<i8')
+        offsets = np.zeros(len(order), dtype='<i8')
+        np.cumsum(lengths[:-1], out=offsets[1:])
+
+        names_start = align(VOICE_HEADER.size)
+        units_start = align(names_start + name_offsets.nbytes + int(name_offsets[-1]))
+        data_start = align(units_start + offsets.nbytes + lengths.nbytes)
+        header = VOICE_HEADER.pack(VOICE_MAGIC, VOICE_VERSION, 2, self.rate, len(order),
+                                   names_start, units_start, data_start, int(lengths.sum()))
+
+        start = file_to_write.tell()
+        file_to_write.write(header)
+        file_to_write.write(bytes(names_start - VOICE_HEADER.size))
+        file_to_write.write(name_offsets.tobytes())
+        file_to_write.write(b''.join(encoded_names))
+        file_to_write.write(bytes(start + units_start - file_to_write.tell()))
+        file_to_write.write(offsets.tobytes())
+        file_to_write.write(lengths.tobytes())
+        file_to_write.write(bytes(start + data_start - file_to_write.tell()))
+        for num in order:
+            file_to_write.write(self[self.names[num]].astype('<i2').tobytes())
+
+    # the memory held by the samples and the offset/length index
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes + self.offsets.nbytes + self.lengths.nbytes
+
+    # a one line summary of the bank, used to size the memory of the workers
+    def describe(self) -> str:
+        return 'Loaded {} diphones ({:.1f} MB) in {:.3f} s'.format(
+            len(self), self.nbytes / 2**20, self.load_time)
+
+    # get the samples of a diphone as a view into the bank (no copy)
+    def __getitem__(self, name: str) -> np.ndarray:
+        num = self.index[name]
+        offset = self.offsets[num]
+        return self.data[offset:offset + self.lengths[num]]
+
+    def get(self, name: str, default: Optional[np.ndarray]=None) -> Optional[np.ndarray]:
+        if name in self.index:
+            return self[name]
+        return default
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+# a fingerprint of the voice at the path (a folder of diphone wav files or a packed voice file), which changes when
+# any of its files is added, removed or changed: the names, sizes and modification times of its files hashed together
+def get_voice_fingerprint(path: str) -> str:
+    if os.path.isdir(path):
+        files = sorted(item for item in Path(path).glob('*.wav') if item.is_file())
+    else:
+        files = [Path(path)]
+    digest = hashlib.sha1()
+    for item in files:
+        stat = item.stat()
+        digest.update('{}\0{}\0{}\n'.format(item.name, stat.st_size, stat.st_mtime_ns).encode('utf-8'))
+    return digest.hexdigest()
+
+
+# round a file position up to the alignment of the packed voice sections
+def align(position: int) -> int:
+    return -(-position // VOICE_ALIGN) * VOICE_ALIGN
@@ -0,0 +1,40 @@
+from typing import Iterator, TextIO
+import re
+
+PHRASE_BLOCK = 65536  # the most characters read from a document at once
+SENTENCE_END = re.compile(r"[.!?:]")  # the punctuation that ends a sentence
+WHITESPACE = re.compile(r"\s")
+
+
+# split a text document into phrases to synthesise, reading it a block at a time
+# every line (or block of a very long line) gives the text up to its last ".", "!", ":" or "?" as a phrase,
+# which can be one or several complete sentences, and the rest of it is carried over to the next line
+# the text carried over is bounded too: without any such punctuation, it is split at a whitespace
+def iter_phrases(text_file: TextIO, block_size: int=PHRASE_BLOCK) -> Iterator[str]:
+    # a phrase to temporarily store the sentence in the text file
+    phrase_tmp = ''
+    while True:
+        line = text_file.readline(block_size)  # read the text line by line, or block by block for long lines
+        # if the text reach the end, give out whatever is left in phrase_tmp, even if it is only whitespace
+        if not line:
+            if phrase_tmp != '':
+                yield phrase_tmp
+            return
+        # find the position of the last ".", "!", ":" and "?" in the line
+        index_period = -1
+        for match in SENTENCE_END.finditer(line):
+            index_period = match.start(0)
+        # if there is no such punctuation, put the whole line into phrase_tmp and read the next line
+        if index_period < 0:
+            phrase_tmp += line
+            # but a phrase should not grow forever, split it at its last whitespace
+            if len(phrase_tmp) > block_size:
+                index_space = max((match.start(0) for match in WHITESPACE.finditer(phrase_tmp)), default=-1)
+                if index_space > 0:
+                    yield phrase_tmp[:index_space]
+                    phrase_tmp = phrase_tmp[index_space:]
+        # if the line has such punctuation, the text up to the last punctuation is one or several complete sentences
+        else:
+            yield phrase_tmp + line[:index_period + 1]
+            # reset the phrase_tmp to the rest text of the line
+            phrase_tmp = line[index_period + 1:]
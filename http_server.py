@@ -0,0 +1,464 @@
+# An HTTP service of the synthesiser, with only the standard library: a warm Synth behind an asyncio server.
+# The event loop only parses requests and sends the audio; the synthesis runs in an executor, and its audio is
+# streamed back with chunked transfer encoding as it is made. The requests wait in a bounded queue, and a request
+# that finds it full is turned away with 503 at once, so a burst never builds up an unbounded backlog.
+# The small requests that are waiting together go to the executor as one batch, in one trip, and a phrase asked for
+# by several of them (with the same options) is synthesised once. The different phrases of a batch are still
+# synthesised one after another: a batch saves the trips and the duplicates, not the synthesis of each phrase.
+#
+#   python http_server.py --diphones ./diphones --port 8000 &
+#   curl -d '{"phrase": "Hello world."}' http://127.0.0.1:8000/synthesise -o hello.wav
+#   curl http://127.0.0.1:8000/metrics
+#
+# POST /synthesise takes the JSON request of the daemon (see client.py): the phrase, and optionally the volume,
+# spell, reverse, crossfade, format ("wav" or "pcm") and encoding ("pcm", "ulaw" or "alaw").
+# GET /metrics gives the queue depth, the counters, the latency percentiles and the real-time factor as JSON.
+import argparse
+import asyncio
+import json
+import os
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from main import parse_request
+from profiling import Histogram
+from simpleaudio import WavWriter
+from synth import Synth, SynthOptions, Utterance
+from timescale import MAX_RATE, MIN_RATE
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8000
+QUEUE_SIZE = 64  # the requests that can wait for the synthesiser, more are turned away with 503
+WORKERS = 1  # the threads that synthesise at once, NumPy releases the GIL in the bulk of the concatenation
+BATCH_SIZE = 16  # the most small requests synthesised in one batch
+BATCH_WINDOW = 0.0  # unit: second, how long a small request waits under load for others to be batched with it
+SMALL_PHRASE = 200  # the characters of the longest phrase batched, longer ones are streamed on their own
+JOB_CHUNKS = 16  # the chunks of audio a job holds for its client, the synthesis waits while it is slow to take them
+MAX_HEADER = 65536  # the longest request line and headers read
+MAX_BODY = 2**20  # the biggest request body read
+RETRY_AFTER = 1  # unit: second, when a client turned away with 503 is told to try again
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 411: 'Length Required',
+           413: 'Payload Too Large', 431: 'Request Header Fields Too Large', 500: 'Internal Server Error',
+           503: 'Service Unavailable'}
+CONTENT_TYPES = {'wav': 'audio/wav', 'pcm': 'application/octet-stream'}
+
+
+# a request to synthesise a phrase, on its way from the connection to the synthesiser and back
+# the synthesiser (in a thread of the executor) writes the encoded audio to it as a file, and every flush
+# hands what was written over to the event loop, where the connection sends it on
+# the end of the audio is marked by None, and a failure by its exception
+# the chunks handed over are bounded, so the synthesis of a client that is slow to take its audio waits for it
+# instead of piling the audio up in memory
+class SynthesisJob:
+    def __init__(self, loop: asyncio.AbstractEventLoop, phrase: str, options: SynthOptions, output_format: str,
+                 encoding: str) -> None:
+        self.loop = loop
+        self.phrase = phrase
+        self.options = options
+        self.output_format = output_format
+        self.encoding = encoding
+        self.small = len(phrase) <= SMALL_PHRASE
+        self.chunks = asyncio.Queue(JOB_CHUNKS)
+        self.pending = bytearray()
+        self.cancelled = False  # set when the client goes away, so the synthesis stops early
+        self.arrival_time = perf_counter()
+        self.start_time = None  # when the synthesiser took it up
+
+    # the requests that give the same audio, which a batch synthesises once
+    def get_key(self) -> tuple:
+        return self.phrase, self.options, self.output_format, self.encoding
+
+    def write(self, data: bytes) -> None:
+        if self.cancelled:
+            raise BrokenPipeError('the client went away')
+        self.pending += data
+
+    def flush(self) -> None:
+        if self.pending:
+            self.send(bytes(self.pending))
+            self.pending.clear()
+
+    def seekable(self) -> bool:
+        return False
+
+    # hand data (bytes, None or an exception) over to the event loop, from a thread of the executor
+    # wait while the chunks are full, unless the job is cancelled (its client does not take them any more)
+    def send(self, data: Union[bytes, None, Exception]) -> None:
+        if not self.cancelled:
+            asyncio.run_coroutine_threadsafe(self.chunks.put(data), self.loop).result()
+
+    # stop the job (in the event loop): its synthesis stops at the next write, and a send waiting for room
+    # in the chunks is let through
+    def cancel(self) -> None:
+        self.cancelled = True
+        while not self.chunks.empty():
+            self.chunks.get_nowait()
+
+
+# the warm synthesiser, with the queue of the requests waiting for it and the metrics of the service
+# the Synth is shared by the threads of the executor, every one of them synthesising a batch (see run), so a request
+# never changes it: the options of a request are a SynthOptions of its own, made when it comes in and given to
+# every call that synthesises it
+class SynthesisService:
+    def __init__(self, synth: Synth, queue_size: int=QUEUE_SIZE, batch_size: int=BATCH_SIZE,
+                 batch_window: float=BATCH_WINDOW, workers: int=WORKERS) -> None:
+        self.synth = synth
+        self.queue = asyncio.Queue(queue_size)
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='synthesis')
+        self.held = None  # a big request taken from the queue while a batch was being made, which goes next
+        self.active = set()  # the jobs submitted whose audio has not all been sent, cancelled when the service stops
+        self.start_time = perf_counter()
+        self.counters = {'requests': 0, 'served': 0, 'rejected': 0, 'failed': 0, 'cancelled': 0, 'batches': 0,
+                         'batched_requests': 0, 'synthesised_phrases': 0}
+        self.audio_seconds = 0.0
+        # latencies in seconds: waiting in the queue, until the first audio is sent, and until all of it is sent
+        self.histograms = {name: Histogram() for name in ('queue_wait', 'first_audio', 'total', 'real_time_factor')}
+
+    # queue a job, or raise asyncio.QueueFull if there is no room for it
+    def submit(self, job: SynthesisJob) -> None:
+        self.counters['requests'] += 1
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.counters['rejected'] += 1
+            raise
+        self.active.add(job)
+
+    # take the next jobs from the queue: a big request on its own, or a batch of the small requests waiting
+    async def next_batch(self) -> List[SynthesisJob]:
+        job = self.held or await self.queue.get()
+        self.held = None
+        if not job.small:
+            return [job]
+        # under load (other requests are waiting already), wait a moment for the small requests on their way,
+        # unless there are enough for a batch, so a request on its own is never held back
+        if self.batch_window and 0 < self.queue.qsize() < self.batch_size - 1:
+            await asyncio.sleep(self.batch_window)
+        batch = [job]
+        while len(batch) < self.batch_size and not self.queue.empty():
+            job = self.queue.get_nowait()
+            if not job.small:
+                self.held = job
+                break
+            batch.append(job)
+        return batch
+
+    # synthesise the jobs in the queue, one batch at a time, until cancelled
+    # there is a run for every thread of the executor, so that many batches are synthesised at once
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [job for job in await self.next_batch() if not job.cancelled]
+            if not batch:
+                continue
+            for job in batch:
+                job.start_time = perf_counter()
+                self.histograms['queue_wait'].add(job.start_time - job.arrival_time)
+            if len(batch) == 1 and not batch[0].small:
+                results = [await loop.run_in_executor(self.executor, self.synthesise_stream, batch[0])]
+            else:
+                results = await loop.run_in_executor(self.executor, self.synthesise_batch, batch)
+                self.counters['batches'] += 1
+                self.counters['batched_requests'] += len(batch)
+            # the metrics are only changed in the event loop, so they need no lock
+            for synthesis_time, audio_seconds in results:
+                self.counters['synthesised_phrases'] += 1
+                self.audio_seconds += audio_seconds
+                if audio_seconds:
+                    self.histograms['real_time_factor'].add(synthesis_time / audio_seconds)
+
+    # the diphone sequence (as diphone IDs) and the word spans of a phrase
+    def prepare(self, phrase: str, options: SynthOptions) -> Tuple[np.ndarray, np.ndarray]:
+        utt = Utterance(phrase, spell=options.spell, reverse=options.reverse, lexicon=self.synth.lexicon)
+        return utt.get_diphone_ids(utt.get_phone_ids()), utt.get_word_spans()
+
+    # synthesise a big request, and stream its audio as it is made (in the executor)
+    # return the seconds the synthesis took and the seconds of audio it made
+    def synthesise_stream(self, job: SynthesisJob) -> Tuple[float, float]:
+        start_time = perf_counter()
+        samples = 0
+        try:
+            diphone_seq, word_spans = self.prepare(job.phrase, job.options)
+            with WavWriter(job, self.synth.rate, raw=job.output_format == 'pcm', encoding=job.encoding) as writer:
+                for chunk in self.synth.iter_audio(diphone_seq, word_spans=word_spans, gain=job.options.get_gain(),
+                                                   options=job.options):
+                    writer.write(chunk)
+                    job.flush()
+                    samples += len(chunk)
+        except BrokenPipeError:
+            pass
+        except Exception as error:
+            job.send(error)
+            return perf_counter() - start_time, samples / self.synth.rate
+        job.send(None)
+        return perf_counter() - start_time, samples / self.synth.rate
+
+    # synthesise a batch of small requests (in the executor) and send each its audio
+    # the requests asking for the same audio are synthesised once, the others one after another as usual
+    # return the seconds the synthesis took and the seconds of audio it made, for every phrase synthesised
+    def synthesise_batch(self, jobs: List[SynthesisJob]) -> List[Tuple[float, float]]:
+        groups = {}
+        for job in jobs:
+            groups.setdefault(job.get_key(), []).append(job)
+        results = []
+        for group in groups.values():
+            job = group[0]
+            start_time = perf_counter()
+            try:
+                diphone_seq, word_spans = self.prepare(job.phrase, job.options)
+                audio = self.synth.get_output_audio_of_diphone_seq(diphone_seq, word_spans, gain=job.options.get_gain(),
+                                                                   options=job.options)
+                output = BytesIO()
+                with WavWriter(output, audio.rate, raw=job.output_format == 'pcm', encoding=job.encoding) as writer:
+                    writer.write(audio.data)
+            except Exception as error:
+                for job in group:
+                    job.send(error)
+                continue
+            results.append((perf_counter() - start_time, len(audio.data) / audio.rate))
+            for job in group:
+                job.send(output.getvalue())
+                job.send(None)
+        return results
+
+    # the metrics of the service, with the latencies in ms
+    def get_metrics(self) -> Dict[str, object]:
+        uptime = perf_counter() - self.start_time
+        latency = {}
+        for name in ('queue_wait', 'first_audio', 'total'):
+            summary = self.histograms[name].summary()
+            latency[name] = {key: value * 1e3 if key != 'count' else value for key, value in summary.items()}
+        batches = self.counters['batches']
+        return {'uptime': uptime, 'queue_depth': self.queue.qsize(), 'queue_size': self.queue.maxsize,
+                **self.counters,
+                'mean_batch_size': self.counters['batched_requests'] / batches if batches else 0.0,
+                'audio_seconds': self.audio_seconds, 'latency_ms': latency,
+                'real_time_factor': self.histograms['real_time_factor'].summary()}
+
+    # record the latencies of a job that has been sent
+    def finish(self, job: SynthesisJob, first_audio_time: float) -> None:
+        self.counters['served'] += 1
+        self.histograms['first_audio'].add(first_audio_time - job.arrival_time)
+        self.histograms['total'].add(perf_counter() - job.arrival_time)
+
+
+# the status line and headers of a response
+def make_head(status: int, headers: Dict[str, object]) -> bytes:
+    lines = ['HTTP/1.1 {} {}'.format(status, REASONS[status])]
+    lines.extend('{}: {}'.format(name, value) for name, value in headers.items())
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+# send a whole JSON response
+async def send_json(writer: asyncio.StreamWriter, status: int, message: Dict[str, object],
+                    headers: Optional[Dict[str, object]]=None, keep_alive: bool=True) -> None:
+    body = json.dumps(message).encode('utf-8')
+    head = {'Content-Type': 'application/json', 'Content-Length': len(body),
+            'Connection': 'keep-alive' if keep_alive else 'close', **(headers or {})}
+    writer.write(make_head(status, head) + body)
+    await writer.drain()
+
+
+# read a request from the connection, and return its method, path, headers and body
+# return None when the client closed the connection between two requests
+# raise ValueError with the status to answer if the request is not one that can be read
+async def read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError as error:
+        if error.partial.strip():
+            raise ValueError(400)
+        return None
+    except asyncio.LimitOverrunError:
+        raise ValueError(431)
+    lines = head.decode('latin-1').split('\r\n')
+    parts = lines[0].split()
+    if len(parts) != 3 or not parts[2].startswith('HTTP/1.'):
+        raise ValueError(400)
+    method, target, version = parts
+    headers = {'connection': 'close'} if version == 'HTTP/1.0' else {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        raise ValueError(411)
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise ValueError(400)
+    if length > MAX_BODY:
+        raise ValueError(413)
+    body = await reader.readexactly(length) if length > 0 else b''
+    return method, target.split('?', 1)[0], headers, body
+
+
+# answer a request to synthesise a phrase: queue it, and stream its audio back when the synthesiser gets to it
+# return whether the connection can be kept for another request
+async def handle_synthesis(service: SynthesisService, writer: asyncio.StreamWriter, body: bytes,
+                           keep_alive: bool) -> bool:
+    try:
+        request = json.loads(body)
+        if not isinstance(request, dict):
+            raise ValueError('the request should be a JSON object')
+        phrase, request_options, output_format, encoding = parse_request(request)
+    except ValueError as error:
+        await send_json(writer, 400, {'status': 'error', 'message': str(error)}, keep_alive=keep_alive)
+        return keep_alive
+    # the options of the request replace the ones of the Synth, and every request starts without emphasis
+    options = service.synth.options._replace(emphasis=False, **request_options)
+    job = SynthesisJob(asyncio.get_running_loop(), phrase, options, output_format, encoding)
+    try:
+        service.submit(job)
+    except asyncio.QueueFull:
+        await send_json(writer, 503, {'status': 'error', 'message': 'the synthesiser is busy'},
+                        headers={'Retry-After': RETRY_AFTER}, keep_alive=keep_alive)
+        return keep_alive
+
+    try:
+        # the status is only known once the synthesis has started, so nothing is sent before the first audio
+        data = await job.chunks.get()
+        if isinstance(data, Exception):
+            service.counters['failed'] += 1
+            status = 400 if isinstance(data, ValueError) else 500
+            await send_json(writer, status, {'status': 'error', 'message': str(data)}, keep_alive=keep_alive)
+            return keep_alive
+        first_audio_time = perf_counter()
+        writer.write(make_head(200, {'Content-Type': CONTENT_TYPES[output_format],
+                                     'X-Sample-Rate': service.synth.rate, 'X-Encoding': encoding,
+                                     'Transfer-Encoding': 'chunked',
+                                     'Connection': 'keep-alive' if keep_alive else 'close'}))
+        while data is not None:
+            if isinstance(data, Exception):
+                # the headers are gone already, so the client can only tell from the unfinished response
+                service.counters['failed'] += 1
+                return False
+            writer.write(b'%x\r\n%s\r\n' % (len(data), data))
+            # wait while the client is slow to take the audio, so its socket buffer does not grow without bound
+            await writer.drain()
+            data = await job.chunks.get()
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+        job.cancel()
+        service.counters['cancelled'] += 1
+        raise
+    finally:
+        service.active.discard(job)
+    service.finish(job, first_audio_time)
+    return keep_alive
+
+
+# serve the requests of a connection, one after another while the client keeps it open
+async def handle_connection(service: SynthesisService, reader: asyncio.StreamReader,
+                            writer: asyncio.StreamWriter) -> None:
+    try:
+        while True:
+            try:
+                request = await read_request(reader)
+            except ValueError as error:
+                status = error.args[0]
+                await send_json(writer, status, {'status': 'error', 'message': REASONS[status]}, keep_alive=False)
+                break
+            if request is None:
+                break
+            method, path, headers, body = request
+            keep_alive = headers.get('connection', '').lower() != 'close'
+            if path == '/synthesise':
+                if method != 'POST':
+                    await send_json(writer, 405, {'status': 'error', 'message': 'use POST'},
+                                    headers={'Allow': 'POST'}, keep_alive=keep_alive)
+                else:
+                    keep_alive = await handle_synthesis(service, writer, body, keep_alive)
+            elif path == '/metrics':
+                await send_json(writer, 200, service.get_metrics(), keep_alive=keep_alive)
+            elif path == '/health':
+                await send_json(writer, 200, {'status': 'ok'}, keep_alive=keep_alive)
+            else:
+                await send_json(writer, 404, {'status': 'error', 'message': 'no such path'}, keep_alive=keep_alive)
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+# keep the Synth warm and serve HTTP on the host and port until stopped (with Ctrl-C or SIGTERM)
+async def serve(synth: Synth, host: str=DEFAULT_HOST, port: int=DEFAULT_PORT, queue_size: int=QUEUE_SIZE,
+                batch_size: int=BATCH_SIZE, batch_window: float=BATCH_WINDOW, workers: int=WORKERS) -> None:
+    service = SynthesisService(synth, queue_size, batch_size, batch_window, workers)
+    loop = asyncio.get_running_loop()
+    stopped = asyncio.Event()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, stopped.set)
+    server = await asyncio.start_server(lambda reader, writer: handle_connection(service, reader, writer),
+                                        host, port, limit=MAX_HEADER)
+    runs = [asyncio.create_task(service.run()) for _ in range(workers)]
+    print('Serving on http://{}:{} with {} synthesis threads'.format(host, port, workers))
+    try:
+        await stopped.wait()
+    finally:
+        server.close()
+        for run in runs:
+            run.cancel()
+        for job in list(service.active):
+            job.cancel()
+        # the synthesis threads may wait for the event loop (see SynthesisJob.send), so it keeps running meanwhile
+        await loop.run_in_executor(None, service.executor.shutdown)
+        print('Stopped serving on http://{}:{}'.format(host, port))
+
+
+# process the commandline and return args
+def process_commandline(argv: Optional[list]=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Serve the synthesiser over HTTP.')
+    parser.add_argument('--diphones', default="./diphones",
+                        help="Folder containing diphone wavs, or a voice file packed by build_voice.py")
+    parser.add_argument('--host', default=DEFAULT_HOST, help="The address to listen on")
+    parser.add_argument('--port', default=DEFAULT_PORT, type=int, help="The port to listen on")
+    parser.add_argument('--queue-size', default=QUEUE_SIZE, type=int,
+                        help="The requests that can wait for the synthesiser, more are turned away with 503")
+    parser.add_argument('--workers', default=WORKERS, type=int,
+                        help="The threads that synthesise at once, all sharing one Synth")
+    parser.add_argument('--batch-size', default=BATCH_SIZE, type=int,
+                        help="The most small requests synthesised in one batch")
+    parser.add_argument('--batch-window', default=BATCH_WINDOW * 1e3, type=float, metavar='MS',
+                        help="How long a small request waits for others to be batched with it, 0 to only batch "
+                             "the requests waiting already")
+    parser.add_argument('--output-rate', default=None, type=int, metavar='HZ',
+                        help="The sample rate of the output, the rate of the voice if not given")
+    parser.add_argument('--rate', dest="speaking_rate", default=1.0, type=float,
+                        help="The speaking rate, from {} to {}".format(MIN_RATE, MAX_RATE))
+    parser.add_argument('--word-cache', default=None, type=float, metavar='MB',
+                        help="Cache the synthesised words in a memory budget of the given MB")
+    parser.add_argument('--internal-format', default='int16', choices=['int16', 'float32'],
+                        help="The type the audio is assembled in")
+    # every request gives its own options (see handle_synthesis), these are only the defaults they start from
+    parser.set_defaults(crossfade=False, reverse=None)
+    args = parser.parse_args(argv)
+    if args.queue_size < 1 or args.batch_size < 1 or args.workers < 1:
+        parser.error('"--queue-size", "--batch-size" and "--workers" must be at least 1')
+    if args.batch_window < 0:
+        parser.error('"--batch-window" cannot be negative')
+    if not MIN_RATE <= args.speaking_rate <= MAX_RATE:
+        parser.error('"--rate" must be between {} and {}'.format(MIN_RATE, MAX_RATE))
+    return args
+
+
+if __name__ == "__main__":
+    args = process_commandline()
+    if not os.path.exists(args.diphones):
+        print("The file path doesn't exist, please check the input path.")
+    else:
+        print(f'Will load wavs from: {args.diphones}')
+        diphone_synth = Synth(args)
+        asyncio.run(serve(diphone_synth, args.host, args.port, args.queue_size, args.batch_size,
+                          args.batch_window / 1e3, args.workers))
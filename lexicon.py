@@ -0,0 +1,247 @@
+from collections import OrderedDict
+from threading import Lock
+from time import perf_counter
+from typing import BinaryIO, Iterable, List, Optional, Sequence, Tuple
+import mmap
+import os
+import re
+import struct
+
+import numpy as np
+
+from phones import PHONE_IDS, ids_to_phones
+
+# the compiled lexicon cache layout:
+#   header - magic, version, number of words, the size and modification time of the cmudict file it was
+#            compiled from, and where each section starts
+#   phones - the names of the phones, separated by spaces (the phone IDs are positions in this list)
+#   words  - uint32 offsets into a utf-8 blob of the words, sorted so that they can be binary searched
+#   prons  - uint32 offsets into a uint8 array of the phone IDs of the pronunciation of every word
+LEXICON_MAGIC = b'DIPHLEX1'
+LEXICON_VERSION = 1
+LEXICON_HEADER = struct.Struct('<8sHHIQQQQQ')
+LEXICON_ALIGN = 64  # the sections are aligned so that numpy views of them are aligned too
+LOOKUP_MEMO = 65536  # the most words whose pronunciation is memoised, the ones looked up least recently are dropped
+
+_default_lexicon = None  # the lexicon shared by every utterance of the process
+_default_lexicon_lock = Lock()
+
+
+# a pronunciation lexicon compiled from cmudict
+# the first pronunciation of every word is kept, with the stress numbers already taken away from the phones,
+# so that the phones match the names of diphone wav files
+class Lexicon:
+    def __init__(self, phones: Sequence[str], words_blob, word_offsets: np.ndarray,
+                 pron_offsets: np.ndarray, pron_phone_ids: np.ndarray) -> None:
+        self.phones = tuple(phones)  # phone ID -> phone name
+        unknown_phones = [phone for phone in self.phones if phone not in PHONE_IDS]
+        if unknown_phones:
+            raise ValueError('the lexicon has phones that are not known: {}'.format(unknown_phones))
+        # the phone IDs of the lexicon -> the phone IDs of phones.py
+        self.phone_id_map = np.array([PHONE_IDS[phone] for phone in self.phones], dtype=np.intp)
+        self.words_blob = words_blob  # the sorted words encoded in utf-8, back to back
+        self.word_offsets = word_offsets  # where every word starts (and the last one ends) in words_blob
+        self.pron_offsets = pron_offsets  # where the phone IDs of every word start (and the last ones end)
+        self.pron_phone_ids = pron_phone_ids
+        self.source_fingerprint = (0, 0)  # the size and modification time of the cmudict file
+        self.load_time = 0.0  # unit: second
+        # the pronunciations of the words found, so that a word in use is only searched for once
+        # the words that are not in the lexicon are not memoised, so text full of them cannot grow the memo
+        self.lookup_memo = OrderedDict()  # word -> phone IDs, the least recently used first
+        self.lookup_lock = Lock()
+
+    # compile a lexicon from (word, pronunciation) entries, keeping the first pronunciation of every word
+    @classmethod
+    def from_entries(cls, entries: Iterable[Tuple[str, List[str]]]) -> 'Lexicon':
+        first_prons = {}
+        for word, pron in entries:
+            if word not in first_prons:
+                first_prons[word] = [re.sub(r'\d', '', phone) for phone in pron]
+        phones = sorted({phone for pron in first_prons.values() for phone in pron})
+        phone_ids = {phone: num for num, phone in enumerate(phones)}
+
+        encoded_words = sorted((word.encode('utf-8'), word) for word in first_prons)
+        word_offsets = np.zeros(len(encoded_words) + 1, dtype='<u4')
+        word_offsets[1:] = np.cumsum([len(encoded) for encoded, _ in encoded_words])
+        pron_offsets = np.zeros(len(encoded_words) + 1, dtype='<u4')
+        pron_offsets[1:] = np.cumsum([len(first_prons[word]) for _, word in encoded_words])
+        pron_phone_ids = np.array([phone_ids[phone] for _, word in encoded_words for phone in first_prons[word]],
+                                  dtype=np.uint8)
+        return cls(phones, b''.join(encoded for encoded, _ in encoded_words), word_offsets,
+                   pron_offsets, pron_phone_ids)
+
+    # compile the lexicon from the cmudict of NLTK
+    @classmethod
+    def from_cmudict(cls) -> 'Lexicon':
+        from nltk.corpus import cmudict
+        start_time = perf_counter()
+        lexicon = cls.from_entries(cmudict.entries())
+        lexicon.source_fingerprint = get_cmudict_fingerprint()
+        lexicon.load_time = perf_counter() - start_time
+        return lexicon
+
+    # map a compiled lexicon cache into memory, nothing is read until a word is looked up
+    @classmethod
+    def from_cache(cls, cache_file: str) -> 'Lexicon':
+        start_time = perf_counter()
+        with open(cache_file, 'rb') as file_to_read:
+            cache = mmap.mmap(file_to_read.fileno(), 0, access=mmap.ACCESS_READ)
+        lexicon = cls.from_buffer(cache, cache_file)
+        lexicon.load_time = perf_counter() - start_time
+        return lexicon
+
+    # read a compiled lexicon from a buffer (e.g. a mapped file or shared memory), described by source in the errors
+    # the words and pronunciations are zero-copy views of the buffer
+    @classmethod
+    def from_buffer(cls, cache, source: str) -> 'Lexicon':
+        if len(cache) < LEXICON_HEADER.size:
+            raise ValueError('"{}" is not a compiled lexicon.'.format(source))
+        (magic, version, _, count, source_size, source_mtime,
+         phones_start, words_start, prons_start) = LEXICON_HEADER.unpack_from(cache)
+        if magic != LEXICON_MAGIC or version != LEXICON_VERSION:
+            raise ValueError('"{}" is not a compiled lexicon of version {}.'.format(source, LEXICON_VERSION))
+
+        phones = bytes(cache[phones_start:words_start]).rstrip(b'\0').decode('ascii').split()
+        word_offsets = np.frombuffer(cache, dtype='<u4', count=count + 1, offset=words_start)
+        blob_start = words_start + word_offsets.nbytes
+        # the words blob is a memoryview of the mapped file, so slicing it does not copy the whole blob
+        words_blob = memoryview(cache)[blob_start:blob_start + int(word_offsets[-1])]
+        pron_offsets = np.frombuffer(cache, dtype='<u4', count=count + 1, offset=prons_start)
+        pron_phone_ids = np.frombuffer(cache, dtype=np.uint8, count=int(pron_offsets[-1]),
+                                       offset=prons_start + pron_offsets.nbytes)
+
+        lexicon = cls(phones, words_blob, word_offsets, pron_offsets, pron_phone_ids)
+        lexicon.source_fingerprint = (source_size, source_mtime)
+        return lexicon
+
+    # load the compiled lexicon from the cache file if it is still up to date with cmudict,
+    # otherwise compile it from cmudict and save it to the cache file for the next time
+    @classmethod
+    def load(cls, cache_file: Optional[str]=None) -> 'Lexicon':
+        if cache_file is None:
+            cache_file = get_default_cache_file()
+        try:
+            lexicon = cls.from_cache(cache_file)
+        except (OSError, ValueError):
+            lexicon = None
+        if lexicon is not None and lexicon.source_fingerprint == get_cmudict_fingerprint():
+            return lexicon
+
+        lexicon = cls.from_cmudict()
+        try:
+            lexicon.save_cache(cache_file)
+        except OSError as error:
+            print('cannot save the compiled lexicon to "{}": {}'.format(cache_file, error))
+        return lexicon
+
+    # write the compiled lexicon to a cache file
+    def save_cache(self, cache_file: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+        # write to a temporary file first, so another process never sees a half written cache
+        tmp_file = '{}.tmp{}'.format(cache_file, os.getpid())
+        with open(tmp_file, 'wb') as file_to_write:
+            self.write_cache(file_to_write)
+        os.replace(tmp_file, cache_file)
+
+    # write the compiled lexicon in the cache layout to a binary file
+    def write_cache(self, file_to_write: BinaryIO) -> None:
+        phones = ' '.join(self.phones).encode('ascii')
+        phones_start = align(LEXICON_HEADER.size)
+        words_start = align(phones_start + len(phones))
+        prons_start = align(words_start + self.word_offsets.nbytes + len(self.words_blob))
+        header = LEXICON_HEADER.pack(LEXICON_MAGIC, LEXICON_VERSION, 0, len(self), *self.source_fingerprint,
+                                     phones_start, words_start, prons_start)
+
+        start = file_to_write.tell()
+        file_to_write.write(header)
+        file_to_write.write(bytes(start + phones_start - file_to_write.tell()))
+        file_to_write.write(phones)
+        file_to_write.write(bytes(start + words_start - file_to_write.tell()))
+        file_to_write.write(self.word_offsets.astype('<u4').tobytes())
+        file_to_write.write(self.words_blob)
+        file_to_write.write(bytes(start + prons_start - file_to_write.tell()))
+        file_to_write.write(self.pron_offsets.astype('<u4').tobytes())
+        file_to_write.write(self.pron_phone_ids.tobytes())
+
+    # find the position of the word in the sorted words by binary search, -1 if it is not in the lexicon
+    def find(self, word: str) -> int:
+        key = word.encode('utf-8')
+        offsets = self.word_offsets
+        low, high = 0, len(offsets) - 1
+        while low < high:
+            middle = (low + high) // 2
+            middle_word = bytes(self.words_blob[offsets[middle]:offsets[middle + 1]])
+            if middle_word < key:
+                low = middle + 1
+            elif middle_word > key:
+                high = middle
+            else:
+                return middle
+        return -1
+
+    # get the pronunciation of the word as an array of phone IDs (as in phones.py), None if the word is not in the lexicon
+    def get_ids(self, word: str) -> Optional[np.ndarray]:
+        with self.lookup_lock:
+            phone_ids = self.lookup_memo.get(word)
+            if phone_ids is not None:
+                self.lookup_memo.move_to_end(word)
+                return phone_ids
+        num = self.find(word)
+        if num < 0:
+            return None
+        phone_ids = self.phone_id_map[self.pron_phone_ids[self.pron_offsets[num]:self.pron_offsets[num + 1]]]
+        phone_ids.flags.writeable = False  # the memo is shared, so make sure nobody changes it
+        with self.lookup_lock:
+            self.lookup_memo[word] = phone_ids
+            if len(self.lookup_memo) > LOOKUP_MEMO:
+                self.lookup_memo.popitem(last=False)
+        return phone_ids
+
+    # get the pronunciation of the word as a list of phones, None if the word is not in the lexicon
+    def get(self, word: str) -> Optional[List[str]]:
+        phone_ids = self.get_ids(word)
+        return None if phone_ids is None else ids_to_phones(phone_ids)
+
+    def __contains__(self, word: str) -> bool:
+        return self.get_ids(word) is not None
+
+    def __getitem__(self, word: str) -> List[str]:
+        pron = self.get(word)
+        if pron is None:
+            raise KeyError(word)
+        return pron
+
+    def __len__(self) -> int:
+        return len(self.word_offsets) - 1
+
+
+# the lexicon of the process, loaded the first time it is needed and then shared
+def get_default_lexicon() -> Lexicon:
+    global _default_lexicon
+    with _default_lexicon_lock:
+        if _default_lexicon is None:
+            _default_lexicon = Lexicon.load()
+        return _default_lexicon
+
+
+# where the compiled lexicon is cached, unless another cache file is given
+def get_default_cache_file() -> str:
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'speech_synthesiser', 'cmudict.lex')
+
+
+# the size and modification time of the cmudict file, used to tell if a compiled lexicon is out of date
+def get_cmudict_fingerprint() -> Tuple[int, int]:
+    from nltk.corpus import cmudict
+    pointer = cmudict.abspath('cmudict')
+    try:
+        path = pointer.path if hasattr(pointer, 'path') else pointer.zipfile.filename
+        stat = os.stat(path)
+    except (AttributeError, OSError):
+        return 0, 0
+    return stat.st_size, stat.st_mtime_ns
+
+
+# round a file position up to the alignment of the lexicon cache sections
+def align(position: int) -> int:
+    return -(-position // LEXICON_ALIGN) * LEXICON_ALIGN
@@ -1,86 +1,353 @@
 import argparse
 import re
 import os
+import signal
+import socket
+import stat
+import sys
+from time import perf_counter
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import BinaryIO, Generator, Iterable, Iterator, List, Optional, TextIO, Tuple, Union
 import numpy as np
 
-from synth import Synth, Utterance
-from simpleaudio import Audio
+from document import iter_phrases
+from profiling import Profiler, get_profiler, set_profiler, stage
+from sentence_cache import SentenceCache
+from shared_voice import SharedVoice, attach_shared_voice
+from synth import REVERSE_WAYS, Synth, SynthOptions, Utterance, carry_emphasis
+from timescale import MAX_RATE, MIN_RATE
+from client import DEFAULT_SOCKET, OUTPUT_FORMATS, read_message, write_message
+from simpleaudio import ENCODING_PCM, ENCODINGS, WavWriter
+from sinks import FileSink, NullSink, PyAudioSink, Sink
 
-# process and synthesise the phrase and output the audio
-def process_phrase_to_output(phrase: str) -> Audio:
+# the synthesis functions take the Synth and the options (see SynthOptions) they use, and change neither,
+# so they can be called from several threads with one Synth
+
+# process the phrase into the diphone sequence (as diphone IDs) to synthesise, together with its word spans
+def process_phrase(synth: Synth, phrase: str, options: SynthOptions) -> Tuple[np.ndarray, np.ndarray]:
     # get the synthesised sequence of words
-    utt = Utterance(phrase=phrase, reverse=args.reverse, spell=args.spell)
-    # expand the word sequence to a phone sequence
-    phone_seq = utt.get_phone_seq()
-    # expand the phone sequence to a corresponding diphone sequence
-    diphone_seq = utt.get_diphone_seq(phone_seq)
-    # get the audio of the diphone sequence
-    output_audio = diphone_synth.get_output_audio_of_diphone_seq(diphone_seq)
-    volume_control(output_audio)  # check the volume control
-
-    # if the user input '-p', then play the audio
-    if args.play:
-        output_audio.play()
-
-    return output_audio
-
-# save the audio as the name given by user
-def save_audio(audio: Audio) -> None:
-    save_filename = args.outfile
+    with stage('normalisation'):
+        utt = Utterance(phrase=phrase, reverse=options.reverse, spell=options.spell, lexicon=synth.lexicon)
+    # expand the word sequence to a phone sequence (as phone IDs)
+    with stage('lexicon'):
+        phone_ids = utt.get_phone_ids()
+    # expand the phone sequence to a corresponding diphone sequence (as diphone IDs)
+    with stage('diphone_sequence'):
+        diphone_seq = utt.get_diphone_ids(phone_ids)
+        word_spans = utt.get_word_spans()
+    return diphone_seq, word_spans
+
+# synthesise a diphone sequence, and give the audio out as a stream of chunks
+def synthesise_to_stream(synth: Synth, diphone_seq: np.ndarray, word_spans: np.ndarray,
+                         options: SynthOptions) -> Iterator[np.ndarray]:
+    rescale_factor = get_rescale_factor(options.volume)  # check the volume control
+    # get the audio of the diphone sequence chunk by chunk, the synthesiser applies the volume as the last step
+    yield from synth.iter_audio(diphone_seq, word_spans=word_spans, gain=rescale_factor, options=options)
+
+# process and synthesise the phrase, and give the audio out as a stream of chunks
+# the generator returns the switch of emphasis after the phrase, for the phrase after it
+def process_phrase_to_stream(synth: Synth, phrase: str, options: SynthOptions) -> Generator[np.ndarray, None, bool]:
+    # with --profile, the stages of the phrase are timed as one utterance
+    profiler = get_profiler()
+    if profiler is not None:
+        profiler.begin_utterance()
+    diphone_seq, word_spans = process_phrase(synth, phrase, options)
+    samples = 0
+    for chunk in synthesise_to_stream(synth, diphone_seq, word_spans, options):
+        samples += len(chunk)
+        yield chunk
+    if profiler is not None:
+        profiler.end_utterance(samples / synth.rate)
+    return carry_emphasis(diphone_seq, options.emphasis)
+
+# open the sinks that the audio goes to, as the user asked in output_args (the commandline)
+def open_sinks(rate: int, output_args: argparse.Namespace) -> List[Sink]:
+    sinks = []
+    # if the user input '-o' and a filename, write the chunks to the file as they are synthesised
+    if output_args.outfile is not None:
+        sinks.append(FileSink(get_save_filename(output_args.outfile, output_args.raw), rate=rate,
+                              raw=output_args.raw, encoding=output_args.encoding))
+    # if the user input '-p', then play the audio while it is being synthesised
+    if output_args.play:
+        if output_args.sink == 'null':
+            sinks.append(NullSink(rate=rate, realtime=True))
+        else:
+            sinks.append(PyAudioSink(rate=rate))
+    return sinks
+
+# output a stream of audio chunks (at the rate) as the user asked in output_args (the commandline), one chunk at
+# a time, so that the memory stays flat
+def output_audio_stream(chunks: Iterable[np.ndarray], rate: int, output_args: argparse.Namespace) -> None:
+    sinks = open_sinks(rate, output_args)
+    try:
+        if output_args.play:
+            print("Playing...")
+        for chunk in chunks:
+            with stage('output'):
+                for sink in sinks:
+                    sink.write(chunk)
+    finally:
+        for sink in sinks:
+            sink.close()
+    if output_args.play:
+        stats = sinks[-1].stats()
+        print("Stopped playing ({:.1f} s of audio, {} underruns)".format(stats['seconds'], stats['underruns']))
+
+# get the filename for saving, as given by user (the outfile, raw or not), or the standard output for '-'
+def get_save_filename(outfile: str, raw: bool=False) -> Union[str, BinaryIO]:
+    if outfile == '-':
+        # the messages go to the standard error instead (see __main__), this is the real standard output
+        return sys.__stdout__.buffer
+    save_filename = outfile
+    # a raw file is not a wav file, it keeps the name it is given
+    if raw:
+        print("Save it as {}".format(save_filename))
+        return save_filename
     # first check if the given filename for saving has a suffix ".wav"
     # if not, add the ".wav" to the filename
     if re.findall(r'[^.]+$', save_filename) != ["wav"]:
         save_filename += ".wav"
     print("Save it as {}".format(save_filename))
-    audio.save(save_filename)
-    
+    return save_filename
 
-# control the volume to change the amplitude of the synthesised waveform
-def volume_control(audio: Audio) -> Audio:
-    if args.volume is not None:
-        print("Control the volume to: {}".format(args.volume))
+
+# get the factor that changes the amplitude of the synthesised waveform to the volume given by user
+def get_rescale_factor(volume: Optional[int]) -> Optional[float]:
+    if volume is not None:
+        print("Control the volume to: {}".format(volume))
         # check if the input volume is an integer between 0 and 100
-        if (args.volume >= 0) & (args.volume <= 100):
-            rescale_factor = args.volume/100  # convert the input volume number to a number between 0 and 1
-            # change the amplitude of the synthesised waveform
-            audio.data = (audio.data * rescale_factor).astype(audio.nptype)
-            return audio
+        if (volume >= 0) & (volume <= 100):
+            return volume/100  # convert the input volume number to a number between 0 and 1
         else:
             print("Please enter a volume number between 0 and 100.")
+    return None
 
 
-# process the input text (after --fromfile)
-def process_from_file(text_file_name: str) -> Audio:
-    # create an empty phrase list to temporarily store the sentence in the text file
-    phrase_tmp = ''
-    data_tmp = np.array([], dtype=diphone_synth.nptype)  # create an empty data array to store wav information
-    # open the given file
-    with open(text_file_name, 'r') as file_to_read:
-        while True:  # a potentially forever loop
-            line = file_to_read.readline()  # read the text line by line
-            # if the text reach the end, process the phrase_tmp and break the loop
-            if not line:
-                if phrase_tmp != '':
-                    audio_tmp = process_phrase_to_output(phrase_tmp)
-                    data_tmp = np.concatenate((data_tmp, audio_tmp.data))
-                break
-            # find the position of ".", "!", ":" and "?" in each processing line
-            period_iter = re.finditer(r"[.!?:]", line)
-            index_period = [m.start(0) for m in period_iter]
-            # if there is no such punctuation, put the whole line into phrase_tmp and process the next line
-            if not index_period:
-                phrase_tmp += line
-            # if this line has such punctuation, put the phrase before the last punctuation into phrase_tmp
-            else:
-                phrase_tmp += line[:index_period[-1]+1]
-                # from the phrase_tmp which contains one or several complete sentences, initial an audio
-                audio_tmp = process_phrase_to_output(phrase_tmp)
-                # extend the data_tmp by adding the wav data of the new phrase to its end
-                data_tmp = np.concatenate((data_tmp, audio_tmp.data))
-                # reset the phrase_tmp to the rest text of the line
-                phrase_tmp = line[index_period[-1]+1:]
-    audio_tmp.data = data_tmp
-    return audio_tmp
+# process the phrase as process_phrase_to_stream does, unless its audio is in the sentence cache already,
+# and save the audio of a phrase synthesised here to the cache
+def process_phrase_with_cache(synth: Synth, phrase: str, options: SynthOptions,
+                              sentence_cache: SentenceCache) -> Generator[np.ndarray, None, bool]:
+    key = sentence_cache.get_key(phrase, options)
+    cached = sentence_cache.get(key)
+    if cached is not None:
+        samples, emphasis = cached
+        yield samples
+        return emphasis
+    # keep the chunks given out for the cache, unless the phrase turns out too big for it
+    chunks = []
+    nbytes = 0
+    stream = process_phrase_to_stream(synth, phrase, options)
+    while True:
+        try:
+            chunk = next(stream)
+        except StopIteration as stop:
+            emphasis = stop.value
+            break
+        if chunks is not None:
+            chunks.append(chunk)
+            nbytes += chunk.nbytes
+            if nbytes > sentence_cache.max_bytes:
+                chunks = None
+        yield chunk
+    if chunks is not None:
+        sentence_cache.put(key, np.concatenate([np.array([], dtype=synth.nptype), *chunks]), emphasis)
+    return emphasis
+
+# process the input text (after --fromfile) and give the audio out as a stream of chunks
+# the text is split into phrases as it is read, and every phrase is synthesised on its own,
+# so neither the whole text nor the whole audio is ever held in memory
+# the emphasis switch carries on from one phrase to the next
+# with a sentence cache, the phrases found in it are not synthesised again
+def process_from_file(synth: Synth, text_file: TextIO, options: SynthOptions,
+                      sentence_cache: Optional[SentenceCache]=None) -> Iterator[np.ndarray]:
+    for phrase in iter_phrases(text_file):
+        if sentence_cache is None:
+            emphasis = yield from process_phrase_to_stream(synth, phrase, options)
+        else:
+            emphasis = yield from process_phrase_with_cache(synth, phrase, options, sentence_cache)
+        options = options._replace(emphasis=emphasis)
+
+
+# set up a worker process of --jobs, with a Synth for all the phrases it gets
+# the Synth uses the voice and the lexicon shared by the main process (see SharedVoice) if their names are given,
+# otherwise the worker loads its own
+def init_worker(synth_args: argparse.Namespace, shared_names: Optional[Tuple[str, str]]=None) -> None:
+    global worker_synth, worker_voice
+    if synth_args.outfile == '-':
+        sys.stdout = sys.stderr
+    # the shared voice is kept for the life of the worker, as its Synth holds views of it
+    worker_voice = attach_shared_voice(shared_names)
+    if worker_voice is None:
+        worker_synth = Synth(synth_args)
+    else:
+        worker_synth = Synth(synth_args, worker_voice.get_diphone_bank(), worker_voice.get_lexicon())
+
+# synthesise a diphone sequence in a worker process, with the options (and so the emphasis switch) it is given
+def synthesise_in_worker(diphone_seq: np.ndarray, word_spans: np.ndarray, options: SynthOptions) -> np.ndarray:
+    return np.concatenate([np.array([], dtype=worker_synth.nptype),
+                           *synthesise_to_stream(worker_synth, diphone_seq, word_spans, options)])
+
+# wait for the audio of a phrase of process_from_file_in_parallel, and save it to the sentence cache if it has a key
+# (the future, the key and the switch of emphasis after the phrase)
+def get_phrase_result(task: Tuple[Future, Optional[str], bool],
+                      sentence_cache: Optional[SentenceCache]) -> np.ndarray:
+    future, key, emphasis = task
+    samples = future.result()
+    if key is not None:
+        sentence_cache.put(key, samples, emphasis)
+    return samples
+
+# process the input text (after --fromfile) with a pool of worker processes, one phrase per task,
+# and give the audio out as a stream of chunks in the order of the text
+# every worker makes its own Synth with synth_args (the commandline), and with share_voice it uses the voice and
+# the lexicon of synth, published once in shared memory, instead of loading its own copy of them
+# at most `window` phrases are being synthesised or waiting to be given out at a time, so the memory stays bounded
+# with a sentence cache, the phrases found in it are not given to the workers, and the others are saved to it
+def process_from_file_in_parallel(synth: Synth, text_file: TextIO, options: SynthOptions, jobs: int,
+                                  synth_args: argparse.Namespace, share_voice: bool=True,
+                                  window: Optional[int]=None,
+                                  sentence_cache: Optional[SentenceCache]=None) -> Iterator[np.ndarray]:
+    window = window or 4 * jobs
+    shared_voice = None
+    if share_voice:
+        try:
+            shared_voice = SharedVoice.publish(synth.all_diphones, synth.lexicon)
+            print('Shared the voice and the lexicon with the workers ({:.1f} MB)'.format(shared_voice.nbytes / 2**20))
+        except OSError as error:
+            print('cannot share the voice with the workers, every worker loads its own: {}'.format(error))
+    # the emphasis switch carries on from one phrase to the next, so it is followed here in the order of the text
+    in_flight = deque()
+    try:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                                 initargs=(synth_args, shared_voice and shared_voice.names)) as pool:
+            for phrase in iter_phrases(text_file):
+                key = cached = None
+                if sentence_cache is not None:
+                    key = sentence_cache.get_key(phrase, options)
+                    cached = sentence_cache.get(key)
+                if cached is None:
+                    diphone_seq, word_spans = process_phrase(synth, phrase, options)
+                    future = pool.submit(synthesise_in_worker, diphone_seq, word_spans, options)
+                    emphasis = carry_emphasis(diphone_seq, options.emphasis)
+                else:
+                    # a cached phrase still waits for its turn, and it is not saved again
+                    samples, emphasis = cached
+                    future, key = Future(), None
+                    future.set_result(samples)
+                in_flight.append((future, key, emphasis))
+                options = options._replace(emphasis=emphasis)
+                # give out the oldest phrase once the window is full
+                if len(in_flight) >= window:
+                    yield get_phrase_result(in_flight.popleft(), sentence_cache)
+            while in_flight:
+                yield get_phrase_result(in_flight.popleft(), sentence_cache)
+    finally:
+        # the workers have stopped, so the shared memory can go
+        if shared_voice is not None:
+            shared_voice.close()
+
+# choose the serial or the parallel way to process the input text (after --fromfile), by the number of jobs
+# (the workers of the parallel way are set up as process_from_file_in_parallel says)
+def process_text_file(synth: Synth, text_file: TextIO, options: SynthOptions, jobs: int=1,
+                      synth_args: Optional[argparse.Namespace]=None, share_voice: bool=True,
+                      sentence_cache: Optional[SentenceCache]=None) -> Iterator[np.ndarray]:
+    if jobs > 1:
+        return process_from_file_in_parallel(synth, text_file, options, jobs, synth_args, share_voice,
+                                             sentence_cache=sentence_cache)
+    return process_from_file(synth, text_file, options, sentence_cache)
+
+# check a request sent to the daemon, and return its phrase, its options (see REQUEST_OPTIONS, they are fields of
+# SynthOptions), and the format and encoding of the audio it asks for
+def parse_request(request: dict) -> Tuple[str, dict, str, str]:
+    phrase = request.get('phrase')
+    if not isinstance(phrase, str) or not phrase.strip():
+        raise ValueError('the request has no phrase')
+    options = {name: request.get(name, default) for name, default in REQUEST_OPTIONS.items()}
+    volume = options['volume']
+    # JSON true and false are bools, which are ints in Python too, so they are not taken as a volume
+    if volume is not None and (isinstance(volume, bool) or not isinstance(volume, int) or not 0 <= volume <= 100):
+        raise ValueError('the volume should be an int between 0 and 100')
+    for name in ('spell', 'crossfade'):
+        if not isinstance(options[name], bool):
+            raise ValueError('"{}" should be true or false'.format(name))
+    if options['reverse'] is not None and (not isinstance(options['reverse'], str)
+                                           or options['reverse'] not in REVERSE_WAYS):
+        raise ValueError('the reverse way should be one of {}'.format(', '.join(REVERSE_WAYS)))
+    output_format = request.get('format', 'wav')
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError('the format should be one of {}'.format(', '.join(OUTPUT_FORMATS)))
+    encoding = request.get('encoding', ENCODING_PCM)
+    if encoding not in ENCODINGS:
+        raise ValueError('the encoding should be one of {}'.format(', '.join(ENCODINGS)))
+    return phrase, options, output_format, encoding
+
+# synthesise the phrase of a request to the daemon with the warm Synth, and stream the audio back over the connection
+def handle_request(synth: Synth, connection: socket.socket) -> None:
+    start_time = perf_counter()
+    with connection, connection.makefile('rwb') as stream:
+        try:
+            phrase, request_options, output_format, encoding = parse_request(read_message(stream))
+        except ValueError as error:
+            write_message(stream, {'status': 'error', 'message': str(error)})
+            return
+        # the options of the request replace the ones of the Synth, and every request starts without emphasis,
+        # as a new process would
+        options = synth.options._replace(emphasis=False, **request_options)
+        write_message(stream, {'status': 'ok', 'rate': synth.rate, 'channels': 1, 'format': output_format,
+                               'encoding': encoding})
+        with WavWriter(stream, synth.rate, raw=output_format == 'pcm', encoding=encoding) as writer:
+            for chunk in process_phrase_to_stream(synth, phrase, options):
+                writer.write(chunk)
+    print('Served a phrase of {} characters in {:.1f} ms'.format(len(phrase), (perf_counter() - start_time) * 1e3))
+
+# keep the Synth warm and serve the requests sent to the UNIX socket, one at a time, until stopped
+# a request that fails only closes its own connection, and a client has CONNECTION_TIMEOUT seconds for every read
+# and write, so one that never sends its request (or stops reading the audio) cannot hold up the others
+def serve(synth: Synth, socket_path: str) -> None:
+    # a socket file is left behind by a daemon that did not stop cleanly, but it may be a daemon still serving
+    if os.path.exists(socket_path):
+        if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            print('"{}" exists and is not a socket.'.format(socket_path))
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            if probe.connect_ex(socket_path) == 0:
+                print('A daemon is already serving on {}'.format(socket_path))
+                return
+        os.unlink(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen()
+    # stop cleanly (and remove the socket file) when killed as well as with Ctrl-C
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print('Serving on {}'.format(socket_path))
+    try:
+        while True:
+            connection, _ = server.accept()
+            connection.settimeout(CONNECTION_TIMEOUT)
+            try:
+                handle_request(synth, connection)
+            except (BrokenPipeError, ConnectionResetError):
+                print('The client went away before the audio was sent.')
+            except socket.timeout:
+                print('The client took more than {} s to send its request or read the audio.'
+                      .format(CONNECTION_TIMEOUT))
+            except Exception as error:
+                print('The request failed: {!r}'.format(error))
+            finally:
+                connection.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.unlink(socket_path)
+        print('Stopped serving on {}'.format(socket_path))
+
+
+# the options a request to the daemon can give, and what they are when it does not
+REQUEST_OPTIONS = {'volume': None, 'spell': False, 'reverse': None, 'crossfade': False}
+CONNECTION_TIMEOUT = 10.0  # unit: second, the longest the daemon waits for a client to send or read
+
 
 # process the commandline and return args
 def process_commandline():
@@ -89,11 +356,18 @@ def process_commandline():
 
     # basic synthesis arguments
     parser.add_argument('--diphones', default="./diphones",
-                        help="Folder containing diphone wavs")
+                        help="Folder containing diphone wavs, or a voice file packed by build_voice.py")
     parser.add_argument('--play', '-p', action="store_true", default=False,
                         help="Play the output audio")
+    parser.add_argument('--sink', action="store", default='pyaudio', choices=['pyaudio', 'null'],
+                        help="Where '-p' plays the audio: the sound card ('pyaudio'), or nowhere but in real time ('null')")
     parser.add_argument('--outfile', '-o', action="store", dest="outfile",
-                        help="Save the output audio to a file", default=None)
+                        help="Save the output audio to a file, or write it to the standard output with '-'",
+                        default=None)
+    parser.add_argument('--encoding', action="store", default=ENCODING_PCM, choices=ENCODINGS,
+                        help="How the saved samples are encoded: 16 bit PCM, or 8 bit G.711 mu-law or A-law")
+    parser.add_argument('--raw', action="store_true", default=False,
+                        help="Save just the encoded samples, without a wav header (e.g. to pipe them into sox)")
     parser.add_argument('phrase', nargs='?',
                         help="The phrase to be synthesised")
 
@@ -105,37 +379,97 @@ def process_commandline():
     parser.add_argument('--reverse', '-r', action="store", default=None, choices=['words', 'phones', 'signal'],
                         help="Speak backwards in a mode specified by string argument: 'words', 'phones' or 'signal'")
     parser.add_argument('--fromfile', '-f', action="store", default=None,
-                        help="Open file with given name and synthesise all text, which can be multiple sentences.")
+                        help="Open file with given name and synthesise all text, which can be multiple sentences. "
+                             "Use '-' to read the text from the standard input.")
+    parser.add_argument('--output-rate', action="store", default=None, type=int, metavar='HZ',
+                        help="The sample rate of the output (e.g. 16000 or 8000), the rate of the voice if not given")
+    parser.add_argument('--rate', action="store", dest="speaking_rate", default=1.0, type=float,
+                        help="The speaking rate, from {} (half as fast) to {} (twice as fast), without changing "
+                             "the pitch".format(MIN_RATE, MAX_RATE))
     parser.add_argument('--crossfade', '-c', action="store_true", default=False,
                         help="Enable slightly smoother concatenation by cross-fading between diphone units")
 
+    # Arguments for performance
+    parser.add_argument('--serve', action="store", nargs='?', const=DEFAULT_SOCKET, default=None, metavar='SOCKET',
+                        help="Keep the voice loaded and synthesise the phrases sent by client.py to a UNIX socket "
+                             "(by default {})".format(DEFAULT_SOCKET))
+    parser.add_argument('--word-cache', action="store", default=None, type=float, metavar='MB',
+                        help="Cache the synthesised words in a memory budget of the given MB")
+    parser.add_argument('--sentence-cache', action="store", default=None, type=float, metavar='MB',
+                        help="Keep the audio of the phrases of --fromfile in a cache on disk of the given MB, "
+                             "so running it again after editing the text only synthesises the phrases that changed")
+    parser.add_argument('--sentence-cache-dir', action="store", default=None, metavar='DIR',
+                        help="Where the sentence cache is kept, next to the compiled lexicon if not given")
+    parser.add_argument('--profile', action="store_true", default=False,
+                        help="Print how long every stage of the synthesis took, and the real-time factor")
+    parser.add_argument('--internal-format', action="store", default='int16', choices=['int16', 'float32'],
+                        help="The type the audio is assembled in: int16 (as the voice), or float32 with a single "
+                             "clipped conversion at the end (no wrap-around of loud emphasised diphones)")
+    parser.add_argument('--jobs', '-j', action="store", default=1, type=int, metavar='N',
+                        help="Synthesise the phrases of --fromfile with N worker processes")
+    parser.add_argument('--no-shared-voice', action="store_false", dest="shared_voice", default=True,
+                        help="With --jobs, let every worker load its own voice and lexicon instead of sharing "
+                             "the ones of the main process in shared memory")
+
     args = parser.parse_args()
 
-    if (args.fromfile and args.phrase) or (not args.fromfile and not args.phrase):
+    if args.serve is not None:
+        if args.fromfile or args.phrase:
+            parser.error('"--serve" synthesises the phrases sent by client.py, not a phrase or "--fromfile"')
+    elif (args.fromfile and args.phrase) or (not args.fromfile and not args.phrase):
         parser.error('Must supply either a phrase or "--fromfile" to synthesise (but not both)')
+    if not MIN_RATE <= args.speaking_rate <= MAX_RATE:
+        parser.error('"--rate" must be between {} and {}'.format(MIN_RATE, MAX_RATE))
+    if args.output_rate is not None and args.output_rate <= 0:
+        parser.error('"--output-rate" must be a positive number of Hz')
+    if args.jobs < 1:
+        parser.error('"--jobs" must be at least 1')
+    if args.profile and args.jobs > 1:
+        parser.error('"--profile" only times the main process, so it cannot be used with "--jobs"')
+    if args.sentence_cache is not None and (args.sentence_cache <= 0 or not args.fromfile):
+        parser.error('"--sentence-cache" must be a positive number of MB, used with "--fromfile"')
 
     return args   
 
 if __name__ == "__main__":
     args = process_commandline()
+    # with '-o -' the standard output carries the audio, so the messages go to the standard error
+    if args.outfile == '-':
+        sys.stdout = sys.stderr
 
     print(f'Will load wavs from: {args.diphones}')
+    # time every stage of the synthesis if the user input '--profile'
+    if args.profile:
+        set_profiler(Profiler())
     # first, check if the input wav_folder (after --diphones) exists
     if os.path.exists(args.diphones):
         # initial a Synth class
         diphone_synth = Synth(args)
+        # the cache on disk of the phrases of --fromfile, if the user input '--sentence-cache'
+        sentence_cache = None
+        if args.sentence_cache is not None:
+            sentence_cache = SentenceCache.for_synth(diphone_synth, args.diphones, int(args.sentence_cache * 2**20),
+                                                     args.sentence_cache_dir)
 
+        # if the user input '--serve', keep the Synth warm for client.py
+        if args.serve is not None:
+            serve(diphone_synth, args.serve)
         # if the input ask open a file with given name and synthesise all text
-        if args.fromfile is not None:
+        elif args.fromfile == '-':
+            print("Synthesise the text from the standard input")
+            output_audio_stream(process_text_file(diphone_synth, sys.stdin, diphone_synth.options, args.jobs, args,
+                                                  args.shared_voice, sentence_cache),
+                                diphone_synth.rate, args)
+        elif args.fromfile is not None:
             # first check if the input is a text file
             if re.findall(r'[^.]+$', args.fromfile) == ["txt"]:
                 # check if the given file exists
                 if os.path.isfile(args.fromfile):
                     print("Synthesise the text file: {}".format(args.fromfile))
-                    out_put_audio = process_from_file(args.fromfile)
-                    # if the user input '-o' and a filename, call the save_audio function
-                    if args.outfile is not None:
-                        save_audio(out_put_audio)
+                    with open(args.fromfile, 'r') as file_to_read:
+                        output_audio_stream(process_text_file(diphone_synth, file_to_read, diphone_synth.options,
+                                                              args.jobs, args, args.shared_voice, sentence_cache),
+                                            diphone_synth.rate, args)
                 else:
                     print('The given file "{}" does not exist.'.format(args.fromfile))
             else:
@@ -144,9 +478,17 @@ if __name__ == "__main__":
         # else, synthesise the input phrase
         else:
             print(f'You printed: {args.phrase}')  # tell the user what is the input
-            out_put_audio = process_phrase_to_output(args.phrase)
-            # if the user input '-o' and a filename, call the save_audio function
-            if args.outfile is not None:
-                save_audio(out_put_audio)
+            output_audio_stream(process_phrase_to_stream(diphone_synth, args.phrase, diphone_synth.options),
+                                diphone_synth.rate, args)
+
+        # tell the user how well the word cache did
+        if diphone_synth.word_cache is not None:
+            print(diphone_synth.word_cache.describe())
+        # and how many phrases were found in the sentence cache
+        if sentence_cache is not None:
+            print(sentence_cache.describe())
+        # tell the user how long every stage took
+        if args.profile:
+            print(get_profiler().report())
     else:
         print("The directory of diphones does not exist.")
\ No newline at end of file
@@ -0,0 +1,85 @@
+from typing import List, Sequence, Tuple, Union
+
+import numpy as np
+
+# the control tokens of a phone sequence, which keep their reserved IDs in a diphone sequence too
+COMMA_ID = 0  # ","
+PERIOD_ID = 1  # "." (and ":", "?", "!")
+EMPHASIS_ON_ID = 2  # "{"
+EMPHASIS_OFF_ID = 3  # "}"
+CONTROL_TOKENS = (',', '.', '{', '}')
+NUM_CONTROL_TOKENS = len(CONTROL_TOKENS)
+
+# the silence phone, and the phones of cmudict
+PAU_ID = NUM_CONTROL_TOKENS
+CMU_PHONES = ('AA', 'AE', 'AH', 'AO', 'AW', 'AY', 'B', 'CH', 'D', 'DH', 'EH', 'ER', 'EY', 'F', 'G', 'HH', 'IH',
+              'IY', 'JH', 'K', 'L', 'M', 'N', 'NG', 'OW', 'OY', 'P', 'R', 'S', 'SH', 'T', 'TH', 'UH', 'UW', 'V',
+              'W', 'Y', 'Z', 'ZH')
+
+# phone ID -> phone name, and phone name -> phone ID
+PHONES = CONTROL_TOKENS + ('PAU',) + CMU_PHONES
+PHONE_IDS = {phone: num for num, phone in enumerate(PHONES)}
+NUM_PHONES = len(PHONES)
+
+# a diphone ID is either the ID of a control token, or NUM_CONTROL_TOKENS + first phone * NUM_PHONES + second phone
+# the pairs that have a control token in them have IDs as well, so that a missing diphone can always be named
+MISSING_DIPHONE_ID = -1  # a diphone name that is not a pair of known phones
+DIPHONE_TABLE = (NUM_CONTROL_TOKENS + np.arange(NUM_PHONES * NUM_PHONES)).reshape(NUM_PHONES, NUM_PHONES)
+DIPHONE_TABLE.flags.writeable = False
+# diphone ID -> diphone name (e.g. "HH-AH"), and the lower case diphone name of the wav files -> diphone ID
+DIPHONES = CONTROL_TOKENS + tuple('{}-{}'.format(first, second) for first in PHONES for second in PHONES)
+DIPHONE_IDS = {diphone.lower(): num for num, diphone in enumerate(DIPHONES)}
+NUM_DIPHONES = len(DIPHONES)
+
+# swap "{" and "}", used when a sequence is reversed
+SWAP_EMPHASIS = np.arange(NUM_PHONES)
+SWAP_EMPHASIS[[EMPHASIS_ON_ID, EMPHASIS_OFF_ID]] = [EMPHASIS_OFF_ID, EMPHASIS_ON_ID]
+SWAP_EMPHASIS.flags.writeable = False
+
+
+# convert a list of phone names to an array of phone IDs
+def phones_to_ids(phone_seq: Sequence[str]) -> np.ndarray:
+    return np.array([PHONE_IDS[phone] for phone in phone_seq], dtype=np.intp)
+
+
+# convert an array of phone IDs to a list of phone names
+def ids_to_phones(phone_ids: np.ndarray) -> List[str]:
+    return [PHONES[phone_id] for phone_id in phone_ids.tolist()]
+
+
+# convert a list of diphone names to an array of diphone IDs
+# the names are matched in lower case, and a name that is not a pair of known phones gets MISSING_DIPHONE_ID
+def diphones_to_ids(diphone_seq: Sequence[str]) -> np.ndarray:
+    return np.array([DIPHONE_IDS.get(diphone.lower(), MISSING_DIPHONE_ID) for diphone in diphone_seq],
+                    dtype=np.intp)
+
+
+# convert an array of diphone IDs to a list of diphone names
+def ids_to_diphones(diphone_ids: np.ndarray) -> List[str]:
+    return [DIPHONES[diphone_id] for diphone_id in diphone_ids.tolist()]
+
+
+# get the diphone IDs of a sequence of phone IDs by pairing every phone with the next one
+# the control tokens stay as they are, a phone just before "{" or "}" is paired with the phone after it,
+# and a phone just before "," or "." is not paired at all
+# if return_positions, the position of the (first) phone of every diphone is returned as well
+def get_diphone_ids(phone_ids: np.ndarray, return_positions: bool=False) -> Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
+    phone_ids = np.asarray(phone_ids, dtype=np.intp)
+    if len(phone_ids) < 2:
+        empty = np.array([], dtype=np.intp)
+        return (empty, empty) if return_positions else empty
+    current_ids = phone_ids[:-1]
+    next_ids = phone_ids[1:]
+    # the phone after next, for the phones followed by "{" or "}" (the last phone never is)
+    after_next_ids = np.append(phone_ids[2:], PAU_ID)
+
+    current_is_control = current_ids < NUM_CONTROL_TOKENS
+    next_is_control = next_ids < NUM_CONTROL_TOKENS
+    next_is_emphasis = (next_ids == EMPHASIS_ON_ID) | (next_ids == EMPHASIS_OFF_ID)
+    partner_ids = np.where(next_is_emphasis, after_next_ids, next_ids)
+
+    diphone_ids = np.where(current_is_control, current_ids, DIPHONE_TABLE[current_ids, partner_ids])
+    keep = current_is_control | ~next_is_control | next_is_emphasis
+    if return_positions:
+        return diphone_ids[keep], np.flatnonzero(keep)
+    return diphone_ids[keep]
@@ -0,0 +1,154 @@
+from contextlib import contextmanager, nullcontext
+from threading import Lock, local
+from time import perf_counter
+from typing import Callable, ContextManager, Dict, Iterator, Optional
+
+import numpy as np
+
+# the histograms have a bucket for every power of HISTOGRAM_BASE from HISTOGRAM_MIN seconds,
+# so that the values from a microsecond to minutes are counted with a few buckets
+HISTOGRAM_MIN = 1e-6  # unit: second
+HISTOGRAM_BASE = 2 ** 0.25
+HISTOGRAM_BUCKETS = 120
+OUTPUT_STAGE = 'output'  # the time spent handing the audio over (e.g. playing it), not part of the synthesis
+
+_profiler = None  # the profiler of the process, None when profiling is off
+_NULL_STAGE = nullcontext()  # what stage gives when profiling is off, so that it costs next to nothing
+
+
+# a histogram of the values of a metric, with logarithmic buckets
+class Histogram:
+    def __init__(self) -> None:
+        self.buckets = np.zeros(HISTOGRAM_BUCKETS + 1, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def add(self, value: float) -> None:
+        bucket = 0 if value <= HISTOGRAM_MIN else int(np.log(value / HISTOGRAM_MIN) / np.log(HISTOGRAM_BASE)) + 1
+        self.buckets[min(bucket, HISTOGRAM_BUCKETS)] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    # the value below which the fraction q of the values are, to within a bucket
+    def percentile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        bucket = int(np.searchsorted(np.cumsum(self.buckets), q * self.count))
+        upper = HISTOGRAM_MIN * HISTOGRAM_BASE ** bucket
+        return min(max(upper, self.min), self.max)
+
+    def summary(self) -> Dict[str, float]:
+        return {'count': self.count, 'total': self.total, 'mean': self.total / self.count if self.count else 0.0,
+                'min': self.min if self.count else 0.0, 'p50': self.percentile(0.5), 'p95': self.percentile(0.95),
+                'p99': self.percentile(0.99), 'max': self.max}
+
+
+# times the stages of the synthesis of every utterance, and aggregates them across utterances
+# a stage timed while no utterance is open (e.g. loading the voice) is counted as a start up stage
+# the stages of an utterance are kept per thread, so that several threads can be profiled at once
+class Profiler:
+    def __init__(self) -> None:
+        self.startup = {}  # stage -> seconds, for the stages out of any utterance
+        self.histograms = {}  # stage (or "total", "audio_seconds", "real_time_factor") -> Histogram
+        self.callbacks = []  # called with the metrics of every utterance
+        self.utterances = 0
+        self.lock = Lock()
+        self.local = local()
+
+    # time a stage of the synthesis
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start_time = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, perf_counter() - start_time)
+
+    # add the seconds to a stage, of the utterance open in this thread if there is one
+    def add(self, name: str, seconds: float) -> None:
+        current = getattr(self.local, 'current', None)
+        if current is None:
+            with self.lock:
+                self.startup[name] = self.startup.get(name, 0.0) + seconds
+        else:
+            current[name] = current.get(name, 0.0) + seconds
+
+    # start timing an utterance in this thread
+    def begin_utterance(self) -> None:
+        self.local.current = {}
+
+    # finish the utterance open in this thread, which made audio_seconds of audio
+    # its metrics are added to the histograms, given to the callbacks, and returned
+    def end_utterance(self, audio_seconds: float) -> Dict[str, float]:
+        metrics = getattr(self.local, 'current', None) or {}
+        self.local.current = None
+        metrics['total'] = sum(metrics.values())
+        metrics['audio_seconds'] = audio_seconds
+        # the time the synthesis took over the length of its audio, below 1 is faster than real time
+        synthesis_time = metrics['total'] - metrics.get(OUTPUT_STAGE, 0.0)
+        metrics['real_time_factor'] = synthesis_time / audio_seconds if audio_seconds else 0.0
+        with self.lock:
+            self.utterances += 1
+            for name, value in metrics.items():
+                self.histograms.setdefault(name, Histogram()).add(value)
+            callbacks = list(self.callbacks)
+        for callback in callbacks:
+            callback(metrics)
+        return metrics
+
+    # call the callback with the metrics of every utterance from now on
+    def add_callback(self, callback: Callable[[Dict[str, float]], None]) -> None:
+        with self.lock:
+            self.callbacks.append(callback)
+
+    # the aggregated metrics: the start up stages, and the histogram summary of every metric of the utterances
+    def summary(self) -> Dict[str, object]:
+        with self.lock:
+            return {'utterances': self.utterances, 'startup': dict(self.startup),
+                    'metrics': {name: histogram.summary() for name, histogram in self.histograms.items()}}
+
+    # a table of the stages, slowest first, with the real-time factor at the end
+    def report(self) -> str:
+        summary = self.summary()
+        lines = ['Profile of {} utterances'.format(summary['utterances'])]
+        for name, seconds in summary['startup'].items():
+            lines.append('  {:<20} {:>10.2f} ms (start up)'.format(name, seconds * 1e3))
+        metrics = summary['metrics']
+        total = metrics.get('total', {}).get('total', 0.0)
+        stages = [name for name in metrics if name not in ('total', 'audio_seconds', 'real_time_factor')]
+        lines.append('  {:<20} {:>10} {:>10} {:>10} {:>10} {:>7}'.format(
+            'stage', 'total ms', 'mean ms', 'p95 ms', 'max ms', 'share'))
+        for name in sorted(stages, key=lambda name: -metrics[name]['total']):
+            times = metrics[name]
+            lines.append('  {:<20} {:>10.2f} {:>10.3f} {:>10.3f} {:>10.3f} {:>6.1f}%'.format(
+                name, times['total'] * 1e3, times['mean'] * 1e3, times['p95'] * 1e3, times['max'] * 1e3,
+                100 * times['total'] / total if total else 0.0))
+        audio_seconds = metrics.get('audio_seconds', {}).get('total', 0.0)
+        if audio_seconds:
+            synthesis_time = total - metrics.get(OUTPUT_STAGE, {}).get('total', 0.0)
+            lines.append('  real-time factor: {:.4f} ({:.2f} s of synthesis for {:.2f} s of audio, '
+                         'p95 per utterance {:.4f})'.format(synthesis_time / audio_seconds, synthesis_time,
+                                                            audio_seconds, metrics['real_time_factor']['p95']))
+        return '\n'.join(lines)
+
+
+# the profiler of the process, None when profiling is off
+def get_profiler() -> Optional[Profiler]:
+    return _profiler
+
+
+# turn profiling on with the profiler, or off with None
+def set_profiler(profiler: Optional[Profiler]) -> None:
+    global _profiler
+    _profiler = profiler
+
+
+# time a stage with the profiler of the process, if profiling is on
+def stage(name: str) -> ContextManager:
+    if _profiler is None:
+        return _NULL_STAGE
+    return _profiler.stage(name)
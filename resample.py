@@ -0,0 +1,82 @@
+from functools import lru_cache
+from math import gcd
+
+import numpy as np
+
+ZERO_CROSSINGS = 10  # the zero crossings of the sinc on each side of the centre of the filter
+KAISER_BETA = 5.0  # the shape of the Kaiser window of the filter, higher has less ripple but a wider transition
+
+
+# the low-pass filter of resampling by up / down, split into its up phases
+# the filter is a Kaiser windowed sinc cut off at the lower of the two Nyquist frequencies, and
+# phase p holds its taps p, p + up, p + 2 * up..., the ones that meet the samples of the input
+# return the phases (up x taps per phase) and the delay of the filter (in samples at up times the input rate)
+@lru_cache(maxsize=16)
+def get_polyphase_filter(up: int, down: int) -> tuple:
+    factor = max(up, down)
+    half_length = ZERO_CROSSINGS * factor
+    taps = np.arange(-half_length, half_length + 1)
+    # the gain of up makes up for the zeros put between the samples of the input
+    filter_taps = np.sinc(taps / factor) * np.kaiser(len(taps), KAISER_BETA) * up / factor
+    taps_per_phase = -(-len(filter_taps) // up)
+    phases = np.zeros(up * taps_per_phase)
+    phases[:len(filter_taps)] = filter_taps
+    return phases.reshape(taps_per_phase, up).T.copy(), half_length
+
+
+# the number of samples of data resampled by up / down
+def get_resampled_length(length: int, up: int, down: int) -> int:
+    return -(-length * up // down)
+
+
+# resample the samples by up / down (e.g. 1 / 3 from 48 kHz to 16 kHz) with a polyphase filter
+# output sample m is at input sample m * down / up: the filter is only evaluated there,
+# with the taps of its phase, so the zeros of the upsampling are never multiplied
+# the outputs that share a phase are one every up samples, and they read the input every down samples,
+# so they are computed together: when down is small (e.g. 48 kHz to 16 kHz), the input is split into down streams
+# of every down-th sample, each convolved with the taps that meet it, otherwise with one strided multiply-add per tap
+# return the float samples
+def resample_poly(data: np.ndarray, up: int, down: int) -> np.ndarray:
+    divisor = gcd(up, down)
+    up, down = up // divisor, down // divisor
+    if up == down:
+        return data.astype(np.float64)
+    phases, delay = get_polyphase_filter(up, down)
+    taps_per_phase = phases.shape[1]
+    length = get_resampled_length(len(data), up, down)
+    # zeros around the input, for the taps that reach before its start or after its end
+    signal = np.zeros(taps_per_phase + len(data) + delay // up + down + 1)
+    signal[taps_per_phase:taps_per_phase + len(data)] = data
+    output = np.zeros(length)
+    for first in range(min(up, length)):
+        position = first * down + delay  # where the output sample is, at up times the input rate
+        phase = phases[position % up]
+        start = position // up + taps_per_phase
+        outputs = output[first::up]
+        if down <= taps_per_phase:
+            for residue in range(down):
+                first_tap = (start - residue) % down
+                shift = (start - first_tap - residue) // down
+                taps = phase[first_tap::down]
+                if len(taps):
+                    outputs += np.convolve(signal[residue::down], taps)[shift:shift + len(outputs)]
+            continue
+        stop = start + (len(outputs) - 1) * down + 1
+        for tap in range(taps_per_phase):
+            if phase[tap]:
+                outputs += phase[tap] * signal[start - tap:stop - tap:down]
+    return output
+
+
+# resample the samples from one rate to another
+def resample(data: np.ndarray, rate: int, new_rate: int) -> np.ndarray:
+    return resample_poly(data, new_rate, rate)
+
+
+# how many zeros have to be between two signals resampled together by up / down so that they do not overlap,
+# and what their starts have to be a multiple of so that they start on a sample of the output
+def get_resampling_gap(up: int, down: int) -> tuple:
+    divisor = gcd(up, down)
+    up, down = up // divisor, down // divisor
+    phases, delay = get_polyphase_filter(up, down)
+    return phases.shape[1] + delay // up + 1, down
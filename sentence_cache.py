@@ -0,0 +1,172 @@
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+
+from diphone_bank import get_voice_fingerprint
+from lexicon import get_cmudict_fingerprint, get_default_cache_file
+from synth import Synth, SynthOptions, get_words
+
+# the cached sentence file layout:
+#   header  - magic, version, the switch of emphasis after the sentence, and the number of samples
+#   samples - the raw little endian samples of the sentence, in the type of the voice
+SENTENCE_MAGIC = b'SENTAUD1'
+SENTENCE_VERSION = 1  # part of every key too: change it when the same sentence is synthesised differently
+SENTENCE_HEADER = struct.Struct('<8sH?5xQ')
+SENTENCE_SUFFIX = '.snd'
+EVICT_TO = 0.9  # an eviction makes room down to this share of the budget, so it is not run for every sentence
+
+
+# a cache on disk of the audio of the sentences (the phrases of --fromfile), so a document synthesised again after
+# small edits only synthesises the sentences that changed
+# a sentence is found by a hash of its normalised words, the voice and the options it is synthesised with,
+# so changing any of them gives other keys, and the sentences nobody asks for any more are evicted in time
+# every sentence has its own file, written to a temporary file and moved in place, so runs sharing the cache folder
+# never see a half written one; when the budget is used up, the files used least recently (by their modification
+# time, which a hit refreshes) are evicted first
+class SentenceCache:
+    def __init__(self, cache_dir: str, max_bytes: int, voice_key: str, nptype: type) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.voice_key = voice_key  # everything but the sentence and the options the audio depends on
+        self.dtype = np.dtype(nptype).newbyteorder('<')  # the type of the samples in the files
+        self.nptype = nptype
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.errors = 0
+        self.nbytes = 0  # the bytes held by the files of the cache folder, as far as this process knows
+        self.evict()
+
+    # the cache of the sentences synthesised by the synth with the voice at voice_path, in cache_dir
+    # (next to the compiled lexicon if not given)
+    @classmethod
+    def for_synth(cls, synth: Synth, voice_path: str, max_bytes: int,
+                  cache_dir: Optional[str]=None) -> 'SentenceCache':
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(get_default_cache_file()), 'sentences')
+        voice_key = json.dumps([get_voice_fingerprint(voice_path), list(get_cmudict_fingerprint()), synth.rate,
+                                np.dtype(synth.nptype).str, synth.internal_format])
+        return cls(cache_dir, max_bytes, voice_key, synth.nptype)
+
+    # the key of a sentence synthesised with the options (all of them, including the emphasis switch it starts with)
+    def get_key(self, phrase: str, options: SynthOptions) -> str:
+        fields = [SENTENCE_VERSION, self.voice_key, get_words(phrase), *options]
+        return hashlib.sha256(json.dumps(fields).encode('utf-8')).hexdigest()
+
+    # where the sentence of the key is cached, in one of 256 sub folders so that none of them gets too big
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + SENTENCE_SUFFIX)
+
+    # get the cached samples of the key together with the switch of emphasis after them, None if they are not cached
+    def get(self, key: str) -> Optional[Tuple[np.ndarray, bool]]:
+        path = self.get_path(key)
+        try:
+            with open(path, 'rb') as file_to_read:
+                content = file_to_read.read()
+        except OSError:
+            self.misses += 1
+            return None
+        if len(content) < SENTENCE_HEADER.size:
+            return self.discard(path)
+        magic, version, emphasis, count = SENTENCE_HEADER.unpack_from(content)
+        if (magic != SENTENCE_MAGIC or version != SENTENCE_VERSION
+                or len(content) != SENTENCE_HEADER.size + count * self.dtype.itemsize):
+            return self.discard(path)
+        # mark the sentence as used, for the eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        samples = np.frombuffer(content, dtype=self.dtype, offset=SENTENCE_HEADER.size)
+        return samples.astype(self.nptype, copy=False), emphasis
+
+    # remove a file that is not a cached sentence, and count it as a miss
+    def discard(self, path: str) -> None:
+        self.misses += 1
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+
+    # cache the samples of the key with the switch of emphasis after them, evicting the sentences used least recently
+    # if the budget is used up
+    def put(self, key: str, samples: np.ndarray, emphasis: bool) -> None:
+        data = samples.astype(self.dtype, copy=False).tobytes()
+        nbytes = SENTENCE_HEADER.size + len(data)
+        if nbytes > self.max_bytes:
+            return
+        path = self.get_path(key)
+        # write to a temporary file first, so a sentence that is being read is never seen half written
+        tmp_file = '{}.tmp{}'.format(path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_file, 'wb') as file_to_write:
+                file_to_write.write(SENTENCE_HEADER.pack(SENTENCE_MAGIC, SENTENCE_VERSION, emphasis, len(samples)))
+                file_to_write.write(data)
+            os.replace(tmp_file, path)
+        except OSError as error:
+            # a cache that cannot be written only makes the run slower, so tell the user once
+            if not self.errors:
+                print('cannot save the sentence to the cache "{}": {}'.format(path, error))
+            self.errors += 1
+            try:
+                os.remove(tmp_file)
+            except OSError:
+                pass
+            return
+        self.writes += 1
+        self.nbytes += nbytes
+        if self.nbytes > self.max_bytes:
+            self.evict()
+
+    # the cached sentence files, the least recently used first, as (modification time, size, path)
+    # other runs can remove files at the same time, so the ones that are gone are left out
+    def scan(self) -> List[Tuple[int, int, Path]]:
+        entries = []
+        for path in Path(self.cache_dir).glob('*/*' + SENTENCE_SUFFIX):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        entries.sort()
+        return entries
+
+    # count the bytes of the cache folder again, and evict the sentences used least recently if they are over budget
+    def evict(self) -> None:
+        entries = self.scan()
+        self.nbytes = sum(size for _, size, _ in entries)
+        if self.nbytes <= self.max_bytes:
+            return
+        for _, size, path in entries:
+            if self.nbytes <= self.max_bytes * EVICT_TO:
+                break
+            try:
+                path.unlink()
+                self.evictions += 1
+            except FileNotFoundError:
+                pass  # evicted by another run
+            except OSError:
+                continue
+            self.nbytes -= size
+
+    # the counters of the cache
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'writes': self.writes, 'evictions': self.evictions,
+                'errors': self.errors, 'bytes': self.nbytes}
+
+    # a one line summary of the counters
+    def describe(self) -> str:
+        lookups = self.hits + self.misses
+        return ('Sentence cache: {} hits, {} misses ({:.1%} hit rate), {} written, {} evictions '
+                '({:.1f} of {:.1f} MB in {})').format(
+            self.hits, self.misses, self.hits / lookups if lookups else 0.0, self.writes, self.evictions,
+            self.nbytes / 2**20, self.max_bytes / 2**20, self.cache_dir)
@@ -0,0 +1,111 @@
+from io import BytesIO
+from multiprocessing import shared_memory
+from typing import Callable, Optional, Tuple
+
+from diphone_bank import DiphoneBank
+from lexicon import Lexicon
+
+
+# the diphone bank and the lexicon of a process, published in shared memory for its worker processes
+# the segments hold the packed voice layout (see build_voice.py) and the compiled lexicon layout (see lexicon.py),
+# so a worker reads them as zero-copy numpy views, as it would map the files, and N workers hold one copy
+# between them instead of N
+# the process that publishes the segments owns them: closing it removes them (the workers that still have them
+# attached keep their mappings until they exit), a worker only detaches
+class SharedVoice:
+    def __init__(self, voice_segment: shared_memory.SharedMemory, lexicon_segment: shared_memory.SharedMemory,
+                 owner: bool=False) -> None:
+        self.voice_segment = voice_segment
+        self.lexicon_segment = lexicon_segment
+        self.owner = owner
+        self.diphone_bank = None  # the bank and the lexicon read from the segments, once asked for
+        self.lexicon = None
+
+    # copy the bank and the lexicon into new shared memory segments
+    @classmethod
+    def publish(cls, diphone_bank: DiphoneBank, lexicon: Lexicon) -> 'SharedVoice':
+        voice_segment = create_segment(diphone_bank.write_voice)
+        try:
+            lexicon_segment = create_segment(lexicon.write_cache)
+        except BaseException:
+            voice_segment.close()
+            voice_segment.unlink()
+            raise
+        return cls(voice_segment, lexicon_segment, owner=True)
+
+    # attach to the segments published by another process, by their names (see names)
+    @classmethod
+    def attach(cls, names: Tuple[str, str]) -> 'SharedVoice':
+        voice_segment = shared_memory.SharedMemory(names[0])
+        try:
+            lexicon_segment = shared_memory.SharedMemory(names[1])
+        except BaseException:
+            voice_segment.close()
+            raise
+        return cls(voice_segment, lexicon_segment)
+
+    # the names of the segments, which is all a worker needs to attach to them
+    @property
+    def names(self) -> Tuple[str, str]:
+        return self.voice_segment.name, self.lexicon_segment.name
+
+    # the bytes held by the segments
+    @property
+    def nbytes(self) -> int:
+        return self.voice_segment.size + self.lexicon_segment.size
+
+    # the diphone bank, as views of the shared samples
+    def get_diphone_bank(self) -> DiphoneBank:
+        if self.diphone_bank is None:
+            self.diphone_bank = DiphoneBank.from_buffer(
+                self.voice_segment.buf, 'shared memory {}'.format(self.voice_segment.name))
+        return self.diphone_bank
+
+    # the lexicon, as views of the shared pronunciations (every process keeps its own memo of the words it looked up)
+    def get_lexicon(self) -> Lexicon:
+        if self.lexicon is None:
+            self.lexicon = Lexicon.from_buffer(
+                self.lexicon_segment.buf, 'shared memory {}'.format(self.lexicon_segment.name))
+        return self.lexicon
+
+    # detach from the segments, and remove them if this process published them
+    # the bank and the lexicon read from them must not be used any more
+    def close(self) -> None:
+        self.diphone_bank = self.lexicon = None
+        for segment in (self.voice_segment, self.lexicon_segment):
+            try:
+                segment.close()
+            except BufferError:
+                # numpy views of the segment are still alive somewhere, its mapping goes when they do
+                pass
+            if self.owner:
+                segment.unlink()
+        self.owner = False
+
+    def __enter__(self) -> 'SharedVoice':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+# a new shared memory segment holding what write writes to a binary file
+def create_segment(write: Callable[[BytesIO], None]) -> shared_memory.SharedMemory:
+    content = BytesIO()
+    write(content)
+    data = content.getbuffer()
+    segment = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+    segment.buf[:len(data)] = data
+    return segment
+
+
+# attach to the shared voice of the names, None if there are no names
+# return it, or None if it cannot be attached to (the caller then loads its own voice)
+def attach_shared_voice(names: Optional[Tuple[str, str]]) -> Optional[SharedVoice]:
+    if names is None:
+        return None
+    try:
+        return SharedVoice.attach(names)
+    except OSError as error:
+        print('cannot attach to the shared voice: {}'.format(error))
+        return None
@@ -1,43 +1,123 @@
-import pyaudio
 import numpy as np
 import wave
+import atexit
 import math
-import random
+import mmap
+import struct
+import sys
+import threading
 
-from time import sleep
+from timescale import time_stretch
 
 #import pylab as pl
 
-# seed the random number generator
-random.seed()
+# The sample formats of PortAudio, the same values as pyaudio.paInt16 etc.
+# They are kept here so that audio buffers can be made and processed without PyAudio,
+# which is only imported when a device is used to play or record
+PA_FLOAT32 = 1
+PA_INT32 = 2
+PA_INT24 = 4
+PA_INT16 = 8
+PA_INT8 = 16
+PA_UINT8 = 32
 
 # Some default values for the audio format
 CHUNK = 256
-FORMAT = pyaudio.paInt16
+FORMAT = PA_INT16
 CHANNELS = 1
 RATE = 48000
 # This is needed for rescaling
 MAX_AMP = 2**15 - 1
 
+# The wav header values used by WavWriter
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_ALAW = 6
+WAVE_FORMAT_MULAW = 7
+WAV_UNKNOWN_SIZE = 0xFFFFFFFF  # the size given by a streamed wav file, which cannot be patched
+
+# The numpy type that holds the samples of each pyaudio format
+# - 24bit samples have no numpy type of their own, so they are held as 32bit integers of the same value
+NP_TYPES = {PA_UINT8: np.uint8,
+            PA_INT8: np.int8,
+            PA_INT16: np.int16,
+            PA_INT24: np.int32,
+            PA_INT32: np.int32,
+            PA_FLOAT32: np.float32}
+# The bytes of a sample of each format
+SAMPLE_SIZES = {PA_UINT8: 1, PA_INT8: 1, PA_INT16: 2, PA_INT24: 3, PA_INT32: 4, PA_FLOAT32: 4}
+
+# The encodings WavWriter can write: linear PCM as it is, or 16bit samples companded to 8bit by G.711
+ENCODING_PCM = "pcm"
+ENCODING_ULAW = "ulaw"
+ENCODING_ALAW = "alaw"
+ENCODINGS = (ENCODING_PCM, ENCODING_ULAW, ENCODING_ALAW)
+# The G.711 constants
+ULAW_BIAS = 0x84
+ULAW_CLIP = 8159  # of the 14bit samples that are encoded
+ULAW_SEGMENT_ENDS = np.array([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF])
+ALAW_SEGMENT_ENDS = np.array([0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF])
+
+# The device shared by every Audio object, opened the first time it is needed
+_default_device = None
+_default_device_lock = threading.Lock()
+
+
+# Just the samples of some audio and how to read them: nothing else is set up to make one,
+# so it is cheap enough to hold every utterance
+class AudioBuffer:
+    __slots__ = ('data', 'rate', 'chan', 'nptype')
+
+    def __init__(self, data=None, rate=RATE, channels=CHANNELS, nptype=np.int16):
+        self.rate = rate
+        self.chan = channels
+        self.nptype = nptype
+        # Set the curent data to an empty array of the correct type, if there is no data
+        self.data = np.array([], dtype=nptype) if data is None else data
+
+    def __len__(self):
+        return self.data.shape[0]
+
+
+# The sound card, used for playing and recording
+# It is PyAudio that initialises PortAudio (which looks for all the devices),
+# so PyAudio is only imported when the device is made
+class AudioDevice:
 
-class Audio(pyaudio.PyAudio):
+    def __init__(self):
+        import pyaudio
+        self.pyaudio = pyaudio.PyAudio()
+
+    # Open an input or output stream, with the arguments of pyaudio.PyAudio.open
+    def open(self, **kwargs):
+        return self.pyaudio.open(**kwargs)
+
+    def terminate(self):
+        if self.pyaudio is not None:
+            self.pyaudio.terminate()
+            self.pyaudio = None
+
+
+# Get the device shared by every Audio object, making it the first time
+def get_default_device():
+    global _default_device
+    with _default_device_lock:
+        if _default_device is None:
+            _default_device = AudioDevice()
+            atexit.register(_default_device.terminate)
+        return _default_device
+
+
+class Audio(AudioBuffer):
+    __slots__ = ('chunk', 'format', 'istream', 'ostream', 'chunk_index')
 
     def __init__(self, channels=1,
                  rate=RATE,
                  chunk=CHUNK,
                  format=FORMAT):
-        # Initialise the parent class
-        pyaudio.PyAudio.__init__(self)
-
         # Set the format to that specified
-        self.chan = channels
-        self.rate = rate
+        AudioBuffer.__init__(self, rate=rate, channels=channels, nptype=self.get_np_type(format))
         self.chunk = chunk
         self.format = format
-        self.nptype = self.get_np_type(format)
-
-        # Set the curent data to an empty array of the correct type
-        self.data = np.array([], dtype=self.nptype)
 
         # No streams are open at the moment
         self.istream = None
@@ -46,14 +126,25 @@ class Audio(pyaudio.PyAudio):
         # a counter for referencing the data in chunks
         self.chunk_index = 0
 
-    def __del__(self):
-        self.terminate()
+    # Open a stream on the device (it is only set up the first time a stream is opened)
+    def open(self, **kwargs):
+        return get_default_device().open(**kwargs)
+
+    # Get the size in bytes of a sample of the format
+    def get_sample_size(self, format):
+        return get_sample_size(format)
+
+    # Get the format of samples of the width in bytes
+    def get_format_from_width(self, width, unsigned=True):
+        return get_format_from_width(width, unsigned)
+
+    # Read a chunk of data from the current input stream
+    def read_chunk(self):
+        return frames_to_array(self.istream.read(self.chunk), self.format)
 
     # Get a chunk of data from the current input stream
     def get_chunk(self):
-        tmpstr = self.istream.read(self.chunk)
-        array = np.fromstring(tmpstr, dtype=self.nptype)
-        self.data = np.append(self.data, array)
+        self.data = np.append(self.data, self.read_chunk())
     
     # Put a chunk of data to the current output stream        
     def put_chunk(self):
@@ -64,11 +155,11 @@ class Audio(pyaudio.PyAudio):
         if slice_from > self.data.shape[0]:
             raise IndexError
         array = self.data[slice_from:slice_to]
-        self.ostream.write(array.tostring())
+        self.ostream.write(array_to_frames(array, self.format))
         self.chunk_index += 1
         
     # Open an input stream
-    # We just call the inherited open function in the parent class 
+    # We just call the open function of the device
     # with the correct format data
     def open_input_stream(self):
         self.istream = self.open(format=self.format,
@@ -103,50 +194,56 @@ class Audio(pyaudio.PyAudio):
         self.open_input_stream()
         print("Recording...")
         # Get time*sample_rate values in total, a chunk at a time
-        for i in range(0, int(time * self.rate/self.chunk)):
-            self.get_chunk()
+        chunks = [self.read_chunk() for i in range(0, int(time * self.rate/self.chunk))]
+        # Join the chunks at the end, so the data is only copied once
+        self.data = np.concatenate([self.data] + chunks)
         print("Done Recording")
         # Close the input stream
         self.close_input_stream()
 
     # Play the current data
+    # The data is fed to the device from its callback, and this returns as soon as it has all been played
     def play(self):
-        # Open an outputstream
-        self.open_output_stream()
-        # Reset the chunk counter to 0
-        self.chunk_index = 0
+        self.play_stream([self.data], keep=False)
+
+    # Play a stream of data chunks, starting as soon as the first chunk arrives
+    # The chunks that were played are kept as the current data, unless keep is False
+    def play_stream(self, chunks, keep=True):
+        # sinks.py builds on this module, so it is imported when it is used
+        from sinks import PyAudioSink
         print("Playing...")
-        # Loop (potentially forever)
-        while True:
-            # Try to put output a chunk
-            try:    
-                self.put_chunk()
-            # If we run out of data to output, break out of the loop
-            except IndexError:
-                break
-        
-        sleep(0.4) # hack to work around a bug in some (non-blocking) audio hardware 
+        played = []
+        with PyAudioSink(self.rate, self.chan, self.format) as sink:
+            for array in chunks:
+                sink.write(array)
+                if keep:
+                    played.append(array)
         print("Stopped playing")
-        # Close the output stream
-        self.close_output_stream()
+        if keep:
+            self.data = np.concatenate(played) if played else np.array([], dtype=self.nptype)
+
+    # Save a stream of data chunks to a file as they arrive, without holding them all
+    def save_stream(self, path, chunks):
+        for array in self.write_stream(path, chunks):
+            pass
+
+    # Write a stream of data chunks to a file and pass them on, so they can be played at the same time
+    def write_stream(self, path, chunks):
+        # Open the file for writing, the header is patched when the writer is closed
+        with WavWriter(path, self.rate, self.chan, self.format) as writer:
+            for array in chunks:
+                writer.write(array)
+                yield array
 
     # Save the data to a file
     def save(self, path):
-        # Create a 'string' of the data
-        raw = self.data.tostring()
-        # Open the file for writing
-        wf = wave.open(path, 'wb')
-        # Set the header information
-        wf.setnchannels(self.chan)
-        wf.setsampwidth(self.get_sample_size(self.format))
-        wf.setframerate(self.rate)
-        # Write the data
-        wf.writeframes(raw)
-        # Close the file
-        wf.close()
-    
-    # Load data from a file    
-    def load(self, path):
+        with WavWriter(path, self.rate, self.chan, self.format) as writer:
+            writer.write(self.data)
+
+    # Load data from a file
+    # The samples are read in one go, or with mmap=True, the file is mapped into memory
+    # and the data is a read-only view of it (24bit samples still have to be converted)
+    def load(self, path, mmap=False):
         # Open the file for reading
         wf = wave.open(path, "rb")
         # Get information from the files header
@@ -154,54 +251,43 @@ class Audio(pyaudio.PyAudio):
         self.nptype = self.get_np_type(self.format)
         self.chan = wf.getnchannels()
         self.rate = wf.getframerate()
-        # Set the internal data attribute to an empty array of the right type
-        self.data = np.array([], dtype=self.nptype)
-        # Read a chunk of data from the file
-        raw = wf.readframes(self.chunk)
-        # Loop while there is data in the file
-        while raw:
-            # Convert the raw data to a numpy array
-            array = np.fromstring(raw, dtype=self.nptype)
-            # Append the array to the class data attribute
-            self.data = np.append(self.data, array)
-            # Read the next chunk, ready for the next loop iteration
-            raw = wf.readframes(self.chunk)
+        frame_size = wf.getsampwidth() * self.chan
         # Close the file
         wf.close()
-    
-    # Convert the pyaudio data format type to the numpy type 
-    #  - This really needs expanding to deal with other data types, e.g. 8bit and 24bit audio
+
+        # Find the samples in the file, only whole frames are kept
+        offset, size = find_data_chunk(path)
+        size -= size % frame_size
+        with open(path, "rb") as file_to_read:
+            if mmap:
+                raw = map_file(file_to_read, offset, size)
+            else:
+                # Read the whole data chunk into one buffer, which the array then uses without a copy
+                file_to_read.seek(offset)
+                raw = bytearray(size)
+                raw = memoryview(raw)[:file_to_read.readinto(raw) // frame_size * frame_size]
+        self.data = frames_to_array(raw, self.format)
+
+    # Convert the pyaudio data format type to the numpy type
     def get_np_type(self, type):
-        if type == pyaudio.paInt16:
-            return np.int16
-    
-    # Convert the numpy data format type to the pyaudio type    
+        return NP_TYPES.get(type)
+
+    # Convert the numpy data format type to the pyaudio type
+    #  - 32bit integers are taken as 32bit audio, although they also hold 24bit audio
     def get_pa_type(self, type):
-        if type == np.int16:
-            return pyaudio.paInt16
-    
+        for pa_type in (PA_UINT8, PA_INT8, PA_INT16, PA_INT32, PA_FLOAT32):
+            if NP_TYPES[pa_type] == type:
+                return pa_type
+
     # Add an echo the the current audio data
     #   repeat - How many delayed repeats to add
     #   delay  - How long to delay each repeat (in samples)
-    def add_echo(self, repeat, delay):
-        # get the length of the existing data
-        length = self.data.shape[0]
-        # create a new array with the required extra length
-        array = np.zeros(length + repeat*delay, dtype=np.float)
-
-        # loop for the number of delays + 1
-        #  - we use the 0th iteration of the loop to reduce the amplitude of the original
-        #    waveform, so when we add to it we don't 'clip'
-        for i in range(0, repeat+1):
-            # Get start and end times for the current offset
-            start = i*delay
-            end = length + i*delay
-            # Calculate the current scaling factor
-            scale = 2**(i+1)
-            # Add a scaled version of self.data to 'window' of the new array
-            array[start:end] += self.data / scale
-        # Set the class data attribute to the new array
-        self.data = np.rint(array).astype(self.nptype)
+    #   decay  - The gain of each repeat relative to the one before
+    # The original waveform is scaled by decay as well, so with the default of 0.5 the sum of the gains stays below 1
+    # and nothing 'clips'
+    def add_echo(self, repeat, delay, decay=0.5):
+        taps = [(i*delay, decay**(i+1)) for i in range(0, repeat+1)]
+        self.data = add_taps(self.data, taps, self.nptype)
 
     def rescale(self, val):
         # Check argument passed
@@ -222,57 +308,41 @@ class Audio(pyaudio.PyAudio):
 
         self.data = (self.data * rescale_factor).astype(self.nptype)
 
-    def create_tone(self, frequency, length, amplitude):
+    # Set the data to a sine wave of the frequency (in Hz), starting at the phase (in radians)
+    def create_tone(self, frequency, length, amplitude, phase=0.0):
         if not 0 <= amplitude <= 1:
             raise ValueError("Expected amplitude between 0 and 1")
 
-        # create new array of requested length
-        s = np.zeros(length, self.nptype)
-
-        # iterate through array, creating waveform sample by sample
-        for i in range(0, length):
-            s[i] = amplitude * MAX_AMP \
-                   * math.sin(frequency * i * 2 * math.pi/self.rate)
+        # the whole waveform at once, one sample per element of the time axis
+        s = np.sin(frequency * np.arange(length) * 2 * math.pi/self.rate + phase)
+        s *= amplitude * MAX_AMP
 
         # set instance data to the newly created array
-        self.data = s
+        self.data = s.astype(self.nptype)
 
-    def create_noise(self, length, amplitude):
+    # Set the data to white noise, uniform between -amplitude and amplitude
+    #   rng - A seed or a numpy Generator, so that the same noise can be made again (new noise every time if None)
+    def create_noise(self, length, amplitude, rng=None):
 
         if not 0 <= amplitude <= 1:
             raise ValueError("Expected amplitude between 0 and 1")
 
-        # create new array of requested length
-        s = np.zeros(length, self.nptype)
-
-        # iterate through array, creating waveform sample by sample
-        for i in range(0, length):
-            s[i] = amplitude * MAX_AMP * random.random()
+        rng = np.random.default_rng(rng)
+        s = rng.uniform(-amplitude * MAX_AMP, amplitude * MAX_AMP, length)
 
         # set instance data to the newly created array
-        self.data = s
+        self.data = s.astype(self.nptype)
 
     # This version adds to the existing object. 
     # Cons of this approach: changes the original object, 
     #  if used more than once to add more than two objects together 
     #  the relative amplitudes are not maintained due to the scaling
     def add(self, other):
-        # Find the length of the longest
-        length = max(self.data.shape[0], other.data.shape[0])
-        # Create an empty array of this length
-        array = np.zeros(length, dtype=self.nptype)
-        # Add in each data at half amplitute (so it doesn't clip)
-        array += self.data / 2.0
-        array += other.data / 2.0
-        # Update the stored array in the current object.
-        self.data = array
-
-    def __len__(self):
-        return self.data.shape[0]
+        # Add in each data at half amplitute (so it doesn't clip), the longest sets the length
+        self.data = mix([self.data, other.data], gains=[0.5, 0.5], nptype=self.nptype)
 
     def get_samplerange(self):
-        if self.nptype == np.int16:
-            return math.pow(2, 16)
+        return math.pow(2, 8 * self.get_sample_size(self.format))
 
     def compute_fft(self, start, end):
         dur = end - start
@@ -288,28 +358,12 @@ class Audio(pyaudio.PyAudio):
         indxs = indxs[indxs < len(self.data)].astype(int)
         self.data = self.data[indxs]
 
+    # Change the speed of the audio without changing its pitch, with the phase vocoder of timescale
+    #   factor - 2.0 is twice as fast, 0.5 twice as slow
+    #   overlap - The samples between the starts of two frames
     def time_stretch_fft(self, factor, windowsize=1024, overlap=512, apply_hanning=True):
-        phase = np.zeros(windowsize)
-        if apply_hanning:
-            amp_window = np.hanning(windowsize)
-        else:
-            amp_window = np.ones(windowsize, dtype=np.float)
-        result = np.zeros(int(len(self.data) / factor + windowsize))
-
-        for i in np.arange(0, len(self.data)-(windowsize+overlap), overlap*factor, dtype=np.int):
-            a1 = self.data[i: i + windowsize]
-            a2 = self.data[i + overlap: i + windowsize + overlap]
-
-            s1 = np.fft.fft(amp_window * a1)
-            s2 = np.fft.fft(amp_window * a2)
-            phase = (phase + np.angle(s2/s1)) % 2*np.pi
-            a2_rephased = np.fft.ifft(np.abs(s2)*np.exp(1j*phase))
-
-            i2 = int(i/factor)
-            result[i2:i2 + windowsize] += amp_window*np.real(a2_rephased)
-        result = ((2**(16-4)) * result/result.max())
-
-        self.data = result.astype(self.nptype)
+        stretched = time_stretch(self.data, factor, windowsize, overlap, window=apply_hanning)
+        self.data = quantise(stretched, self.nptype)
 
     def plot_waveform(self, start=0, end=-1, x_unit="samples"):
         array = self.data[start:end]
@@ -343,29 +397,284 @@ class Audio(pyaudio.PyAudio):
 
 # This version uses a function just defined in the module namespace (i.e. not a method of the class),
 # and takes one argument that is a list of audio objects. This allows an arbitrary number of objects and uniform scaling
+# The sources are added up in float and converted back once, so the sum cannot overflow
 def sum_audio(audio_objects):
-    # Get the length of the longest.
-    #   - the max() function when given an iterable object will give the max in that 'list', 
-    #   - you can also specifiy a function to use to evaluate the size of each object using key=function_name
-    length = len(max(audio_objects, key=len))
+    audio_objects = list(audio_objects)
     # Work out the required scaling factor to prevent clipping
     scale = 1.0/len(audio_objects)
+    first = audio_objects[0]
+
+    # Create a new object to return, in the format of the first object
+    new_object = Audio(channels=first.chan, rate=first.rate, format=first.get_pa_type(first.nptype)
+                       if isinstance(first, Audio) else FORMAT)
+    new_object.data = mix([obj.data for obj in audio_objects], gains=[scale] * len(audio_objects),
+                          nptype=first.nptype)
 
-    # make an array of zeros
-    # - should really check that the dtype of each of the objects is the same and use that dtype!
-    array = np.zeros(length, dtype=np.int16)
-    
-    # Add each audio_object to the array
-    for obj in audio_objects:
-        array += np.rint(obj.data * scale).astype(np.int16)
-    
-    # Create a new object to return
-    new_object = Audio()
-    new_object.data = array
-    
     return new_object
 
 
+# Mix the arrays of samples into one, each multiplied by its gain (1 if gains is None) and starting
+# at its offset in samples (0 if offsets is None), as long as needed to hold them all
+# They are added up in float and converted to nptype in one clipped step at the end
+def mix(sources, gains=None, offsets=None, nptype=np.int16):
+    gains = [1.0] * len(sources) if gains is None else gains
+    offsets = [0] * len(sources) if offsets is None else offsets
+    length = max((offset + len(source) for source, offset in zip(sources, offsets)), default=0)
+    array = np.zeros(length, dtype=np.float64)
+    for source, gain, offset in zip(sources, gains, offsets):
+        # the scaled source is added straight into its window of the mix, without a temporary copy of it
+        window = array[offset:offset + len(source)]
+        window += np.multiply(source, gain, dtype=np.float64)
+    return quantise(array, nptype)
+
+
+# Add delayed copies of the samples to themselves: a multi-tap echo
+#   taps - (delay in samples, gain) of every copy, the original is not kept unless a tap has a delay of 0
+def add_taps(data, taps, nptype=np.int16):
+    return mix([data] * len(taps), gains=[gain for _, gain in taps], offsets=[delay for delay, _ in taps],
+               nptype=nptype)
+
+
+# Convert float samples to nptype: rounded and clipped to its range for the integer types
+def quantise(array, nptype=np.int16):
+    if not np.issubdtype(nptype, np.integer):
+        return array.astype(nptype)
+    info = np.iinfo(nptype)
+    return np.clip(np.rint(array), info.min, info.max).astype(nptype)
+
+
+# Get the size in bytes of a sample of the format
+def get_sample_size(format):
+    return SAMPLE_SIZES[format]
+
+
+# Get the format of samples of the width in bytes (8bit wav files are unsigned)
+def get_format_from_width(width, unsigned=True):
+    if width == 1:
+        return PA_UINT8 if unsigned else PA_INT8
+    formats = {2: PA_INT16, 3: PA_INT24, 4: PA_INT32}
+    if width not in formats:
+        raise ValueError("Invalid width: %d" % width)
+    return formats[width]
+
+
+# Write audio chunk by chunk to a wav file, a pipe or the standard output ("-"), without holding it all
+# The chunks can be arrays of any integer type, which are converted to the format,
+# or float arrays between -1 and 1, which are scaled to the full range of the format.
+# The sizes in the header are patched when the writer is closed. A pipe cannot be seeked back to the header,
+# so it gets the largest sizes instead, as streamed wav files do, or with raw=True just the PCM without a header.
+# With the ulaw or alaw encoding, the 16bit samples are written as 8bit G.711 (format has to be 16bit).
+class WavWriter:
+
+    def __init__(self, target, rate=RATE, channels=CHANNELS, format=FORMAT, raw=False, encoding=ENCODING_PCM):
+        if format == PA_FLOAT32:
+            raise ValueError("WavWriter only writes integer PCM formats")
+        if encoding not in ENCODINGS:
+            raise ValueError("Unknown encoding: %s" % encoding)
+        if encoding != ENCODING_PCM and format != PA_INT16:
+            raise ValueError("Only 16bit samples can be encoded as %s" % encoding)
+        self.rate = rate
+        self.chan = channels
+        self.format = format
+        self.raw = raw
+        self.encoding = encoding
+        self.sampwidth = get_sample_size(format) if encoding == ENCODING_PCM else 1
+        self.frames_written = 0
+        # Open the target, unless it is a file object already
+        self.owns_file = isinstance(target, str)
+        if target == "-":
+            # The real standard output, even when the messages have been sent elsewhere (as main.py does with '-o -')
+            self.file = sys.__stdout__.buffer
+            self.owns_file = False
+        elif self.owns_file:
+            self.file = open(target, "wb")
+        else:
+            self.file = target
+        try:
+            self.seekable = self.file.seekable()
+        except (AttributeError, OSError):
+            self.seekable = False
+        self.start = self.file.tell() if self.seekable else 0
+        self.datalength = 0
+        if not raw:
+            self.file.write(self.make_header(WAV_UNKNOWN_SIZE))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # The header of a wav file with datalength bytes of samples: 44 bytes for PCM
+    # G.711 is not PCM, so its "fmt " chunk has the size of its extension (none) and a "fact" chunk follows it
+    # with the number of samples, 58 bytes in all
+    def make_header(self, datalength):
+        block_align = self.chan * self.sampwidth
+        fmt = struct.pack('<HHIIHH', WAVE_FORMAT_PCM, self.chan, self.rate, self.rate * block_align, block_align,
+                          self.sampwidth * 8)
+        fact = b''
+        if self.encoding != ENCODING_PCM:
+            tag = WAVE_FORMAT_MULAW if self.encoding == ENCODING_ULAW else WAVE_FORMAT_ALAW
+            fmt = struct.pack('<H', tag) + fmt[2:] + struct.pack('<H', 0)
+            fact = struct.pack('<4sII', b'fact', 4, min(datalength // self.chan, WAV_UNKNOWN_SIZE))
+        chunks_size = 4 + 8 + len(fmt) + len(fact) + 8
+        riff_size = min(chunks_size + datalength + (datalength & 1), WAV_UNKNOWN_SIZE)
+        return (struct.pack('<4sI4s4sI', b'RIFF', riff_size, b'WAVE', b'fmt ', len(fmt)) + fmt + fact
+                + struct.pack('<4sI', b'data', min(datalength, WAV_UNKNOWN_SIZE)))
+
+    # Write a chunk of samples, returns the number of frames written
+    def write(self, array):
+        array = np.asarray(array)
+        if array.dtype.kind == 'f':
+            array = self.scale_float(array)
+        if self.encoding == ENCODING_ULAW:
+            raw = encode_ulaw(array).tobytes()
+        elif self.encoding == ENCODING_ALAW:
+            raw = encode_alaw(array).tobytes()
+        else:
+            raw = array_to_frames(array, self.format)
+        self.file.write(raw)
+        self.datalength += len(raw)
+        frames = len(raw) // (self.chan * self.sampwidth)
+        self.frames_written += frames
+        return frames
+
+    # Scale float samples between -1 and 1 to the integers of the format (8bit wav files are unsigned)
+    def scale_float(self, array):
+        max_amp = 2**(8 * get_sample_size(self.format) - 1) - 1
+        array = np.rint(np.clip(array, -1.0, 1.0) * max_amp)
+        if self.format == PA_UINT8:
+            array += 128
+        return array
+
+    # Finish the file: pad the data to an even size and put the real sizes in the header if it can seek back
+    def close(self):
+        if self.file is None:
+            return
+        try:
+            if not self.raw:
+                if self.datalength & 1:
+                    self.file.write(b'\0')
+                if self.seekable:
+                    end = self.file.tell()
+                    self.file.seek(self.start)
+                    self.file.write(self.make_header(self.datalength))
+                    self.file.seek(end)
+            self.file.flush()
+        finally:
+            if self.owns_file:
+                self.file.close()
+            self.file = None
+
+
+# The G.711 byte of every 16bit sample, as tables indexed by the samples seen as unsigned, made once
+# so that encoding is a single lookup per sample
+def get_ulaw_table():
+    global _ulaw_table
+    if _ulaw_table is None:
+        samples = np.arange(-32768, 32768, dtype=np.int32) >> 2
+        mask = np.where(samples >= 0, 0xFF, 0x7F)
+        magnitude = np.minimum(np.abs(samples), ULAW_CLIP) + (ULAW_BIAS >> 2)
+        segment = np.searchsorted(ULAW_SEGMENT_ENDS, magnitude)
+        codes = (np.minimum(segment, 7) << 4) | ((magnitude >> (segment + 1)) & 0x0F)
+        codes = np.where(segment >= 8, 0x7F, codes) ^ mask
+        _ulaw_table = np.roll(codes.astype(np.uint8), -32768)
+    return _ulaw_table
+
+
+def get_alaw_table():
+    global _alaw_table
+    if _alaw_table is None:
+        samples = np.arange(-32768, 32768, dtype=np.int32) >> 3
+        mask = np.where(samples >= 0, 0xD5, 0x55)
+        magnitude = np.where(samples >= 0, samples, -samples - 1)
+        segment = np.searchsorted(ALAW_SEGMENT_ENDS, magnitude)
+        shift = np.maximum(segment, 1)
+        codes = (np.minimum(segment, 7) << 4) | ((magnitude >> shift) & 0x0F)
+        # the magnitudes beyond the last segment are clipped to its largest code
+        codes = np.where(segment >= 8, 0x7F, codes) ^ mask
+        _alaw_table = np.roll(codes.astype(np.uint8), -32768)
+    return _alaw_table
+
+
+_ulaw_table = None
+_alaw_table = None
+
+
+# Encode 16bit samples as G.711 bytes
+def encode_ulaw(array):
+    return get_ulaw_table()[np.asarray(array, dtype=np.int16).view(np.uint16)]
+
+
+def encode_alaw(array):
+    return get_alaw_table()[np.asarray(array, dtype=np.int16).view(np.uint16)]
+
+
+# Decode G.711 bytes back to 16bit samples
+def decode_ulaw(array):
+    codes = ~np.asarray(array, dtype=np.uint8).astype(np.int32) & 0xFF
+    magnitude = (((codes & 0x0F) << 3) + ULAW_BIAS) << ((codes & 0x70) >> 4)
+    return np.where(codes & 0x80, ULAW_BIAS - magnitude, magnitude - ULAW_BIAS).astype(np.int16)
+
+
+def decode_alaw(array):
+    codes = np.asarray(array, dtype=np.uint8).astype(np.int32) ^ 0x55
+    segment = (codes & 0x70) >> 4
+    magnitude = ((codes & 0x0F) << 4) + np.where(segment == 0, 8, 0x108)
+    magnitude <<= np.maximum(segment - 1, 0)
+    return np.where(codes & 0x80, magnitude, -magnitude).astype(np.int16)
+
+
+# Find where the data chunk (the samples) of a wav file starts, and how many bytes it has
+# The chunks before it (e.g. "fmt ", "LIST") are skipped by their sizes
+def find_data_chunk(path):
+    with open(path, "rb") as file_to_read:
+        riff, _, wave_id = struct.unpack('<4sI4s', file_to_read.read(12))
+        if riff != b'RIFF' or wave_id != b'WAVE':
+            raise wave.Error('file does not start with RIFF id')
+        file_size = file_to_read.seek(0, 2)
+        offset = 12
+        while offset + 8 <= file_size:
+            file_to_read.seek(offset)
+            chunk_id, chunk_size = struct.unpack('<4sI', file_to_read.read(8))
+            offset += 8
+            if chunk_id == b'data':
+                # a wav file written as a stream may not have the right size in its header
+                return offset, min(chunk_size, file_size - offset)
+            # the chunks are padded to an even size
+            offset += chunk_size + (chunk_size & 1)
+    raise wave.Error('data chunk missing')
+
+
+# Map size bytes of an open file from offset into memory, read-only
+# mmap can only start at a multiple of its allocation granularity, so the map starts before the offset
+def map_file(file_to_map, offset, size):
+    if size == 0:
+        return b''
+    start = offset - offset % mmap.ALLOCATIONGRANULARITY
+    mapped = mmap.mmap(file_to_map.fileno(), offset - start + size, access=mmap.ACCESS_READ, offset=start)
+    return memoryview(mapped)[offset - start:]
+
+
+# Convert raw (little endian) frames of a pyaudio format to a numpy array without copying them
+# 24bit frames are converted to 32bit integers: each sample is put in the top 3 bytes of a 32bit integer,
+# and an arithmetic shift brings it down with its sign
+def frames_to_array(raw, format):
+    if format == PA_INT24:
+        samples = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3)
+        padded = np.zeros((len(samples), 4), dtype=np.uint8)
+        padded[:, 1:] = samples
+        return padded.view('<i4').ravel() >> 8
+    return np.frombuffer(raw, dtype=np.dtype(NP_TYPES[format]).newbyteorder('<'))
+
+
+# Convert a numpy array to raw (little endian) frames of a pyaudio format
+def array_to_frames(array, format):
+    if format == PA_INT24:
+        return array.astype('<i4').view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+    return array.astype(np.dtype(NP_TYPES[format]).newbyteorder('<'), copy=False).tobytes()
+
+
 def test_add():
     c = Audio()
     e = Audio()
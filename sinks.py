@@ -0,0 +1,237 @@
+from threading import Condition
+from time import perf_counter, sleep
+from typing import BinaryIO, Dict, Optional, Union
+
+import numpy as np
+
+from simpleaudio import (CHANNELS, ENCODING_PCM, FORMAT, NP_TYPES, RATE, WavWriter, array_to_frames,
+                         get_default_device, get_sample_size)
+
+# the values a PortAudio stream callback returns, the same as pyaudio.paContinue and pyaudio.paComplete
+PA_CONTINUE = 0
+PA_COMPLETE = 1
+
+DEVICE_BUFFER_TIME = 0.1  # unit: second, how much audio a sink takes ahead of what is being played
+CALLBACK_FRAMES = 1024  # the frames asked for by every callback of the device
+
+
+# where the synthesised audio goes, a chunk at a time
+# with realtime, a sink takes the chunks at the pace they would be played, as a sound card does:
+# a write waits while more than buffer_time is queued ahead of the playback, and a chunk that arrives
+# after the audio before it has finished playing is counted as an underrun (the listener hears a gap)
+class Sink:
+    def __init__(self, rate: int=RATE, channels: int=CHANNELS, format: int=FORMAT, realtime: bool=False,
+                 buffer_time: float=DEVICE_BUFFER_TIME) -> None:
+        self.rate = rate
+        self.chan = channels
+        self.format = format
+        self.nptype = NP_TYPES[format]
+        self.realtime = realtime
+        self.buffer_time = buffer_time
+        self.frames_written = 0
+        self.underruns = 0
+        self.underrun_time = 0.0  # unit: second, the total length of the gaps
+        self.open_time = perf_counter()
+        self.first_write_time = None  # when the first chunk arrived, None until it does
+        self.play_end = 0.0  # when everything written so far will have been played
+        self.closed = False
+
+    def __enter__(self) -> 'Sink':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    # take a chunk of samples
+    def write(self, chunk: np.ndarray) -> None:
+        frames = len(chunk) // self.chan
+        now = perf_counter()
+        if self.first_write_time is None:
+            self.first_write_time = now
+            self.play_end = now
+        elif now > self.play_end:
+            self.underruns += 1
+            self.underrun_time += now - self.play_end
+            self.play_end = now
+        self.play_end += frames / self.rate
+        self.write_frames(chunk)
+        self.frames_written += frames
+        if self.realtime:
+            ahead = self.play_end - perf_counter() - self.buffer_time
+            if ahead > 0:
+                sleep(ahead)
+
+    # write the samples to the backend, the backends override it
+    def write_frames(self, chunk: np.ndarray) -> None:
+        pass
+
+    # wait until everything written has been played (with realtime), and release the backend
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if self.realtime:
+            left = self.play_end - perf_counter()
+            if left > 0:
+                sleep(left)
+
+    # the counters of the sink
+    def stats(self) -> Dict[str, float]:
+        return {'frames': self.frames_written,
+                'seconds': self.frames_written / self.rate,
+                'first_chunk_latency': (self.first_write_time - self.open_time
+                                        if self.first_write_time is not None else None),
+                'underruns': self.underruns,
+                'underrun_seconds': self.underrun_time}
+
+
+# a sink that throws the audio away, to measure the synthesis (and, with realtime, its scheduling) on its own
+class NullSink(Sink):
+    pass
+
+
+# a sink that writes the audio to a wav file as it arrives (or with raw, just its samples),
+# in the encoding given (see WavWriter)
+class FileSink(Sink):
+    def __init__(self, path: Union[str, BinaryIO], rate: int=RATE, channels: int=CHANNELS, format: int=FORMAT,
+                 realtime: bool=False, buffer_time: float=DEVICE_BUFFER_TIME, raw: bool=False,
+                 encoding: str=ENCODING_PCM) -> None:
+        super().__init__(rate, channels, format, realtime, buffer_time)
+        self.writer = WavWriter(path, rate, channels, format, raw=raw, encoding=encoding)
+
+    def write_frames(self, chunk: np.ndarray) -> None:
+        self.writer.write(chunk)
+
+    def close(self) -> None:
+        if not self.closed:
+            self.writer.close()
+        super().close()
+
+
+# a sink that writes the raw samples of the audio to the standard output, for piping it into another program
+class StdoutSink(FileSink):
+    def __init__(self, rate: int=RATE, channels: int=CHANNELS, format: int=FORMAT, realtime: bool=False,
+                 buffer_time: float=DEVICE_BUFFER_TIME, encoding: str=ENCODING_PCM) -> None:
+        super().__init__('-', rate, channels, format, realtime, buffer_time, raw=True, encoding=encoding)
+
+
+# a fixed size queue of samples between a producer and a consumer on another thread
+# the producer waits while it is full, and the consumer never waits: it takes what there is
+class RingBuffer:
+    def __init__(self, capacity: int, dtype: type=np.int16) -> None:
+        self.data = np.zeros(capacity, dtype=dtype)
+        self.start = 0  # where the oldest sample is
+        self.size = 0  # how many samples are queued
+        self.closed = False  # no more samples will be written
+        self.condition = Condition()
+
+    # queue all the samples, waiting for room when the buffer is full
+    def write(self, samples: np.ndarray) -> None:
+        position = 0
+        while position < len(samples):
+            with self.condition:
+                while self.size == len(self.data):
+                    self.condition.wait()
+                position += self.write_some(samples[position:])
+
+    # queue as many of the samples as there is room for without waiting, and return how many that was
+    def write_some(self, samples: np.ndarray) -> int:
+        capacity = len(self.data)
+        with self.condition:
+            count = min(capacity - self.size, len(samples))
+            end = (self.start + self.size) % capacity
+            first = min(count, capacity - end)
+            self.data[end:end + first] = samples[:first]
+            self.data[:count - first] = samples[first:count]
+            self.size += count
+        return count
+
+    # take up to count samples out of the buffer
+    def read(self, count: int) -> np.ndarray:
+        capacity = len(self.data)
+        with self.condition:
+            count = min(count, self.size)
+            first = min(count, capacity - self.start)
+            samples = np.concatenate((self.data[self.start:self.start + first], self.data[:count - first]))
+            self.start = (self.start + count) % capacity
+            self.size -= count
+            self.condition.notify_all()
+        return samples
+
+    # tell the consumer that no more samples will come
+    def close(self) -> None:
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    # wait until the consumer has taken every sample
+    def wait_empty(self) -> None:
+        with self.condition:
+            while self.size:
+                self.condition.wait()
+
+
+# a sink that plays the audio on the sound card with PyAudio in callback mode
+# the chunks are queued in a ring buffer that PortAudio takes from on its own thread, so a write only waits
+# when the buffer is full, and the playback starts as soon as the first chunk arrives
+class PyAudioSink(Sink):
+    def __init__(self, rate: int=RATE, channels: int=CHANNELS, format: int=FORMAT,
+                 buffer_time: float=DEVICE_BUFFER_TIME, device: Optional[object]=None) -> None:
+        # the ring buffer keeps the pace of the playback, so the base class does not have to
+        super().__init__(rate, channels, format, False, buffer_time)
+        self.ring = RingBuffer(max(int(buffer_time * rate), CALLBACK_FRAMES) * channels, self.nptype)
+        self.device_underruns = 0  # callbacks that found less audio than they asked for
+        self.frame_size = get_sample_size(format) * channels
+        device = device or get_default_device()
+        self.stream = device.open(format=format, channels=channels, rate=rate, output=True,
+                                  frames_per_buffer=CALLBACK_FRAMES, stream_callback=self.callback,
+                                  start=False)
+        self.started = False
+
+    # called by PortAudio on its own thread whenever it needs frame_count frames
+    def callback(self, in_data, frame_count: int, time_info, status):
+        samples = self.ring.read(frame_count * self.chan)
+        raw = array_to_frames(samples, self.format)
+        if len(samples) < frame_count * self.chan:
+            if self.ring.closed:
+                # everything has been played, the stream can stop
+                return raw, PA_COMPLETE
+            # fill the gap with silence and carry on
+            self.device_underruns += 1
+            raw += bytes(frame_count * self.frame_size - len(raw))
+        return raw, PA_CONTINUE
+
+    def write_frames(self, chunk: np.ndarray) -> None:
+        chunk = chunk.astype(self.nptype, copy=False)
+        if not self.started:
+            # queue a callback's worth of audio before starting, so the device does not begin with a gap
+            chunk = chunk[self.ring.write_some(chunk):]
+            if self.ring.size < CALLBACK_FRAMES * self.chan:
+                return
+            self.start()
+        self.ring.write(chunk)
+
+    # start playing what has been queued
+    def start(self) -> None:
+        self.stream.start_stream()
+        self.started = True
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.ring.close()
+        if not self.started and self.ring.size:
+            self.start()
+        if self.started:
+            # wait for the device to play what is left
+            self.ring.wait_empty()
+            while self.stream.is_active():
+                sleep(CALLBACK_FRAMES / self.rate)
+            self.stream.stop_stream()
+        self.stream.close()
+        super().close()
+
+    def stats(self) -> Dict[str, float]:
+        stats = super().stats()
+        stats['underruns'] = self.device_underruns
+        return stats
@@ -1,161 +1,496 @@
-from pathlib import Path
+from functools import lru_cache
+from time import perf_counter
 import argparse
 import re
-import os
-from typing import Dict, List, Optional
+from typing import Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
 
-from simpleaudio import Audio
-from nltk.corpus import cmudict
+from simpleaudio import MAX_AMP, AudioBuffer
+from diphone_bank import DiphoneBank
+from word_cache import WordCache
+from lexicon import Lexicon, get_default_lexicon
+from profiling import get_profiler, stage
+from timescale import MAX_RATE, MIN_RATE, TimeStretcher, time_stretch
+from phones import (COMMA_ID, DIPHONE_IDS, DIPHONES, EMPHASIS_OFF_ID, EMPHASIS_ON_ID, NUM_CONTROL_TOKENS,
+                    NUM_DIPHONES, PAU_ID, PERIOD_ID, PHONE_IDS, SWAP_EMPHASIS, diphones_to_ids, get_diphone_ids,
+                    ids_to_diphones, ids_to_phones, phones_to_ids)
 import numpy as np
 
+# the kinds of step in a concatenation plan
+SILENCE = 0
+UNIT = 1
+WORD = 2
+STREAM_CHUNK = 2048  # the number of samples in a chunk given out by Synth.iter_audio
+# the internal formats of Synth -> the type of the samples while they are being assembled (None: the type of the voice)
+INTERNAL_FORMATS = {'int16': None, 'float32': np.float32}
+REVERSE_WAYS = ('words', 'phones', 'signal')
 
+
+# the options of one synthesis, which are never changed, so a Synth can serve many requests with different options
+# at once: every call takes its options (the ones of the Synth if not given) instead of reading them from the Synth
+# spell and volume are used by the caller (for the Utterance and the gain), the rest by the Synth
+# emphasis is the switch of emphasis at the start, for a phrase that carries on the emphasis of the one before
+class SynthOptions(NamedTuple):
+    crossfade: bool = False
+    reverse: Optional[str] = None
+    spell: bool = False
+    volume: Optional[int] = None
+    speaking_rate: float = 1.0
+    emphasis: bool = False
+
+    # the options given on the commandline
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> 'SynthOptions':
+        return cls(crossfade=bool(args.crossfade), reverse=args.reverse, spell=bool(getattr(args, 'spell', False)),
+                   volume=getattr(args, 'volume', None), speaking_rate=getattr(args, 'speaking_rate', None) or 1.0)
+
+    # check the options the Synth uses, raise ValueError if one is not valid
+    def check(self) -> 'SynthOptions':
+        if self.reverse not in (None,) + REVERSE_WAYS:
+            raise ValueError('the reverse way should be one of {}'.format(', '.join(REVERSE_WAYS)))
+        if not MIN_RATE <= self.speaking_rate <= MAX_RATE:
+            raise ValueError('the speaking rate should be between {} and {}'.format(MIN_RATE, MAX_RATE))
+        return self
+
+    # the factor of the volume, None at full volume
+    def get_gain(self) -> Optional[float]:
+        return self.volume / 100 if self.volume is not None else None
+
+
+# the switch of emphasis after a diphone sequence, which started with the switch as it is given:
+# left on by a "{" and turned off by a "}", whichever comes last
+def carry_emphasis(diphone_ids: np.ndarray, emphasis: bool) -> bool:
+    signs = diphone_ids[(diphone_ids == EMPHASIS_ON_ID) | (diphone_ids == EMPHASIS_OFF_ID)]
+    if len(signs):
+        return bool(signs[-1] == EMPHASIS_ON_ID)
+    return emphasis
+
+
+# a Synth only holds the voice and what is made from it, which is never changed by a synthesis,
+# so one Synth can be shared by the threads of a pool
+# the diphone bank and the lexicon are loaded as args says, unless they are given (e.g. from a SharedVoice)
 class Synth:
-    def __init__(self, args: dict) -> None:
-        self.all_diphones = self.load_diphone_data(args.diphones)
+    def __init__(self, args: dict, diphone_bank: Optional[DiphoneBank]=None,
+                 lexicon: Optional[Lexicon]=None) -> None:
+        # the rate of the synthesised audio, the rate of the voice if not given
+        if diphone_bank is None:
+            self.all_diphones = self.load_diphone_data(args.diphones, getattr(args, 'output_rate', None))
+        else:
+            self.all_diphones = self.use_diphone_bank(diphone_bank)
         self.comma_silence_time = 0.2  # unit: second
         self.period_silence_time = 0.4  # unit: second
-        self.emphasis_flag = False  # a flag used for emphasis function
         self.emphasis_scale = 2  # the scale of emphasis (two times)
         self.crossfade_time = 0.01  # unit: second
-        self.crossfade = args.crossfade
-        self.reverse = args.reverse
+        # the type of the samples while they are being assembled: "int16" assembles them in the type of the voice
+        # (every step is quantised, and loud emphasised diphones wrap around), "float32" in float,
+        # with one clipped conversion at the end
+        self.internal_format = getattr(args, 'internal_format', None) or 'int16'
+        if self.internal_format not in INTERNAL_FORMATS:
+            raise ValueError('the internal format should be one of {}'.format(', '.join(INTERNAL_FORMATS)))
+        self.work_type = INTERNAL_FORMATS[self.internal_format] or self.nptype
+        # the options of the calls that do not give their own, e.g. the speaking rate: how fast the utterances are
+        # spoken, 1.0 as the voice is recorded, changed by time stretching the audio
+        self.options = SynthOptions.from_args(args).check()
+        # the pronunciation lexicon, loaded once and shared by the utterances synthesised with this Synth
+        self.lexicon = lexicon if lexicon is not None else get_default_lexicon()
+        # an optional cache of the assembled samples of words, with a budget in MB
+        word_cache_size = getattr(args, 'word_cache', None)
+        self.word_cache = WordCache(int(word_cache_size * 2**20)) if word_cache_size else None
 
     # reverse in "signal" way: switch the waveform signal for the whole synthetic utterance back to front
     @staticmethod
-    def reverse_signal_way(audio: Audio) -> Audio:
+    def reverse_signal_way(audio: AudioBuffer) -> AudioBuffer:
         audio.data = audio.data[::-1]
         return audio
 
-    # load the diphone data from the wav_folder, and generate an dictionary for all the diphones
-    def load_diphone_data(self, wav_folder: str) -> Dict[str, str]:
-        self.all_diphones = {}  # an empty dictionary for storing all the diphones and its corresponding .wav files
-        # get all path of all the diphone files
-        self.all_diphone_wav_files = (str(item) for item in Path(wav_folder).glob('*.wav') if item.is_file())
-        # check if there is wav file in the list
-        if not self.all_diphone_wav_files:
+    # load the diphone data once and keep all the diphones in memory
+    # wav_folder is either a folder of diphone wav files or a packed voice file made by build_voice.py,
+    # which is memory-mapped instead of being read
+    # with an output_rate other than the rate of the voice, all the diphones are resampled once here,
+    # so that everything after works at the output rate
+    def load_diphone_data(self, wav_folder: str, output_rate: Optional[int]=None) -> DiphoneBank:
+        with stage('voice_loading'):
+            self.all_diphones = DiphoneBank.load(wav_folder)
+        # check if there is any diphone in the voice
+        if not len(self.all_diphones):
             print("there is no wav file in the {}".format(wav_folder))
-        # for every .wav file, extract the real file name without path (e.g. diphones/) and the file suffix (e.g. .wav)
-        for wav_file in self.all_diphone_wav_files:
-            # get the file name first (e.g. xxx.wav)
-            file_name_without_path = os.path.split(wav_file)[1]
-            # extract the file name before ".wav"
-            file_name = re.findall(r'(.+?)\.wav', file_name_without_path)
-            # put the file name and wav file path together in the dictionary, file name as key, and the path as value
-            self.all_diphones[file_name[0]] = wav_file
-        
-        # get the first file path in the all diphones dictionary and load it
-        first_diphone_path = (list(self.all_diphones.values())[0])
-        tmp_audio = Audio()  # initial an instance of class Audio
-        # load the first diphone file
-        tmp_audio.load(first_diphone_path)
-        # in order to get the rate and nptype for later works
-        self.rate = tmp_audio.rate
-        self.nptype = tmp_audio.nptype
-        del tmp_audio
-        
+        if output_rate and output_rate != self.all_diphones.rate:
+            voice_rate = self.all_diphones.rate
+            with stage('resampling'):
+                self.all_diphones = self.all_diphones.resample(output_rate)
+            print("Resampled the diphones from {} Hz to {} Hz".format(voice_rate, output_rate))
+        # report the load time and the memory held by the diphones
+        print(self.all_diphones.describe())
+        return self.use_diphone_bank(self.all_diphones)
+
+    # synthesise with the diphones of the bank, which is used as it is (at its rate)
+    def use_diphone_bank(self, diphone_bank: DiphoneBank) -> DiphoneBank:
+        self.all_diphones = diphone_bank
+        # get the rate and nptype for later works
+        self.rate = self.all_diphones.rate
+        self.nptype = self.all_diphones.nptype
+        # diphone ID -> position in the diphone bank, -1 if the voice does not have the diphone
+        # (the extra last entry is for MISSING_DIPHONE_ID, which is -1)
+        self.diphone_slots = np.full(NUM_DIPHONES + 1, -1, dtype=np.intp)
+        for slot, name in enumerate(self.all_diphones.names):
+            diphone_id = DIPHONE_IDS.get(name, -1)
+            if diphone_id >= NUM_CONTROL_TOKENS:
+                self.diphone_slots[diphone_id] = slot
+
         return self.all_diphones
 
     # generate an output audio of a diphone sequence with diphone files
-    def get_output_audio_of_diphone_seq(self, diphone_seq_list: List[str]) -> Audio:
-        output_audio = Audio()  # initial an instance of class Audio
-        # create an empty np array for later stroring audio data
-        diphone_seq_data = np.array([], dtype = self.nptype)
-        # for every diphone, get the corresponding file path
-        # load it and store to the diphone data
-        # insert silence time for "," and "."
-        for diphone in diphone_seq_list:
-            # for "," and the punctuation sign "." (actually include ".", ":", "?", "!")
-            # insert a corresponding silence array data
-            if diphone == ',':
-                # calculate the silence array length = silence time * rate
-                array_len = int(np.floor(self.rate * self.comma_silence_time))  
-                array = np.zeros(array_len, dtype=self.nptype)  # initial the zero np array for silence
-                diphone_seq_data = np.concatenate((diphone_seq_data, array))  # add the array to diphone sequence data
-            elif diphone == '.':
-                array_len = int(np.floor(self.rate * self.period_silence_time))
-                array = np.zeros(array_len, dtype=self.nptype)
-                diphone_seq_data = np.concatenate((diphone_seq_data, array))
-            # for emphasis sign "{" and "}", the switch of emphasis will accordingly turn on or off
-            elif diphone == '{':
-                self.emphasis_flag = True
-            elif diphone == '}':
-                self.emphasis_flag = False
-            else:
-                # convert each diphone (except "," "." "{" "}") into lower case first
-                # since the wav file names are in lower case
-                diphone = diphone.lower()
-                try:
-                    # get the file path of the diphone
-                    diphone_file_path = self.all_diphones[diphone]
-                except KeyError:
-                    print('cannot find the wav file of "{}".'.format(diphone))
-                else:
-                    output_audio.load(diphone_file_path)  # load the corresponding diphone file path
-                    # if the switch of emphasis is on, increase the loudness by emphasis_scale times
-                    if self.emphasis_flag:
-                        output_audio.data *= self.emphasis_scale 
-                    # if the cross-fading is required, call the smoother_audio_concatenation function and get the processed diphone sequence data
-                    if self.crossfade:
-                        diphone_seq_data = self.smoother_audio_concatenation(diphone_seq_data, output_audio.data)
-                    # else just put the data of the output_audio to the end of diphone sequence data
-                    else:
-                        diphone_seq_data = np.concatenate((diphone_seq_data, output_audio.data))
-
-        # assign the data concatenated to the output audio
-        output_audio.data = diphone_seq_data
-        output_audio.data.dtype = self.nptype  # ensure the data type is the same as the nptype
+    # the diphone sequence is either a list of diphone names or an array of diphone IDs
+    # word_spans (from Utterance.get_word_spans) lets the words be taken from the word cache
+    # the audio is assembled in two passes: plan_diphone_seq works out what goes where and the exact length,
+    # then render_plan fills one preallocated array, so no diphone is copied more than once
+    # gain (the volume) and quantise are applied at the end, see finish_samples
+    # options (see SynthOptions) are the ones of the Synth if not given
+    def get_output_audio_of_diphone_seq(self, diphone_seq_list: Union[Sequence[str], np.ndarray],
+                                        word_spans: Optional[np.ndarray]=None, gain: Optional[float]=None,
+                                        quantise: bool=True, options: Optional[SynthOptions]=None) -> AudioBuffer:
+        options = options or self.options
+        with stage('diphone_lookup'):
+            plan, length = self.plan_diphone_seq(diphone_seq_list, word_spans, options)
+        with stage('concatenation'):
+            diphone_seq_data = self.render_plan(plan, length, self.get_overlap_len(options))
+        if options.speaking_rate != 1.0:
+            with stage('time_stretch'):
+                diphone_seq_data = time_stretch(diphone_seq_data, options.speaking_rate)
+        data = self.finish_samples(diphone_seq_data, gain, quantise)
+        # the output audio only holds the data assembled, it does not need an audio device
+        output_audio = AudioBuffer(data, rate=self.rate, nptype=data.dtype.type)
 
         # if the user choose to reverse in "signal" way, call the reverse_signal function
-        if self.reverse == 'signal':
+        if options.reverse == 'signal':
             output_audio = self.reverse_signal_way(output_audio)  # then assign it to the output_audio
 
         return output_audio
 
+    # generate the audio of a diphone sequence as a stream of chunks of chunk_size samples (the last one can be shorter)
+    # a chunk is given out as soon as the diphones in it are assembled, so playing or saving can start straight away
+    # when cross-fading, the last cross_fading_len samples are held back until the next diphone has been added to them
+    # gain (the volume) and quantise are applied to every chunk, see finish_samples
+    # with a speaking rate other than 1.0, the chunks are time stretched as they come, so they vary in size
+    def iter_audio(self, diphone_seq_list: Union[Sequence[str], np.ndarray], chunk_size: int=STREAM_CHUNK,
+                   word_spans: Optional[np.ndarray]=None, gain: Optional[float]=None,
+                   quantise: bool=True, options: Optional[SynthOptions]=None) -> Iterator[np.ndarray]:
+        options = options or self.options
+        chunks = self.iter_samples(diphone_seq_list, chunk_size, word_spans, options)
+        if options.speaking_rate != 1.0:
+            chunks = self.iter_stretched(chunks, options.speaking_rate)
+        for chunk in chunks:
+            yield self.finish_samples(chunk, gain, quantise, copy=True)
+
+    # time stretch a stream of chunks to the speaking rate
+    @staticmethod
+    def iter_stretched(chunks: Iterator[np.ndarray], speaking_rate: float) -> Iterator[np.ndarray]:
+        stretcher = TimeStretcher(speaking_rate)
+        for chunk in chunks:
+            with stage('time_stretch'):
+                stretched = stretcher.process(chunk)
+            if len(stretched):
+                yield stretched
+        with stage('time_stretch'):
+            stretched = stretcher.flush()
+        if len(stretched):
+            yield stretched
+
+    # the chunks of iter_audio, in the internal format, before anything is applied to them
+    # a chunk is only valid until the next one is asked for, as the samples are assembled in the same buffer
+    def iter_samples(self, diphone_seq_list: Union[Sequence[str], np.ndarray], chunk_size: int=STREAM_CHUNK,
+                     word_spans: Optional[np.ndarray]=None,
+                     options: Optional[SynthOptions]=None) -> Iterator[np.ndarray]:
+        options = options or self.options
+        cross_fading_len = self.get_overlap_len(options)
+        with stage('diphone_lookup'):
+            plan, length = self.plan_diphone_seq(diphone_seq_list, word_spans, options)
+        # reversing in "signal" way needs the whole utterance before its first sample
+        if options.reverse == 'signal':
+            with stage('concatenation'):
+                diphone_seq_data = self.render_plan(plan, length, cross_fading_len)[::-1]
+            for start in range(0, length, chunk_size):
+                yield diphone_seq_data[start:start + chunk_size]
+            return
+
+        longest_step = max((step[1] if step[0] == SILENCE else len(step[1]) for step in plan), default=0)
+        # the samples that have been assembled but not given out yet
+        pending_data = np.empty(chunk_size + cross_fading_len + longest_step, dtype=self.work_type)
+        pending_len = 0
+        # the steps are timed one by one, so the time spent on the chunks given out is not counted
+        profiler = get_profiler()
+        for step in plan:
+            if profiler is not None:
+                start_time = perf_counter()
+            pending_len = self.write_step(pending_data, pending_len, step, cross_fading_len)
+            if profiler is not None:
+                profiler.add('concatenation', perf_counter() - start_time)
+            # give out every full chunk that the next diphone cannot overlap any more
+            start = 0
+            while pending_len - start - cross_fading_len >= chunk_size:
+                yield pending_data[start:start + chunk_size]
+                start += chunk_size
+            if start:
+                pending_data[:pending_len - start] = pending_data[start:pending_len]
+                pending_len -= start
+        if pending_len:
+            yield pending_data[:pending_len]
+
+    # the last step of the synthesis: apply the gain (the volume) and give the samples out in the type of the voice
+    # with the int16 internal format, the samples are in that type already, and the gain is applied as it always was
+    # (truncated, and wrapping around)
+    # with the float32 internal format (or time stretched samples, which are float), the gain and the conversion
+    # are one clipped (and rounded) conversion,
+    # or if not quantise, the float samples are given out between -1 and 1
+    # with copy, the samples given out never share the memory of data
+    def finish_samples(self, data: np.ndarray, gain: Optional[float]=None, quantise: bool=True,
+                       copy: bool=False) -> np.ndarray:
+        if data.dtype == self.nptype:
+            if gain is None:
+                return data.copy() if copy else data
+            with stage('volume'):
+                return (data * gain).astype(self.nptype)
+        with stage('volume'):
+            if not quantise:
+                return np.multiply(data, (1.0 if gain is None else gain) / MAX_AMP, dtype=np.float32)
+            info = np.iinfo(self.nptype)
+            if gain is not None:
+                data = data * np.float32(gain)
+            return np.clip(np.rint(data), info.min, info.max).astype(self.nptype)
+
+    # the length of the overlap between adjacent diphones when cross-fading
+    def get_cross_fading_len(self) -> int:
+        return int(np.floor(self.crossfade_time * self.rate))
+
+    # the length of the overlap between adjacent diphones with the options, 0 if they do not cross-fade
+    def get_overlap_len(self, options: SynthOptions) -> int:
+        return self.get_cross_fading_len() if options.crossfade else 0
+
+    # the first pass: resolve the diphone sequence into a plan of silences and diphone units
+    # diphone_seq is either a list of diphone names or an array of diphone IDs (see phones.py)
+    # a step of the plan is either (SILENCE, silence length), (UNIT, diphone data, emphasis flag),
+    # or (WORD, samples) for the samples of a whole word assembled already
+    # return the plan together with the exact length of the output
+    def plan_diphone_seq(self, diphone_seq: Union[Sequence[str], np.ndarray],
+                         word_spans: Optional[np.ndarray]=None,
+                         options: Optional[SynthOptions]=None) -> Tuple[List[tuple], int]:
+        options = options or self.options
+        if isinstance(diphone_seq, np.ndarray):
+            diphone_ids = diphone_seq
+        else:
+            # the names are matched in lower case, since the wav file names are in lower case
+            diphone_ids = diphones_to_ids(diphone_seq)
+        is_control = (diphone_ids >= 0) & (diphone_ids < NUM_CONTROL_TOKENS)
+        # where every diphone is in the diphone bank, -1 if the voice does not have it
+        slots = self.diphone_slots[diphone_ids]
+        is_unit = slots >= 0
+
+        # tell the user about all the diphones that cannot be found at once
+        missing = np.flatnonzero(~is_control & ~is_unit)
+        if len(missing):
+            if isinstance(diphone_seq, np.ndarray):
+                missing_names = [DIPHONES[diphone_id].lower() for diphone_id in diphone_ids[missing].tolist()]
+            else:
+                missing_names = [diphone_seq[num].lower() for num in missing.tolist()]
+            print('cannot find the wav files of {}.'.format(', '.join('"{}"'.format(name) for name in missing_names)))
+
+        # for emphasis sign "{" and "}", the switch of emphasis will accordingly turn on or off
+        # so a diphone is emphasised if the last sign before it is "{", or if there is none and the switch was on
+        # (options.emphasis, see carry_emphasis for the switch after the sequence)
+        positions = np.arange(len(diphone_ids))
+        last_on = np.maximum.accumulate(np.where(diphone_ids == EMPHASIS_ON_ID, positions, -1))
+        last_off = np.maximum.accumulate(np.where(diphone_ids == EMPHASIS_OFF_ID, positions, -1))
+        emphasis = np.where(last_on == last_off, options.emphasis, last_on > last_off)
+
+        # for "," and the punctuation sign "." (actually include ".", ":", "?", "!")
+        # insert a corresponding silence, the silence length = silence time * rate
+        lengths = np.zeros(len(diphone_ids), dtype=np.int64)
+        lengths[diphone_ids == COMMA_ID] = int(np.floor(self.rate * self.comma_silence_time))
+        lengths[diphone_ids == PERIOD_ID] = int(np.floor(self.rate * self.period_silence_time))
+        lengths[is_unit] = self.all_diphones.lengths[slots[is_unit]]
+        is_step = is_unit | (diphone_ids == COMMA_ID) | (diphone_ids == PERIOD_ID)
+
+        # when cross-fading, every diphone but the first one overlaps the end of the data before it
+        cross_fading_len = self.get_overlap_len(options)
+        too_short = np.flatnonzero(is_unit & (lengths < cross_fading_len))
+        if len(too_short):
+            raise ValueError('the diphone "{}" is shorter than the cross-fading time.'
+                             .format(DIPHONES[diphone_ids[too_short[0]]].lower()))
+
+        # take the words from the word cache, a word is a run of diphones that starts at its first phone,
+        # so its samples only depend on its diphones (which include the first phone of the next word)
+        words = {}  # position of the first diphone of a word -> (position after its last diphone, samples)
+        is_overlapping = is_unit
+        if self.word_cache is not None and word_spans is not None:
+            is_overlapping = is_unit.copy()
+            for start, end in word_spans.tolist():
+                if end - start < 2 or not is_unit[start:end].all():
+                    continue
+                samples = self.get_word_samples(diphone_ids[start:end], slots[start:end], bool(emphasis[start]),
+                                                cross_fading_len)
+                words[start] = (end, samples)
+                # the word is one step, which overlaps the data before it like a diphone does
+                lengths[start] = len(samples)
+                lengths[start + 1:end] = 0
+                is_step[start + 1:end] = False
+                is_overlapping[start + 1:end] = False
+
+        overlaps = is_overlapping & (np.cumsum(lengths) - lengths > 0)
+        length = int(lengths.sum()) - cross_fading_len * int(overlaps.sum())
+
+        # get the samples of every diphone from the diphone bank
+        plan = []
+        for num in np.flatnonzero(is_step).tolist():
+            if num in words:
+                plan.append((WORD, words[num][1]))
+            elif is_unit[num]:
+                plan.append((UNIT, self.get_diphone_data(slots[num]), bool(emphasis[num])))
+            else:
+                plan.append((SILENCE, int(lengths[num])))
+        return plan, length
+
+    # get the samples of a diphone from the diphone bank by its position in the bank
+    def get_diphone_data(self, slot: int) -> np.ndarray:
+        offset = self.all_diphones.offsets[slot]
+        return self.all_diphones.data[offset:offset + self.all_diphones.lengths[slot]]
+
+    # get the assembled samples of a word from the word cache, or assemble and cache them
+    # the samples are assembled as if the word was a whole utterance, with its start and end faded when cross-fading
+    def get_word_samples(self, diphone_ids: np.ndarray, slots: np.ndarray, emphasis: bool,
+                         cross_fading_len: int) -> np.ndarray:
+        key = (diphone_ids.tobytes(), cross_fading_len, self.emphasis_scale if emphasis else 1,
+               np.dtype(self.work_type).char)
+        samples = self.word_cache.get(key)
+        if samples is None:
+            word_plan = [(UNIT, self.get_diphone_data(slot), emphasis) for slot in slots.tolist()]
+            length = int(self.all_diphones.lengths[slots].sum()) - cross_fading_len * (len(slots) - 1)
+            samples = self.render_plan(word_plan, length, cross_fading_len)
+            self.word_cache.put(key, samples)
+        return samples
+
+    # the second pass: fill one preallocated array (of the internal format) by following the plan
+    # cross_fading_len is the overlap of adjacent diphones (see get_overlap_len), 0 if they do not cross-fade
+    def render_plan(self, plan: List[tuple], length: int, cross_fading_len: int=0) -> np.ndarray:
+        diphone_seq_data = np.empty(length, dtype=self.work_type)
+        position = 0  # where the next step starts in diphone_seq_data
+        for step in plan:
+            position = self.write_step(diphone_seq_data, position, step, cross_fading_len)
+        return diphone_seq_data
+
+    # write one step of a plan to the diphone sequence data at the position, and return the position after it
+    def write_step(self, diphone_seq_data: np.ndarray, position: int, step: tuple, cross_fading_len: int) -> int:
+        if step[0] == SILENCE:
+            diphone_seq_data[position:position + step[1]] = 0
+            return position + step[1]
+        if step[0] == UNIT:
+            return self.write_unit(diphone_seq_data, position, step[1], step[2], cross_fading_len)
+        return self.write_word(diphone_seq_data, position, step[1], cross_fading_len)
+
+    # write the assembled samples of a word to the diphone sequence data at the position,
+    # and return the position after it
+    # the samples are faded already, so when cross-fading their start is just added to the data before them
+    def write_word(self, diphone_seq_data: np.ndarray, position: int, samples: np.ndarray,
+                   cross_fading_len: int) -> int:
+        cross_fading_len = cross_fading_len if position else 0
+        start = position - cross_fading_len
+        end = start + len(samples)
+        diphone_seq_data[position:end] = samples[cross_fading_len:]
+        diphone_seq_data[start:position] += samples[:cross_fading_len]
+        return end
+
+    # write the data of one diphone to the diphone sequence data at the position, and return the position after it
+    # the diphone data in the bank is never changed, emphasis and cross-fading are applied on the way
+    def write_unit(self, diphone_seq_data: np.ndarray, position: int, diphone_data: np.ndarray,
+                   emphasis: bool, cross_fading_len: int) -> int:
+        length = len(diphone_data)
+        # if the cross-fading is not required, just put the data to the end of diphone sequence data
+        if not cross_fading_len:
+            end = position + length
+            # if the switch of emphasis is on, increase the loudness by emphasis_scale times
+            if emphasis:
+                np.multiply(diphone_data, self.emphasis_scale, out=diphone_seq_data[position:end])
+            else:
+                diphone_seq_data[position:end] = diphone_data
+            return end
+        return self.smoother_audio_concatenation(diphone_seq_data, position, diphone_data, emphasis, cross_fading_len)
+
     # smooth the audio concatenation by cross-fading between adjacent diphones using cross_fading_time overlap
-    def smoother_audio_concatenation(self, audio_data_seq: np.ndarray, audio_data_add: np.ndarray) -> np.ndarray:
-        # calculate the length of cross fading
-        cross_fading_len = int(np.floor(self.crossfade_time * self.rate))
-        # initial two arrays for cross-fading
-        process_array_start = np.linspace(0, 1, cross_fading_len)
-        process_array_end = np.linspace(1, 0, cross_fading_len)
-        # use the cross-fading arrays to process the audio_data_add
-        audio_data_add[-cross_fading_len:] = \
-            (audio_data_add[-cross_fading_len:] * process_array_start).astype(self.nptype)
-        audio_data_add[:cross_fading_len] = \
-            (audio_data_add[:cross_fading_len] * process_array_end).astype(self.nptype)
-        # if the length of the audio data sequence is 0， or say, if it is the data of the first diphone audio
-        # directly put the processed audio_data_add to the audio_data_seq
-        if len(audio_data_seq) == 0:
-            concatenated_audio_data_seq = np.concatenate((audio_data_seq, audio_data_add))
-        # if not, concatenate the two audio data with overlapping
+    # the end of the diphone is faded in and its start is faded out, then its start is added to the last
+    # cross_fading_len samples of the data before it (unless it is the first diphone)
+    def smoother_audio_concatenation(self, diphone_seq_data: np.ndarray, position: int, diphone_data: np.ndarray,
+                                     emphasis: bool, cross_fading_len: int) -> int:
+        process_array_start, process_array_end = get_fade_windows(cross_fading_len)
+        scale = self.emphasis_scale if emphasis else 1
+        # the samples are rounded towards zero after every step in int16, but not in float32
+        work_type = diphone_seq_data.dtype
+        # the diphone overlaps the data before it, unless it is the first one
+        start = position - cross_fading_len if position else position
+        end = start + len(diphone_data)
+
+        if len(diphone_data) >= 2 * cross_fading_len:
+            # the faded start and end do not meet, so the middle of the diphone can go straight to the output
+            diphone_seq_data[start + cross_fading_len:end] = diphone_data[cross_fading_len:]
+            if emphasis:
+                diphone_seq_data[start + cross_fading_len:end] *= scale
+            audio_data_end = diphone_seq_data[end - cross_fading_len:end]
+            audio_data_end[:] = (audio_data_end * process_array_start).astype(work_type)
+            audio_data_start = diphone_data[:cross_fading_len] * scale
         else:
-            audio_data_seq[-cross_fading_len:] = \
-                (audio_data_seq[-cross_fading_len:] + audio_data_add[:cross_fading_len]).astype(self.nptype)
-            # put the rest of the audio_data_add to the audio data sequence
-            concatenated_audio_data_seq = np.concatenate((audio_data_seq, audio_data_add[cross_fading_len:]))
-        return concatenated_audio_data_seq
+            # a short diphone whose faded start and end overlap, process a copy of it
+            audio_data_add = diphone_data.astype(work_type) * scale
+            audio_data_add[-cross_fading_len:] = \
+                (audio_data_add[-cross_fading_len:] * process_array_start).astype(work_type)
+            diphone_seq_data[start + cross_fading_len:end] = audio_data_add[cross_fading_len:]
+            audio_data_start = audio_data_add[:cross_fading_len]
+        audio_data_start = (audio_data_start * process_array_end).astype(work_type)
+
+        if position:
+            diphone_seq_data[start:start + cross_fading_len] += audio_data_start
+        else:
+            diphone_seq_data[start:start + cross_fading_len] = audio_data_start
+        return end
+
+
+# the fade in and fade out windows of the cross-fading, made once for every cross-fading length
+@lru_cache(maxsize=None)
+def get_fade_windows(cross_fading_len: int) -> Tuple[np.ndarray, np.ndarray]:
+    process_array_start = np.linspace(0, 1, cross_fading_len)
+    process_array_end = np.linspace(1, 0, cross_fading_len)
+    # the windows are shared, so make sure nobody changes them
+    process_array_start.flags.writeable = False
+    process_array_end.flags.writeable = False
+    return process_array_start, process_array_end
+
+
+# normalise a phrase and get a straight forward sequence of words (with "," "." "{" "}" as words),
+# which is all of the text the synthesis depends on
+def get_words(phrase: str) -> List[str]:
+    lower_phrase = phrase.lower()  # convert the input phrase to lower case
+
+    # deal with the punctuation
+    # add a space before and after "," and "." for further spliting
+    puncsign_phrase = re.sub(r',', ' , ', lower_phrase)
+    puncsign_phrase = re.sub(r'\.', ' . ', puncsign_phrase)
+    # add a space before and after "{" and "}" (emphasis sign) for further spliting
+    # this step is for further dealing with the emphasis
+    puncsign_phrase = re.sub(r'{', ' { ', puncsign_phrase)
+    puncsign_phrase = re.sub(r'}', ' } ', puncsign_phrase)
+    # change the ":", "?", "!" to "." since they will have same silence time
+    # for further dealing with the silence time for these punctuation
+    puncsign_phrase = re.sub(r'[:?!]', ' . ', puncsign_phrase)
+    # ignore other punctuations, substitue all of them with spaces
+    # remain " ' ", since some of the words have and can be pronunced through cmudict
+    puncsign_phrase = re.sub(r"[^\w,.'{}]", ' ', puncsign_phrase)  
+    return puncsign_phrase.split()  # split it to a string list
 
 
 class Utterance:
-    def __init__(self, phrase: str, spell: bool=False, reverse: Optional[str]=None) -> None:
+    def __init__(self, phrase: str, spell: bool=False, reverse: Optional[str]=None,
+                 lexicon: Optional[Lexicon]=None) -> None:
+        # the pronunciation lexicon, the one shared by the whole process if not given
+        self.lexicon = lexicon if lexicon is not None else get_default_lexicon()
+
         # normalise the input phrase and get a straight forward sequence of words
-        self.lower_phrase = phrase.lower()  # convert the input phrase to lower case
-
-        # deal with the punctuation
-        # add a space before and after "," and "." for further spliting
-        self.puncsign_phrase = re.sub(r',', ' , ', self.lower_phrase)
-        self.puncsign_phrase = re.sub(r'\.', ' . ', self.puncsign_phrase)
-        # add a space before and after "{" and "}" (emphasis sign) for further spliting
-        # this step is for further dealing with the emphasis
-        self.puncsign_phrase = re.sub(r'{', ' { ', self.puncsign_phrase)
-        self.puncsign_phrase = re.sub(r'}', ' } ', self.puncsign_phrase)
-        # change the ":", "?", "!" to "." since they will have same silence time
-        # for further dealing with the silence time for these punctuation
-        self.puncsign_phrase = re.sub(r'[:?!]', ' . ', self.puncsign_phrase)
-        # ignore other punctuations, substitue all of them with spaces
-        # remain " ' ", since some of the words have and can be pronunced through cmudict
-        self.puncsign_phrase = re.sub(r"[^\w,.'{}]", ' ', self.puncsign_phrase)  
-        self.seq_words = self.puncsign_phrase.split()  # split it to a string list
+        self.seq_words = get_words(phrase)
 
         # if the user input "-s" or "--spell", convert the word sequence to a sequence of letters
         if spell:
@@ -195,22 +530,37 @@ class Utterance:
 
     # get the phone sequence of the input phrase
     def get_phone_seq(self) -> List[str]:
-        alphabet = cmudict.dict()  # a pronunciation lexicon provided as a part of NLTK
-        self.phone_seq_original = []  # an empty list for the original phones caught from cmudict
+        self.phone_seq = ids_to_phones(self.get_phone_ids())
+        return self.phone_seq
+
+    # get the phone sequence of the input phrase as an array of phone IDs (see phones.py)
+    def get_phone_ids(self) -> np.ndarray:
+        # the lexicon gives the phone IDs without the numbers of stress that cmudict has,
+        # so that they match the names of diphone wav files
+        # utterance should always start with an silence phone
+        # so add "PAU" (a label for the short pause or silence phone) to the first of the phone sequence
+        phone_id_parts = [np.array([PAU_ID])]
+        # the position in seq_words of the word of every phone, -1 for "PAU" and the punctuation
+        word_index_parts = [np.array([-1])]
         # create an empty list to save the words that is not in cmudict and cannot be pronounced
         self.words_cannot_pronunced = []  
 
-        for word in self.seq_words:
+        for word_index, word in enumerate(self.seq_words):
             # check if the word is in cmudict
             # if yes, get the pronunciation and add it to the phone list
             # for ",", ".", "{" and "}", remain
             # if the word is not in cmudict, add it to the words_cannot_pronunced list
-            if word in alphabet:
-                self.phone_seq_original.extend(alphabet[word][0])
+            word_phone_ids = self.lexicon.get_ids(word)
+            if word_phone_ids is not None:
+                phone_id_parts.append(word_phone_ids)
+                word_index_parts.append(np.full(len(word_phone_ids), word_index))
             elif word in [',', '.']:
-                self.phone_seq_original.extend(['PAU', word, 'PAU'])  # add "PAU" before and after a punctuation
+                # add "PAU" before and after a punctuation
+                phone_id_parts.append(np.array([PAU_ID, PHONE_IDS[word], PAU_ID]))
+                word_index_parts.append(np.array([-1, -1, -1]))
             elif word in ['{', '}']:
-                self.phone_seq_original.extend(word)
+                phone_id_parts.append(np.array([PHONE_IDS[word]]))
+                word_index_parts.append(np.array([-1]))
             else:
                 self.words_cannot_pronunced.append(word)
         # if there are some words cannot be pronunced in the phrase, tell the user
@@ -218,55 +568,51 @@ class Utterance:
             print('The word "{}" cannot be pronounced because it is not in the cmudict.'
                   .format(self.words_cannot_pronunced))
 
-        # the original phones provided by cmudict have numbers
-        # so try to delete the numbers in order to match the names of diphone wav files
-        self.phone_seq_without_num = []  # an empty list for storing the phones without numbers
-        for ori_phone in self.phone_seq_original:
-            self.phone_seq_without_num.append(re.sub(r'\d', '', ori_phone))
-
-        # utterance should always start and end with an silence phone
-        # so add "PAU" (a label for the short pause or silence phone) to the first and the end of the phone sequence
-        self.phone_seq_without_num.insert(0, 'PAU')
+        # the utterance should end with an silence phone as well
         # but if the last phone is "PAU", not add an extra "PAU"
         # since a "PAU" has already added if there is a punctuation at the end
-        if self.phone_seq_without_num[-1] != 'PAU':
-            self.phone_seq_without_num.extend(['PAU'])
-        self.phone_seq_with_pau = self.phone_seq_without_num  # then assign it to phone_seq_with_pau
-
-        self.phone_seq = self.phone_seq_with_pau  # the final vision of the phone sequence
+        if phone_id_parts[-1][-1] != PAU_ID:
+            phone_id_parts.append(np.array([PAU_ID]))
+            word_index_parts.append(np.array([-1]))
+        self.phone_ids = np.concatenate(phone_id_parts).astype(np.intp)
+        self.phone_word_index = np.concatenate(word_index_parts)
 
         # check the reverse way
         # if it is "phones", call the reverse_phones_way function
         if self.reverse == 'phones':
-            self.phone_seq = self.reverse_phones_way(self.phone_seq)            
+            self.phone_ids = self.reverse_phones_way(self.phone_ids)
+            self.phone_word_index = self.phone_word_index[::-1]
 
-        return self.phone_seq
+        return self.phone_ids
 
     # reverse in "phones" way: reverse the order of the phones that will be spoken for the whole utterance
+    # phone_seq is either a list of phone names or an array of phone IDs
     @staticmethod
-    def reverse_phones_way(phone_seq: List[str]) -> List[str]:
-        phone_seq = phone_seq[::-1]  # assign it to the phone_seq for following function
-        # if the input ask for emphasis
-        # swap the "{" and "}"
-        phone_seq_tmp = ['*' if i == '{' else i for i in phone_seq]
-        phone_seq_tmp = ['{' if i == '}' else i for i in phone_seq_tmp]
-        phone_seq_tmp = ['}' if i == '*' else i for i in phone_seq_tmp]
-        phone_seq = phone_seq_tmp
-        return phone_seq
+    def reverse_phones_way(phone_seq: Union[List[str], np.ndarray]) -> Union[List[str], np.ndarray]:
+        if isinstance(phone_seq, np.ndarray):
+            # if the input ask for emphasis, swap the "{" and "}"
+            return SWAP_EMPHASIS[phone_seq[::-1]]
+        return ids_to_phones(SWAP_EMPHASIS[phones_to_ids(phone_seq)[::-1]])
 
     # get the corresponding diphone sequence
     @staticmethod
     def get_diphone_seq(phone_seq: List[str]) -> List[str]:
-        diphone_seq = []  # an empty list to store the diphones
-        # for every phone in the phone seq list, use "-" to link the phone and its following phone
-        # for ",", ".", "{" and "}", remain
-        # for phone just before "{" and "}", use "-" to link the phone and the next phone
-        # then store it to the diphone seq
-        for num in range(len(phone_seq)-1):
-            if (phone_seq[num+1] not in [',', '.', '{', '}']) & (phone_seq[num] not in [',', '.', '{', '}']):
-                diphone_seq.append(phone_seq[num] + '-' + phone_seq[num+1])
-            elif phone_seq[num] in [',', '.', '{', '}']:
-                diphone_seq.append(phone_seq[num])
-            elif phone_seq[num+1] in ['{', '}']:
-                diphone_seq.append(phone_seq[num] + '-' + phone_seq[num+2])
-        return diphone_seq
+        return ids_to_diphones(get_diphone_ids(phones_to_ids(phone_seq)))
+
+    # get the corresponding sequence of diphone IDs of an array of phone IDs
+    # every phone is paired with its following phone through the diphone table, all at once
+    # for ",", ".", "{" and "}", remain
+    # for phone just before "{" and "}", the phone is paired with the next phone
+    @staticmethod
+    def get_diphone_ids(phone_ids: np.ndarray) -> np.ndarray:
+        return get_diphone_ids(phone_ids)
+
+    # get where every word is in the diphone sequence of get_diphone_ids(get_phone_ids())
+    # a word is the run of diphones whose first phone is in the word, as an array of (start, end) rows
+    def get_word_spans(self) -> np.ndarray:
+        _, positions = get_diphone_ids(self.phone_ids, return_positions=True)
+        word_index = self.phone_word_index[positions]
+        starts = np.flatnonzero(np.diff(word_index, prepend=-2) != 0)
+        ends = np.append(starts[1:], len(word_index))
+        is_word = word_index[starts] >= 0
+        return np.stack((starts[is_word], ends[is_word]), axis=1)
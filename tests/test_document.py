@@ -0,0 +1,43 @@
+import io
+
+from document import iter_phrases
+
+
+# the phrases of the text, split as --fromfile has always split them: a phrase up to the last ".", "!", ":" or "?"
+# of every line, and whatever is left at the end (as main.py did before iter_phrases)
+def split_by_lines(text):
+    phrases = []
+    phrase_tmp = ''
+    for line in io.StringIO(text):
+        index_period = max((line.rfind(sign) for sign in '.!?:'))
+        if index_period < 0:
+            phrase_tmp += line
+        else:
+            phrases.append(phrase_tmp + line[:index_period + 1])
+            phrase_tmp = line[index_period + 1:]
+    if phrase_tmp != '':
+        phrases.append(phrase_tmp)
+    return phrases
+
+
+def test_phrases_of_lines():
+    text = 'Hello world. A rose\nby any other name: would smell\nas sweet? The cat\n\nsat on the mat!\n'
+    phrases = list(iter_phrases(io.StringIO(text)))
+    assert phrases == split_by_lines(text)
+    assert phrases == ['Hello world.', ' A rose\nby any other name:', ' would smell\nas sweet?',
+                       ' The cat\n\nsat on the mat!', '\n']
+
+
+# the whitespace left after the last sentence is still given out, as a phrase that gives no audio
+def test_trailing_whitespace_is_kept():
+    assert list(iter_phrases(io.StringIO('The end.\n  \n'))) == ['The end.', '\n  \n']
+    assert list(iter_phrases(io.StringIO('The end.'))) == ['The end.']
+    assert list(iter_phrases(io.StringIO(''))) == []
+
+
+# a long line without any sentence end is split at whitespace, so no phrase is longer than a block
+def test_long_line_is_bounded():
+    text = 'word ' * 1000
+    phrases = list(iter_phrases(io.StringIO(text), block_size=100))
+    assert ''.join(phrases) == text
+    assert max(len(phrase) for phrase in phrases) <= 2 * 100
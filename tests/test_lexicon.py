@@ -0,0 +1,30 @@
+import lexicon
+from lexicon import Lexicon
+
+ENTRIES = [('cat', ['K', 'AE1', 'T']), ('mat', ['M', 'AE1', 'T']), ('sat', ['S', 'AE1', 'T']),
+           ('the', ['DH', 'AH0']), ('the', ['DH', 'IY0'])]
+
+
+def test_lookup():
+    words = Lexicon.from_entries(ENTRIES)
+    assert words['cat'] == ['K', 'AE', 'T']
+    assert words['the'] == ['DH', 'AH']  # the first pronunciation
+    assert 'dog' not in words
+
+
+# the words that are not in the lexicon are never memoised, however many are looked up
+def test_misses_are_not_memoised():
+    words = Lexicon.from_entries(ENTRIES)
+    for num in range(1000):
+        assert words.get_ids('unknown{}'.format(num)) is None
+    assert len(words.lookup_memo) == 0
+
+
+# the memo keeps the words looked up most recently
+def test_memo_is_bounded(monkeypatch):
+    monkeypatch.setattr(lexicon, 'LOOKUP_MEMO', 2)
+    words = Lexicon.from_entries(ENTRIES)
+    for word in ('cat', 'mat', 'cat', 'sat'):
+        words.get_ids(word)
+    assert list(words.lookup_memo) == ['cat', 'sat']
+    assert words['mat'] == ['M', 'AE', 'T']
@@ -0,0 +1,18 @@
+import io
+import sys
+
+import numpy as np
+
+from simpleaudio import WavWriter
+
+
+# "-" writes to the real standard output, even when sys.stdout has been sent elsewhere
+def test_wav_writer_dash_uses_real_stdout(monkeypatch):
+    real_stdout = io.TextIOWrapper(io.BytesIO())
+    monkeypatch.setattr(sys, '__stdout__', real_stdout)
+    monkeypatch.setattr(sys, 'stdout', io.TextIOWrapper(io.BytesIO()))
+    with WavWriter('-', 16000) as writer:
+        writer.write(np.arange(10, dtype=np.int16))
+    audio = real_stdout.buffer.getvalue()
+    assert audio.startswith(b'RIFF') and audio.endswith(np.arange(10, dtype='<i2').tobytes())
+    assert sys.stdout.buffer.getvalue() == b''
@@ -0,0 +1,55 @@
+import argparse
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic_voice import make_synthetic_voice
+from lexicon import Lexicon
+from synth import Synth, SynthOptions, Utterance
+
+ENTRIES = [('the', ['DH', 'AH0']), ('cat', ['K', 'AE1', 'T']), ('sat', ['S', 'AE1', 'T']), ('on', ['AA1', 'N']),
+           ('mat', ['M', 'AE1', 'T']), ('hello', ['HH', 'AH0', 'L', 'OW1']), ('world', ['W', 'ER1', 'L', 'D']),
+           ('c', ['S', 'IY1']), ('a', ['EY1']), ('t', ['T', 'IY1'])]
+PHRASES = ['Hello world, the cat sat on the mat.', 'The {cat} sat.', '{Hello, world.} The mat.']
+OPTIONS = [SynthOptions(), SynthOptions(crossfade=True), SynthOptions(reverse='words'),
+           SynthOptions(reverse='signal', crossfade=True), SynthOptions(spell=True), SynthOptions(volume=30),
+           SynthOptions(speaking_rate=0.75), SynthOptions(speaking_rate=1.5, crossfade=True),
+           SynthOptions(emphasis=True)]
+CASES = [(phrase, options) for phrase in PHRASES for options in OPTIONS]
+
+
+# one Synth of a synthetic voice, with and without a word cache, shared by all the threads of a test
+@pytest.fixture(scope='module', params=[None, 8], ids=['no word cache', 'word cache'])
+def synth(request, tmp_path_factory):
+    folder = tmp_path_factory.getbasetemp() / 'diphones'
+    if not folder.exists():
+        make_synthetic_voice(str(folder))
+    args = argparse.Namespace(diphones=str(folder), crossfade=False, reverse=None, word_cache=request.param)
+    return Synth(args, lexicon=Lexicon.from_entries(ENTRIES))
+
+
+# synthesise the phrase with the options, as a whole or streamed in chunks
+def synthesise(synth, phrase, options, streamed):
+    utt = Utterance(phrase, spell=options.spell, reverse=options.reverse, lexicon=synth.lexicon)
+    diphone_seq, word_spans = utt.get_diphone_ids(utt.get_phone_ids()), utt.get_word_spans()
+    if streamed:
+        chunks = synth.iter_audio(diphone_seq, word_spans=word_spans, gain=options.get_gain(), options=options)
+        return np.concatenate(list(chunks))
+    return synth.get_output_audio_of_diphone_seq(diphone_seq, word_spans, gain=options.get_gain(),
+                                                 options=options).data
+
+
+# every request synthesised by threads sharing the Synth gives the audio it gives when it is synthesised alone
+@pytest.mark.parametrize('streamed', [False, True], ids=['whole', 'streamed'])
+def test_threads_with_mixed_options(synth, streamed):
+    expected = [synthesise(synth, phrase, options, streamed) for phrase, options in CASES]
+    assert len({audio.tobytes() for audio in expected}) > len(PHRASES)  # the options do change the audio
+    rng = random.Random(0)
+    tasks = [rng.randrange(len(CASES)) for _ in range(8 * len(CASES))]
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda num: synthesise(synth, *CASES[num], streamed), tasks))
+    for num, audio in zip(tasks, results):
+        assert np.array_equal(audio, expected[num]), CASES[num]
+    assert synth.options == SynthOptions()  # and the Synth is never changed
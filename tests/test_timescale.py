@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from timescale import time_stretch
+
+RATE = 48000
+
+
+# a steady sine of the amplitude, two seconds long
+def make_sine(frequency, amplitude=10000.0, seconds=2.0):
+    return amplitude * np.sin(2 * np.pi * frequency * np.arange(int(RATE * seconds)) / RATE)
+
+
+# the level of the middle half of a signal in dB, relative to a sine of the amplitude
+def get_level(samples, amplitude=10000.0):
+    middle = samples[len(samples) // 4:3 * len(samples) // 4]
+    return 20 * np.log10(np.sqrt(np.mean(middle ** 2)) / (amplitude / np.sqrt(2)))
+
+
+@pytest.mark.parametrize('rate', [0.5, 0.75, 1.0, 1.25, 2.0])
+def test_length_follows_rate(rate):
+    samples = make_sine(440)
+    assert len(time_stretch(samples, rate)) == round(len(samples) / rate)
+
+
+@pytest.mark.parametrize('frequency', [187.5, 440, 1000])
+@pytest.mark.parametrize('rate', [0.5, 0.75, 2.0])
+def test_stationary_sine_keeps_its_level(rate, frequency):
+    assert abs(get_level(time_stretch(make_sine(frequency), rate))) < 0.5
+
+
+@pytest.mark.parametrize('rate', [0.5, 2.0])
+def test_stationary_sine_keeps_its_pitch(rate):
+    output = time_stretch(make_sine(1000), rate)
+    middle = output[len(output) // 4:3 * len(output) // 4]
+    spectrum = np.abs(np.fft.rfft(middle * np.hanning(len(middle))))
+    peak = np.fft.rfftfreq(len(middle), 1 / RATE)[np.argmax(spectrum)]
+    assert abs(peak - 1000) < 5
+
+
+def test_blocks_give_the_same_output():
+    samples = np.random.RandomState(0).randn(100000) * 3000
+    whole = time_stretch(samples, 0.75, block_size=None)
+    assert np.allclose(time_stretch(samples, 0.75, block_size=3000), whole, atol=1e-3)
@@ -0,0 +1,161 @@
+from typing import Optional
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+WINDOW_SIZE = 1024  # the samples in a frame
+HOP = 256  # the samples between the starts of two output frames
+STREAM_BLOCK = 65536  # the samples given to the time stretcher at once by time_stretch
+MIN_RATE = 0.5  # the slowest speaking rate, half as fast
+MAX_RATE = 2.0  # the fastest speaking rate, twice as fast
+
+
+# change how fast a signal goes without changing its pitch, with a phase vocoder
+# rate 2.0 makes it twice as fast (half as long), 0.5 twice as slow
+# an output frame is made every hop samples from the frames of the input at every rate * hop samples:
+# its magnitudes are interpolated between the two input frames around it, and the phase of every bin carries on
+# from the last output frame by the turn measured between those input frames, with the bins around every peak
+# locked to it (see lock_phase)
+# the signal goes in and comes out a block at a time, so long inputs are stretched in bounded memory,
+# and all the frames a block makes possible are transformed at once (one rfft and one irfft)
+class TimeStretcher:
+    def __init__(self, rate: float, window_size: int=WINDOW_SIZE, hop: int=HOP, window: bool=True) -> None:
+        if rate <= 0:
+            raise ValueError('the rate should be above 0')
+        if window_size % hop or window_size < 2 * hop:
+            raise ValueError('the window size should be a multiple of the hop, and at least twice as long')
+        self.rate = rate
+        self.window_size = window_size
+        self.hop = hop
+        # a periodic Hann window (or none), applied to the frames before and after the transforms
+        self.window = np.hanning(window_size + 1)[:-1] if window else np.ones(window_size)
+        # the sum of the squared windows that overlap at every sample of a hop, which the overlap-add is divided by
+        self.norm = (self.window ** 2).reshape(-1, hop).sum(axis=0)
+        # how much the phase of every bin turns in a hop
+        self.hop_advance = 2 * np.pi * hop * np.arange(window_size // 2 + 1) / window_size
+        # the input not used up yet, starting with zeros so that the first samples are overlapped as much as the rest
+        padding = window_size - hop
+        self.pending = np.zeros(padding)
+        self.first_frame = 0  # the frame that starts at the beginning of pending
+        self.steps = 0  # the output frames made so far
+        self.phase = None  # the phase of every bin of the next output frame
+        self.tail = np.zeros(padding)  # the end of the output frames made so far, which the next ones overlap
+        self.skip = padding  # the output samples of the zeros at the beginning, which are thrown away
+        self.samples_in = 0
+        self.samples_out = 0
+
+    # stretch the next block of the signal, and return the output that is complete
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        self.samples_in += len(samples)
+        self.pending = np.concatenate((self.pending, samples))
+        return self.trim(self.run())
+
+    # stretch what is left of the signal, and return the end of the output
+    # the whole output is round(samples in / rate) samples long
+    def flush(self) -> np.ndarray:
+        # enough zeros for the last frames to be complete, however far apart they are in the input
+        self.pending = np.concatenate((self.pending, np.zeros(int(np.ceil((self.rate + 1) * self.window_size)))))
+        output = self.trim(self.run())
+        target = int(round(self.samples_in / self.rate))
+        left = target - (self.samples_out - len(output))
+        self.samples_out = target
+        if left > len(output):
+            return np.concatenate((output, np.zeros(left - len(output))))
+        return output[:left]
+
+    # make every output frame whose two input frames are complete, and overlap-add them
+    def run(self) -> np.ndarray:
+        hop = self.hop
+        # one past the last frame that is complete in pending
+        last = self.first_frame + (len(self.pending) - self.window_size) // hop + 1
+        # the output frame at a position t (in input frames) needs the frames floor(t) and floor(t) + 1
+        end_step = max(self.steps, int(np.ceil((last - 1) / self.rate)))
+        positions = np.arange(self.steps, end_step) * self.rate
+        positions = positions[np.floor(positions) + 1 < last]
+        if not len(positions):
+            return np.empty(0)
+        frame_index = np.floor(positions).astype(np.intp)
+        fraction = (positions - frame_index)[:, None]
+        first = frame_index[0] - self.first_frame
+        count = frame_index[-1] - frame_index[0] + 2
+        frames = sliding_window_view(self.pending, self.window_size)[first * hop:(first + count - 1) * hop + 1:hop]
+        spectra = np.fft.rfft(frames * self.window, axis=1)
+        magnitude = np.abs(spectra)
+        angle = np.angle(spectra)
+
+        before = frame_index - frame_index[0]
+        after = before + 1
+        magnitude = (1 - fraction) * magnitude[before] + fraction * magnitude[after]
+        # the turn of every bin from one frame to the next, wrapped around the turn expected from its frequency
+        deviation = angle[after] - angle[before] - self.hop_advance
+        deviation -= 2 * np.pi * np.round(deviation / (2 * np.pi))
+        advance = self.hop_advance + deviation
+        if self.phase is None:
+            self.phase = angle[before[0]]
+        # the phase of every output frame is the phase of the one before plus its turn
+        phase = self.phase + np.cumsum(advance, axis=0) - advance
+        self.phase = np.mod(phase[-1] + advance[-1], 2 * np.pi)
+        phase = lock_phase(phase, magnitude, angle[before])
+        output_frames = np.fft.irfft(magnitude * np.exp(1j * phase), n=self.window_size, axis=1) * self.window
+
+        self.steps += len(positions)
+        # the frames before the one the next output frame starts from are not needed any more
+        drop = int(np.floor(self.steps * self.rate)) - self.first_frame
+        if drop > 0:
+            self.pending = self.pending[drop * hop:]
+            self.first_frame += drop
+        return self.overlap_add(output_frames)
+
+    # add up the output frames, each hop samples after the one before, and return the samples they complete
+    def overlap_add(self, frames: np.ndarray) -> np.ndarray:
+        hop = self.hop
+        count = len(frames)
+        output = np.zeros((count + self.window_size // hop - 1) * hop)
+        output[:len(self.tail)] = self.tail
+        # one addition of a hop's worth of every frame at a time, so the loop is over the overlaps, not the frames
+        hops = output.reshape(-1, hop)
+        for i in range(self.window_size // hop):
+            hops[i:i + count] += frames[:, i * hop:(i + 1) * hop]
+        self.tail = output[count * hop:]
+        return (hops[:count] / self.norm).reshape(-1)
+
+    # throw away the output of the zeros at the beginning
+    def trim(self, output: np.ndarray) -> np.ndarray:
+        if self.skip:
+            skipped = min(self.skip, len(output))
+            output = output[skipped:]
+            self.skip -= skipped
+        self.samples_out += len(output)
+        return output
+
+
+# identity phase locking: only the peaks of the magnitude of every frame keep the phase carried on from frame to
+# frame, and the bins around a peak (up to half way to the next one) keep the phase differences they have to it in
+# the input frame (analysis_phase), so the bins of one sinusoid stay in phase with each other instead of partly
+# cancelling out (which made stretched audio quieter, by up to 6 dB at half speed)
+# a peak is above the two bins on either side of it, frames without any peak are left as they are
+def lock_phase(phase: np.ndarray, magnitude: np.ndarray, analysis_phase: np.ndarray) -> np.ndarray:
+    bins = magnitude.shape[1]
+    padded = np.pad(magnitude, ((0, 0), (2, 2)))
+    peaks = np.ones(magnitude.shape, dtype=bool)
+    for offset in (0, 1, 3, 4):
+        peaks &= magnitude > padded[:, offset:offset + bins]
+    # the nearest peak at or below every bin, and at or above it
+    index = np.arange(bins)
+    below = np.maximum.accumulate(np.where(peaks, index, -bins), axis=1)
+    above = np.minimum.accumulate(np.where(peaks, index, 2 * bins)[:, ::-1], axis=1)[:, ::-1]
+    nearest = np.where(index - below <= above - index, below, above)
+    has_peak = peaks.any(axis=1)
+    nearest[~has_peak] = index
+    rows = np.arange(len(phase))[:, None]
+    return phase[rows, nearest] + analysis_phase - analysis_phase[rows, nearest]
+
+
+# stretch a whole signal (see TimeStretcher), a block at a time, and return the float output
+def time_stretch(data: np.ndarray, rate: float, window_size: int=WINDOW_SIZE, hop: int=HOP, window: bool=True,
+                 block_size: Optional[int]=STREAM_BLOCK) -> np.ndarray:
+    stretcher = TimeStretcher(rate, window_size, hop, window)
+    block_size = block_size or max(len(data), 1)
+    output = [stretcher.process(data[start:start + block_size]) for start in range(0, len(data), block_size)]
+    output.append(stretcher.flush())
+    return np.concatenate(output)
@@ -0,0 +1,62 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Hashable, Optional
+
+import numpy as np
+
+
+# a cache of the assembled samples of words, with a budget of bytes
+# when the budget is used up, the words used least recently are evicted first
+class WordCache:
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.nbytes = 0  # the bytes held by the cached samples
+        self.words = OrderedDict()  # key -> samples, the least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    # get the cached samples of the key, None if they are not cached
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        with self.lock:
+            samples = self.words.get(key)
+            if samples is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.words.move_to_end(key)
+            return samples
+
+    # cache the samples of the key, evicting the words used least recently until they fit in the budget
+    def put(self, key: Hashable, samples: np.ndarray) -> None:
+        if samples.nbytes > self.max_bytes:
+            return
+        # the cached samples are shared, so make sure nobody changes them
+        samples.flags.writeable = False
+        with self.lock:
+            old_samples = self.words.pop(key, None)
+            if old_samples is not None:
+                self.nbytes -= old_samples.nbytes
+            self.words[key] = samples
+            self.nbytes += samples.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted_samples = self.words.popitem(last=False)
+                self.nbytes -= evicted_samples.nbytes
+                self.evictions += 1
+
+    # the counters of the cache
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'words': len(self.words), 'bytes': self.nbytes}
+
+    # a one line summary of the counters
+    def describe(self) -> str:
+        stats = self.stats()
+        return 'Word cache: {} hits, {} misses, {} evictions, {} words ({:.1f} of {:.1f} MB)'.format(
+            stats['hits'], stats['misses'], stats['evictions'], stats['words'],
+            stats['bytes'] / 2**20, self.max_bytes / 2**20)
+
+    def __len__(self) -> int:
+        return len(self.words)